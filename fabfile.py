@@ -11,6 +11,7 @@
 #
 #   * fab release: update this package on pypi
 #   * fab version_bump: bump the package version
+#   * fab bench: run the micro-benchmarks in tests/benchmarks
 
 #
 import os
@@ -69,6 +70,17 @@ def test():
                   '--pyargs ./tests')
 
 
+@api.task
+def bench():
+    """ run the micro-benchmarks in tests/benchmarks """
+    bench_dir = os.path.join(ldir, 'tests', 'benchmarks')
+    with api.lcd(ldir):
+        for fname in sorted(os.listdir(bench_dir)):
+            if fname.startswith('bench_') and fname.endswith('.py'):
+                api.local('python -m tests.benchmarks.{0}'.format(
+                    fname[:-len('.py')]))
+
+
 @api.task
 def vulture():
     with api.lcd(os.path.dirname(__file__)):
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+""" tests.benchmarks
+
+    micro-benchmarks for ymir hot paths.  these are not collected
+    by py.test, run them individually or with `fab bench`, e.g.:
+
+        $ python -m tests.benchmarks.bench_templating
+"""
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+""" tests.benchmarks.bench_json
+
+    compares demjson with ymir.util.jsonc, for the skeleton
+    files and for a generated 5,000 line service.json
+"""
+from __future__ import print_function
+
+import os
+import glob
+
+import demjson
+
+from ymir.util import jsonc
+from tests import common as test_common
+from tests.benchmarks import common
+
+
+def commented_service_json(lines=5000):
+    """ a large service.json in the same style as the skeleton:
+        commented, with single quotes and trailing commas
+    """
+    json = common.large_service_json(size=10)
+    out = ['//', '// generated service.json', '//', '{']
+    for key, value in sorted(json.items()):
+        if key == 'service_defaults':
+            continue
+        out.append('    // {0}'.format(key))
+        out.append('    "{0}": {1},'.format(key, demjson.encode(value)))
+    out.append('    "service_defaults": {')
+    for i in range((lines - len(out)) // 2):
+        out.append('        // default number {0}'.format(i))
+        out.append("        'var{0}': 'value{0}',".format(i))
+    out += ['    },', '}']
+    return '\n'.join(out)
+
+
+def bench_decode(label, text):
+    print(label + ':')
+    assert jsonc.decode(text) == demjson.decode(text)
+    before = common.timeit('demjson', lambda: demjson.decode(text), number=3)
+    after = common.timeit('jsonc', lambda: jsonc.decode(text), number=3)
+    common.report_speedup(before, after)
+
+
+if __name__ == '__main__':
+    for fname in sorted(glob.glob(
+            os.path.join(test_common.skeleton_dir, '*.json'))):
+        with open(fname) as fhandle:
+            bench_decode(os.path.basename(fname), fhandle.read())
+    text = commented_service_json()
+    bench_decode('generated ({0} lines)'.format(
+        text.count('\n') + 1), text)
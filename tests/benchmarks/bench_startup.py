@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+""" tests.benchmarks.bench_startup
+
+    import-time budget for the `ymir` command line tool and for the
+    ansible inventory script.  exits nonzero when a budget is exceeded,
+    so that `fab bench` fails when startup gets slower.
+
+    python 2.7 has no `-X importtime`, so each import is timed
+    in a fresh interpreter instead
+"""
+from __future__ import print_function
+
+import sys
+import subprocess
+
+# module(s) -> seconds.  the budget is checked against
+# the best of several runs, to smooth out disk-cache noise
+IMPORT_BUDGET = [
+    # what `ymir version` and `ymir help` import
+    ['ymir.bin._ymir', 0.1],
+    # what skeleton/ansible/ymir_inventory.py imports
+    ['ymir.api, ymir.service', 0.6],
+]
+
+# these should never be imported just to parse the command line
+HEAVY_MODULES = [
+    'boto', 'demjson', 'fabric', 'voluptuous', 'vagrant',
+    'testinfra', 'requests', 'werkzeug', 'jinja2', 'ansible']
+
+TIMER = ("import time; start = time.time(); import {0}; "
+         "print(time.time() - start)")
+
+LOADED = ("import sys; import {0}; "
+          "print(' '.join(name for name in {1!r} "
+          "if type(sys.modules.get(name)) is type(sys)))")
+
+
+def import_time(modules, number=5):
+    """ best time, in seconds, to import `modules` in a new interpreter """
+    return min(
+        float(subprocess.check_output(
+            [sys.executable, '-c', TIMER.format(modules)]).split()[-1])
+        for _ in range(number))
+
+
+def heavy_imports(modules):
+    """ which of HEAVY_MODULES get imported along with `modules` """
+    return subprocess.check_output(
+        [sys.executable, '-c', LOADED.format(modules, HEAVY_MODULES)]
+    ).split()
+
+
+if __name__ == '__main__':
+    print('import times:')
+    over_budget = []
+    for modules, budget in IMPORT_BUDGET:
+        seconds = import_time(modules)
+        print('  {0:<40} {1:>10.2f} ms  (budget: {2:.0f} ms)'.format(
+            modules, seconds * 1000, budget * 1000))
+        if seconds > budget:
+            over_budget.append(modules)
+    heavy = heavy_imports('ymir.bin._ymir')
+    if heavy:
+        print('  ymir.bin._ymir imports: ' + ', '.join(heavy))
+    if over_budget or heavy:
+        raise SystemExit('import budget exceeded: ' +
+                         ', '.join(over_budget + heavy))
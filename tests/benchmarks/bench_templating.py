@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+""" tests.benchmarks.bench_templating
+
+    shows the effect of the compiled-template cache
+    in ymir.api.str_reflect, and of memoizing template_data
+"""
+from __future__ import print_function
+
+import contextlib
+
+from ymir import api as yapi
+from tests import common as test_common
+from tests.benchmarks import common
+
+
+@contextlib.contextmanager
+def without_template_cache():
+    """ the behaviour of str_reflect before templates were cached """
+    orig = yapi._get_template, yapi._is_template
+    yapi._get_template = yapi.jinja_env.from_string
+    yapi._is_template = lambda obj: True
+    try:
+        yield
+    finally:
+        yapi._get_template, yapi._is_template = orig
+
+
+def bench_reflect(json):
+    print('_reflect:')
+    with without_template_cache():
+        before = common.timeit('uncached', lambda: yapi._reflect(json))
+    after = common.timeit('cached', lambda: yapi._reflect(json))
+    common.report_speedup(before, after)
+
+
+@test_common.mock_aws
+def bench_template_data(json):
+    print('_template_data:')
+    with common.service_json_file(json) as fname:
+        service = yapi.load_service_from_json(fname, quiet=True)
+        # compute the status once, so only rendering is measured
+        service.template_data()
+        with without_template_cache():
+            before = common.timeit('uncached', service._template_data)
+        after = common.timeit('cached', service._template_data)
+        common.report_speedup(before, after)
+        print('template_data:')
+        memo = common.timeit('memoized', service.template_data)
+    common.report_speedup(after, memo)
+
+
+if __name__ == '__main__':
+    json = common.large_service_json()
+    bench_reflect(json)
+    bench_template_data(json)
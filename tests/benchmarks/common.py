@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+""" tests.benchmarks.common
+"""
+from __future__ import print_function
+
+import os
+import time
+import contextlib
+
+import demjson
+
+from ymir.util import TemporaryDirectory
+from tests import common as test_common
+
+
+def large_service_json(size=200):
+    """ returns the skeleton service.json, padded out with
+        `size` entries in each of the templated lists
+    """
+    json = demjson.decode_file(test_common.skeleton_json_path)
+    json['service_defaults'] = dict(
+        ['var{0}'.format(i), 'value{0}'.format(i)] for i in range(size))
+    json['provision_list'] = [
+        'remote://echo {{name}} {{var%s}} > /tmp/%s' % (i, i)
+        for i in range(size)]
+    json['provision_list'] += [
+        'local://make target{0}'.format(i) for i in range(size)]
+    json['setup_list'] = [
+        'ansible-role://role{0}'.format(i) for i in range(size)]
+    json['health_checks'] = dict(
+        ['check{0}'.format(i),
+         'http_200://http://{{host}}/path%s' % i] for i in range(size))
+    return json
+
+
+@contextlib.contextmanager
+def service_json_file(json):
+    """ writes the given json to a temporary service root """
+    with TemporaryDirectory() as tmp_dir:
+        fname = os.path.join(tmp_dir, 'service.json')
+        with open(fname, 'w') as fhandle:
+            fhandle.write(demjson.encode(json))
+        yield fname
+
+
+def timeit(label, fxn, number=10):
+    """ runs `fxn` several times and prints the mean runtime """
+    start = time.time()
+    for _ in range(number):
+        fxn()
+    mean = (time.time() - start) / number
+    print('  {0:<40} {1:>10.2f} ms'.format(label, mean * 1000))
+    return mean
+
+
+def report_speedup(before, after):
+    print('  {0:<40} {1:>10.1f} x'.format('speedup', before / after))
@@ -26,6 +26,8 @@ def fake_aws_conn():
     """ """
     conn = mock.Mock()
     conn.get_all_security_groups.return_value = []
+    conn.get_only_instances.return_value = []
+    conn.region.name = 'us-east-1'
     fake_sg = mock.Mock()
     fake_sg.rules = []
     conn.create_security_group.return_value = fake_sg
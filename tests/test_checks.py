@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 """
 """
+import os
+import threading
+import time
+
 import mock
 import pytest
 import requests
 
+from ymir import util
 from ymir import checks
 from .common import mock_service
 
@@ -84,3 +89,209 @@ test_301 = _test_factory(301)
 test_401 = _test_factory(401)
 test_403 = _test_factory(403)
 test_200 = _test_factory(200)
+
+
+def _checks(*names):
+    return [checks.Check(name=name, check_type='http_200', url_t=name)
+            for name in names]
+
+
+@mock.patch('ymir.checks.http_200')
+def test_run_checks_keeps_order(checker):
+    checker.side_effect = lambda service, url: (url, url != 'b', url)
+    results = checks.run_checks(mock_service(), _checks('a', 'b', 'c'))
+    assert [c.name for c in results] == ['a', 'b', 'c']
+    assert [c.success for c in results] == [True, False, True]
+    assert [c.message for c in results] == ['a', 'b', 'c']
+
+
+@mock.patch('ymir.checks.http_200')
+def test_run_checks_deadline(checker):
+    def slow(service, url):
+        if url == 'slow':
+            time.sleep(2)
+        return url, True, ''
+    checker.side_effect = slow
+    results = checks.run_checks(
+        mock_service(), _checks('fast', 'slow'), deadline=1)
+    assert results[0].success
+    assert results[1].failed
+    assert 'deadline' in results[1].message
+
+
+@mock.patch('ymir.checks.http_200')
+def test_run_checks_failfast(checker):
+    def fail_first(service, url):
+        if url != 'bad':
+            time.sleep(2)
+        return url, url != 'bad', ''
+    checker.side_effect = fail_first
+    start = time.time()
+    results = checks.run_checks(
+        mock_service(), _checks('bad', 'slow'), failfast=True, deadline=0)
+    assert time.time() - start < 2
+    assert results[0].failed
+    assert 'cancelled' in results[1].message
+
+
+@mock.patch.dict(checks.session_cache, clear=True)
+def test_sessions_are_pooled_per_host():
+    session = checks._get_session('http://example.com/foo')
+    assert checks._get_session('http://example.com/bar') is session
+    assert checks._get_session('https://example.com/foo') is not session
+    assert checks._get_session('http://example.org/foo') is not session
+    retries = session.get_adapter('http://example.com/').max_retries
+    assert retries.connect == 2 and retries.read == 0
+
+
+@mock.patch('ymir.checks._get_request')
+def test_http_check_options(request_mock):
+    request_mock.return_value = mock.Mock(status_code=301)
+    check = checks.Check(
+        name='test-options', check_type='http_301', url_t='',
+        options=dict(timeout=3, allow_redirects=False))
+    assert check.run(mock_service()).success
+    request_mock.assert_called_with('', timeout=3, allow_redirects=False)
+
+
+def _get(pool, host, ssh_config='config'):
+    """ leases a backend, and releases it right away """
+    with pool.lease((host, '22', 'ubuntu', 'key.pem'), ssh_config) as backend:
+        return backend
+
+
+@mock.patch('ymir.checks.testinfra_mod')
+def test_backend_pool(testinfra_mod):
+    testinfra_mod.get_backend.side_effect = lambda *a, **k: mock.Mock()
+    pool = checks.BackendPool(size=2, idle_check=0)
+    first = _get(pool, 'host1')
+    config_file = testinfra_mod.get_backend.call_args[1]['ssh_config']
+    assert open(config_file).read() == 'config'
+    assert _get(pool, 'host1') is first
+    assert testinfra_mod.get_backend.call_count == 1
+    # dead transports are dropped, so testinfra reconnects
+    client = first._client
+    client.get_transport.return_value.is_active.return_value = False
+    _get(pool, 'host1')
+    assert client.close.called
+    # the least recently used backend is closed to make room
+    _get(pool, 'host2')
+    _get(pool, 'host3')
+    assert len(pool) == 2
+    assert not os.path.exists(config_file)
+    pool.clear()
+    assert len(pool) == 0
+    assert pool._key_locks == {}
+
+
+@mock.patch('ymir.checks.testinfra_mod')
+def test_backend_pool_closes_evicted_backends_after_release(testinfra_mod):
+    testinfra_mod.get_backend.side_effect = lambda *a, **k: mock.Mock()
+    pool = checks.BackendPool(size=1, idle_check=0)
+    with pool.lease(('host1', '22', 'ubuntu', 'key.pem'), 'config') as first:
+        client = first._client
+        config_file = testinfra_mod.get_backend.call_args[1]['ssh_config']
+        # evicted while still in use, so it stays open for now
+        _get(pool, 'host2')
+        assert len(pool) == 1
+        assert not client.close.called
+        assert os.path.exists(config_file)
+    assert client.close.called
+    assert not os.path.exists(config_file)
+    pool.clear()
+
+
+def test_testinfra_namespace_is_lazy():
+    backend = mock.Mock()
+    namespace = checks._TestinfraNamespace(backend)
+    assert not backend.get_module.called
+    exec('assert File and len([1])', {}, namespace)
+    backend.get_module.assert_called_once_with('File')
+    with pytest.raises(KeyError):
+        namespace['NotATestinfraModule']
+
+
+def test_remote_check_script():
+    import json
+    import subprocess
+    with util.TemporaryDirectory() as tmp_dir:
+        fname = os.path.join(tmp_dir, 'some file')
+        with open(fname, 'w') as fhandle:
+            fhandle.write('hello world')
+        check_objs = [
+            checks.Check('a', 'file-exists', fname),
+            checks.Check('b', 'file_exists', fname + '.missing'),
+            checks.Check('c', 'file-contains', fname + ',world'),
+            checks.Check('d', 'file-contains', fname + ',missing'),
+            checks.Check('e', 'socket_listening', 'tcp://22'), ]
+        script = checks.remote_check_script(check_objs)
+        result = json.loads(subprocess.check_output(['sh', '-c', script]))
+    assert result['results'] == {'0': True, '1': False, '2': True, '3': False}
+    assert 'netstat' in result
+
+
+def test_socket_listening_from_netstat():
+    netstat = '\n'.join([
+        'Proto Recv-Q Send-Q Local Address  Foreign Address  State',
+        'tcp        0      0 0.0.0.0:22     0.0.0.0:*        LISTEN',
+        'tcp6       0      0 :::22          :::*             LISTEN',
+        'tcp        0      0 127.0.0.1:80   0.0.0.0:*        LISTEN', ])
+    listening = checks._socket_listening_from_netstat
+    assert listening('tcp://22', netstat)
+    assert listening('tcp://127.0.0.1:80', netstat)
+    assert not listening('tcp://80', netstat)
+    assert not listening('udp://22', netstat)
+
+
+@mock.patch('ymir.checks._testinfra_backend')
+@mock.patch('ymir.checks.http_200')
+def test_run_checks_batches_remote_checks(checker, get_backend):
+    checker.side_effect = lambda service, url: (url, True, '')
+    backend = get_backend.return_value.__enter__.return_value
+    backend.run.return_value = mock.Mock(
+        rc=0, stdout='motd\n{"uname": "Linux", "netstat": "", '
+                     '"results": {"0": true, "1": false}}\n')
+    check_objs = [
+        checks.Check('a', 'http_200', 'http://foo'),
+        checks.Check('b', 'file-exists', '/etc/passwd'),
+        checks.Check('c', 'file_contains', '/etc/passwd,foo'),
+        checks.Check('d', 'file_contains', 'malformed'),
+        checks.Check('e', 'socket-listening', 'tcp://22'), ]
+    results = checks.run_checks(mock_service(), check_objs, quiet=True)
+    assert backend.run.call_count == 1
+    assert [c.success for c in results] == [True, True, False, False, False]
+    assert results[3].message == 'malformed check'
+
+
+@mock.patch('ymir.checks.testinfra_mod')
+def test_backend_pool_connects_hosts_concurrently(testinfra_mod):
+    """ a slow connection to one host doesn't hold up other hosts,
+        and concurrent checks against one host share a backend
+    """
+    connecting = threading.Event()
+    release = threading.Event()
+
+    def backend(*args, **kargs):
+        out = mock.Mock()
+        if 'slow' in open(kargs['ssh_config']).read():
+            type(out).client = mock.PropertyMock(
+                side_effect=lambda: connecting.set() or release.wait(5))
+        return out
+    testinfra_mod.get_backend.side_effect = backend
+    pool = checks.BackendPool(size=4)
+    results = []
+    slow = [threading.Thread(target=lambda: results.append(
+        _get(pool, 'slow', 'slow')))
+        for _ in range(2)]
+    for thread in slow:
+        thread.start()
+    assert connecting.wait(5)
+    start = time.time()
+    _get(pool, 'fast', 'fast')
+    assert time.time() - start < 2
+    release.set()
+    for thread in slow:
+        thread.join(5)
+    assert len(results) == 2 and results[0] is results[1]
+    assert testinfra_mod.get_backend.call_count == 2
+    pool.clear()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+""" tests.test_dag
+"""
+import time
+import threading
+
+import pytest
+
+from ymir import dag
+from ymir.data import BadProvisionInstruction
+
+
+def test_plan_defaults_to_declaration_order():
+    steps = dag.plan(['puppet://a.pp', 'remote://ls'])
+    assert [s.name for s in steps] == ['0', '1']
+    assert [s.after for s in steps] == [[], ['0']]
+    assert steps[1].instruction == 'remote://ls'
+
+
+def test_plan_with_annotations():
+    steps = dag.plan([
+        '[assets] local://make assets',
+        '[roles after=] ansible_role://nginx',
+        'remote://ls',
+        '[deploy after=assets,roles] puppet://deploy.pp', ])
+    assert [s.name for s in steps] == ['assets', 'roles', '2', 'deploy']
+    assert [s.after for s in steps] == [
+        [], [], ['roles'], ['assets', 'roles']]
+    assert steps[0].instruction == 'local://make assets'
+    for bad in [['[a after=b] remote://ls', '[b] remote://ls'],
+                ['[a] remote://ls', '[a] remote://pwd'],
+                ['[a after] remote://ls']]:
+        with pytest.raises(BadProvisionInstruction):
+            dag.plan(bad)
+
+
+def test_steps_run_in_order_in_calling_thread():
+    """ fabric's env is process-global, so only background
+        steps may run on other threads
+    """
+    steps = dag.plan([
+        '[a after=] remote://a', '[b after=] remote://b',
+        '[c after=a,b] remote://c'])
+    ran = []
+
+    def fxn(step):
+        ran.append((step.name, threading.current_thread().name))
+        return step.name.upper()
+    done = []
+    results = dag.run_steps(
+        steps, fxn, workers=2,
+        on_done=lambda step, result: done.append((step.name, result)))
+    assert results == dict(a='A', b='B', c='C')
+    assert done == [('a', 'A'), ('b', 'B'), ('c', 'C')]
+    assert ran == [(name, threading.current_thread().name)
+                   for name in 'abc']
+    assert all(s.seconds is not None for s in steps)
+    assert len(dag.timing_report(steps)) == 3
+
+
+def test_run_steps_failure_stops_new_steps():
+    steps = dag.plan([
+        '[bg background] local://sleep', '[a] remote://a',
+        '[b] remote://b'])
+    ran = []
+
+    def fxn(step):
+        ran.append(step.name)
+        if step.name == 'a':
+            raise SystemExit('aborted')
+        if step.background:
+            time.sleep(0.2)
+    with pytest.raises(SystemExit):
+        dag.run_steps(steps, fxn, workers=2)
+    # the background step still finished
+    assert sorted(ran) == ['a', 'bg']
+    assert steps[0].seconds >= 0.2
+
+
+def test_background_failure_is_raised():
+    steps = dag.plan([
+        '[bg background] local://false', '[a] remote://a',
+        '[b after=bg] remote://b'])
+    ran = []
+
+    def fxn(step):
+        ran.append(step.name)
+        if step.background:
+            raise SystemExit('background failed')
+    with pytest.raises(SystemExit):
+        dag.run_steps(steps, fxn)
+    assert 'b' not in ran
+
+
+def test_background_steps():
+    steps = dag.plan([
+        '[assets background] local://sleep 1',
+        '[puppet] remote://a',
+        '[deploy after=assets] remote://b', ])
+    assert [s.after for s in steps] == [[], [], ['assets']]
+    assert steps[0].background
+    finished = []
+
+    def fxn(step):
+        time.sleep(1 if step.background else 0.5)
+        finished.append(step.name)
+    start = time.time()
+    dag.run_steps(steps, fxn, workers=1)
+    # puppet overlaps with assets, and deploy waits for assets
+    assert time.time() - start < 2
+    assert finished == ['puppet', 'assets', 'deploy']
+    assert '(background)' in dag.timing_report(steps)[0]
+    for bad in ['[x background] remote://ls', '[x nope] local://ls']:
+        with pytest.raises(BadProvisionInstruction):
+            dag.plan([bad])
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+""" tests.test_events
+"""
+import os
+import json
+import socket
+from StringIO import StringIO
+
+import mock
+import pytest
+from fabric import api
+
+from ymir import events
+from ymir import checks
+from ymir import data as ydata
+import tests.common as test_common
+
+
+@pytest.fixture
+def recorded():
+    """ events emitted during the test """
+    out = []
+    events.set_sinks([out.append])
+    yield out
+    events.set_sinks(None)
+
+
+def test_parse_sinks(tmpdir):
+    path = os.path.join(str(tmpdir), 'logs', 'events.jsonl')
+    with mock.patch.dict(os.environ, YMIR_EVENTS='file://' + path):
+        events.set_sinks(None)
+        try:
+            assert len(events.get_sinks()) == 1
+            events.emit('hello', answer=42)
+            events.emit('hello', answer=43)
+        finally:
+            events.set_sinks(None)
+    lines = [json.loads(line) for line in open(path)]
+    assert [line['answer'] for line in lines] == [42, 43]
+    assert lines[0]['event'] == 'hello'
+    assert 'timestamp' in lines[0]
+    assert len(events.parse_sinks('stdout, udp://127.0.0.1:8125')) == 2
+    assert events.parse_sinks('') == []
+    with pytest.raises(ValueError):
+        events.parse_sinks('udp://nowhere')
+
+
+def test_stream_and_udp_sinks():
+    out = StringIO()
+    events.stream_sink(out)(dict(event='x'))
+    assert json.loads(out.getvalue()) == dict(event='x')
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(5)
+    try:
+        events.udp_sink('127.0.0.1', sock.getsockname()[1])(dict(event='y'))
+        assert json.loads(sock.recv(4096)) == dict(event='y')
+    finally:
+        sock.close()
+
+
+def test_nothing_happens_without_sinks():
+    events.set_sinks([])
+    try:
+        original = api.local
+        with events.operation('svc', 'provision'):
+            assert api.local is original
+            assert events.CONTEXT == {}
+    finally:
+        events.set_sinks(None)
+
+
+def test_operation_events(recorded):
+    original = api.local
+    with mock.patch('fabric.api.local') as local:
+        local.return_value = mock.Mock(failed=True)
+        with events.operation('svc', 'provision'):
+            with events.operation('svc', 'run'):
+                api.local('make assets')
+            with events.timed('provisioner', provisioner='local'):
+                events.report('svc', ydata.SUCCESS + 'done')
+        assert api.local is local
+    assert api.local is original
+    assert events.CONTEXT == {}
+    kinds = [event['event'] for event in recorded]
+    assert kinds == ['operation.start', 'command', 'provisioner.start',
+                     'report', 'provisioner.end', 'operation.end']
+    assert all(event['service'] == 'svc' and
+               event['operation'] == 'provision' for event in recorded)
+    command = recorded[1]
+    assert command['command'] == 'make assets'
+    assert command['outcome'] == 'fail'
+    assert recorded[3]['message'] == u'✓ done'
+    assert recorded[3]['level'] == 'ok'
+    assert recorded[-1]['outcome'] == 'ok'
+    assert recorded[-1]['duration'] >= 0
+
+
+def test_failed_operation(recorded):
+    with pytest.raises(SystemExit):
+        with events.operation('svc', 'provision'):
+            raise SystemExit('aborted')
+    assert recorded[-1]['outcome'] == 'error'
+    assert recorded[-1]['error'] == 'aborted'
+
+
+@mock.patch('ymir.checks.http_200')
+def test_check_events(checker, recorded):
+    checker.side_effect = lambda service, url: (url, False, 'boom')
+    service = test_common.mock_service()
+    service._report_name.return_value = 'svc'
+    check_objs = [checks.Check(name='a', check_type='http_200', url_t='u')]
+    checks.run_checks(service, check_objs, quiet=True)
+    check_objs[0].run(service, quiet=True)
+    assert [event['event'] for event in recorded] == ['check', 'check']
+    for event in recorded:
+        assert event['service'] == 'svc'
+        assert event['outcome'] == 'fail'
+        assert event['message'] == 'boom'
+        assert event['duration'] >= 0
+
+
+@test_common.mock_aws
+def test_provisioner_events():
+    recorded = []
+    with test_common.demo_service() as ctx:
+        service = ctx.get_service()
+        service._provision_remote = mock.Mock(return_value=True)
+        events.set_sinks([recorded.append])
+        try:
+            service._run_provisioner('remote', 'uptime')
+        finally:
+            events.set_sinks(None)
+    provisioner = [event for event in recorded
+                   if event['event'].startswith('provisioner.')]
+    assert [event['event'] for event in provisioner] == [
+        'provisioner.start', 'provisioner.end']
+    assert provisioner[-1]['instruction'] == 'uptime'
+    assert provisioner[-1]['outcome'] == 'ok'
+
+
+def test_events_and_profiling_share_one_hook(recorded, tmpdir):
+    from fabric.contrib import files, project
+    from ymir import hooks, profiling
+    original = files.run
+    with mock.patch('fabric.contrib.files.run') as run, \
+            mock.patch('fabric.contrib.project.local') as local:
+        run.return_value = mock.Mock(failed=False)
+        with events.operation('svc', 'provision'):
+            with profiling.profile(str(tmpdir), 'provision') as profiler:
+                wrapped = files.run
+                # both observers go through the same wrapper
+                assert len(hooks._observers) == 2
+                assert files.exists('/etc/passwd')
+                project.local('rsync -a src dest')
+        assert files.run is run and project.local is local
+        assert not hooks._originals
+    assert files.run is original
+    assert wrapped is not run
+    commands = [event['command'] for event in recorded
+                if event['event'] == 'command']
+    assert commands == ['test -e "$(echo /etc/passwd)"', 'rsync -a src dest']
+    names = [span.name for span in profiler.spans]
+    assert names == ['provision', 'run: test -e "$(echo /etc/passwd)"',
+                     'local: rsync -a src dest']
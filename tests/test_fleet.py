@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+""" tests.test_fleet
+"""
+import os
+import shutil
+
+import mock
+import demjson
+
+from ymir import fleet
+import tests.common as test_common
+
+
+def test_parse_operation():
+    assert fleet.parse_operation('status') == ('status', [], {})
+    assert fleet.parse_operation('check:foo,failfast=1') == (
+        'check', ['foo'], {'failfast': '1'})
+
+
+@test_common.mock_aws
+def test_find_service_files():
+    with test_common.demo_service() as ctx:
+        pattern = os.path.join(ctx.tmp_dir, '*', 'service.json')
+        fnames = fleet.find_service_files([pattern])
+        assert ctx.service_json in fnames
+        fnames = fleet.find_service_files([pattern], env_name='EnvName')
+        assert fnames == [ctx.service_json]
+        assert not fleet.find_service_files([pattern], env_name='nope')
+        ctx.rewrite_json(tags=['web', 'python'])
+        assert fleet.find_service_files([pattern], tags=['web']) == \
+            [ctx.service_json]
+        assert not fleet.find_service_files([pattern], tags=['web', 'node'])
+
+
+@test_common.mock_aws
+def test_find_service_files_with_extends():
+    with test_common.demo_service() as ctx:
+        pattern = os.path.join(ctx.tmp_dir, '*', '*.json')
+        base = os.path.join(ctx.service_dir, 'base.json')
+        with open(base, 'w') as fhandle:
+            fhandle.write(demjson.encode(dict(
+                env_name='staging', tags=['web'])))
+        extension = os.path.join(ctx.service_dir, 'extension.json')
+        with open(extension, 'w') as fhandle:
+            fhandle.write(demjson.encode(dict(
+                extends='base.json', tags=['web', 'python'])))
+        assert fleet.find_service_files([pattern], env_name='staging') == \
+            [base, extension]
+        assert fleet.find_service_files([pattern], tags=['python']) == \
+            [extension]
+
+
+def test_log_files():
+    log_files = fleet._log_files('/logs', [
+        '/srv/prod/web/service.json', '/srv/dev/web/service.json',
+        '/srv/dev/web/other.json'])
+    assert log_files == [
+        '/logs/prod-web-service.log', '/logs/dev-web-service.log',
+        '/logs/dev-web-other.log']
+    assert fleet._log_files('/logs', ['/srv/web/service.json']) == \
+        ['/logs/web-service.log']
+
+
+@test_common.mock_aws
+def test_run_fleet():
+    with test_common.demo_service() as ctx:
+        log_dir = os.path.join(ctx.tmp_dir, 'logs')
+        other_dir = os.path.join(ctx.tmp_dir, 'other_service')
+        shutil.copytree(ctx.service_dir, other_dir)
+        other = os.path.join(other_dir, 'service.json')
+        other_json = ctx.get_json()
+        other_json.update(app_name='OtherApp')
+        with open(other, 'w') as fhandle:
+            fhandle.write(demjson.encode(other_json))
+        files = [ctx.service_json, other]
+        # one worker, so a second service would see anything
+        # the first one left behind in the worker process
+        results = fleet.run_fleet(files, 'status', jobs=1, log_dir=log_dir)
+        assert [r['success'] for r in results] == [True, True]
+        assert len(set(r['log_file'] for r in results)) == 2
+        logs = [open(r['log_file']).read() for r in results]
+        assert 'checking status' in logs[0]
+        assert 'OrgName-AppName-EnvName' in logs[0]
+        assert 'OtherApp' not in logs[0]
+        assert 'OrgName-OtherApp-EnvName' in logs[1]
+        assert 'OrgName-AppName-EnvName' not in logs[1]
+        results = fleet.run_fleet(
+            files[:1], 'not_an_operation', log_dir=log_dir)
+        assert not results[0]['success']
+        assert 'not a ymir operation' in results[0]['error']
+        table = fleet.summary_table(results)
+        assert len(table) == 2
+        assert 'FAIL' in table[1]
+
+
+@test_common.mock_aws
+def test_sync_tags():
+    conn = test_common.fake_aws_conn()
+    conn.get_all_tags.return_value = []
+    instance = mock.Mock(id='i-1')
+    with test_common.demo_service() as ctx:
+        name = ctx.get_service().template_data()['name']
+        with mock.patch('ymir.util.aws.get_conn', lambda *args: conn), \
+                mock.patch('ymir.util.aws.get_instance_index',
+                           lambda conn: {name: instance}):
+            results = fleet.sync_tags([ctx.service_json])
+            assert results[0]['success']
+            assert 'set env' in results[0]['changes']
+            # one call tagging the instance with everything it lacks
+            assert conn.create_tags.call_count == 1
+            ids, tags = conn.create_tags.call_args[0]
+            assert ids == ['i-1'] and tags['env'] == 'EnvName'
+            # tags for empty fields are only removed when asked to
+            description = mock.Mock(res_id='i-1', value='old')
+            description.name = 'description'
+            conn.get_all_tags.return_value = [description]
+            ctx.rewrite_json(service_description='')
+            results = fleet.sync_tags([ctx.service_json])
+            assert 'remove description' not in results[0]['changes']
+            assert not conn.delete_tags.called
+            results = fleet.sync_tags([ctx.service_json], prune=True)
+            assert 'remove description' in results[0]['changes']
+            assert conn.delete_tags.call_args[0] == \
+                (['i-1'], dict(description=None))
+            ctx.rewrite_json(name='elsewhere')
+            results = fleet.sync_tags([ctx.service_json])
+            assert not results[0]['success']
+            assert results[0]['error'] == 'no instance found'
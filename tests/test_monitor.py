@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+""" tests.test_monitor
+"""
+import json
+import urllib2
+from StringIO import StringIO
+
+import mock
+
+from ymir import checks
+from ymir import monitor
+from .common import mock_service
+
+
+def _service():
+    service = mock_service()
+    service._service_json['name'] = 'svc'
+    return service
+
+
+def _checks(**intervals):
+    return [checks.Check(name=name, check_type='http_200', url_t=name,
+                         options=dict(interval=interval) if interval else None)
+            for name, interval in sorted(intervals.items())]
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_check_interval_is_not_a_checker_option():
+    check_obj = checks.Check(
+        name='a', check_type='http_200', url_t='a',
+        options=dict(interval=5, timeout=3))
+    assert check_obj.interval == 5
+    assert check_obj.options == dict(timeout=3)
+
+
+@mock.patch('ymir.checks.http_200')
+def test_monitor_schedules_each_check(checker):
+    checker.side_effect = lambda service, url: (url, True, '')
+    clock = FakeClock()
+    mon = monitor.Monitor(
+        _service(), _checks(fast=10, slow=None), interval=30, jitter=0)
+    mon.run(rounds=4, clock=clock, sleep=clock.sleep)
+    runs = dict((sched.check.name, sched.runs) for sched in mon.scheduled)
+    # t=0 both, t=10, t=20 fast, t=30 both
+    assert runs == dict(fast=4, slow=2)
+    assert clock.now == 1030.0
+
+
+@mock.patch('ymir.checks.http_200')
+def test_monitor_jitter(checker):
+    checker.side_effect = lambda service, url: (url, True, '')
+    mon = monitor.Monitor(_service(), _checks(a=100), jitter=0.1)
+    mon.start(0)
+    assert 0 <= mon.scheduled[0].next_run <= 10
+    mon.run_round(10)
+    assert 100 <= mon.scheduled[0].next_run <= 120
+
+
+@mock.patch('ymir.checks.http_200')
+def test_monitor_events_and_flapping(checker):
+    results = iter([True, False, False, True, False, True, False])
+    checker.side_effect = lambda service, url: (url, next(results), 'msg')
+    out = StringIO()
+    mon = monitor.Monitor(
+        _service(), _checks(a=1), jitter=0,
+        sinks=[monitor.ndjson_sink(out)])
+    for now in range(7):
+        mon.run_round(now)
+    events = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert len(events) == 7
+    assert [e['consecutive_failures'] for e in events[:3]] == [0, 1, 2]
+    assert [e['changed'] for e in events[:3]] == [False, True, False]
+    assert not events[3]['flapping']
+    assert events[-1]['flapping']
+    assert events[-1]['service'] == 'svc'
+    assert events[-1]['timestamp'] == 6
+    text = mon.metrics()
+    labels = 'service="svc",check="a",check_type="http_200"'
+    assert 'ymir_check_up{' + labels + '} 0' in text
+    assert 'ymir_check_failures_total{' + labels + '} 4' in text
+    assert 'ymir_check_flapping{' + labels + '} 1' in text
+
+
+@mock.patch('ymir.checks.http_200')
+def test_serve_metrics(checker):
+    checker.side_effect = lambda service, url: (url, True, '')
+    mon = monitor.Monitor(_service(), _checks(a=1), jitter=0)
+    mon.run_round(0)
+    server = monitor.serve_metrics(mon, 0, host='127.0.0.1')
+    try:
+        url = 'http://127.0.0.1:{0}/metrics'.format(server.server_address[1])
+        text = urllib2.urlopen(url).read()
+    finally:
+        server.shutdown()
+    assert 'ymir_check_runs_total{service="svc",check="a"' in text
+
+
+@mock.patch('ymir.checks.http_200')
+def test_check_context_is_resolved_once(checker):
+    checker.side_effect = lambda service, url: (url, True, '')
+    service = _service()
+    with mock.patch('ymir.checks._check_context',
+                    return_value=dict(name='svc')) as context:
+        clock = FakeClock()
+        mon = monitor.Monitor(service, _checks(a=1), jitter=0)
+        mon.run(rounds=3, clock=clock, sleep=clock.sleep)
+    assert context.call_count == 1
+    assert mon.scheduled[0].runs == 3
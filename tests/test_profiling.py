@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+""" tests.test_profiling
+"""
+import os
+import json
+import time
+import threading
+
+import mock
+from fabric import api
+
+from ymir import profiling
+import tests.common as test_common
+
+
+def test_spans_nest_per_thread():
+    profiler = profiling.Profiler('test')
+    with profiler.span('op', 'operation'):
+        with profiler.span('step', 'provisioner'):
+            time.sleep(0.1)
+
+        def worker():
+            with profiler.span('bg', 'local'):
+                time.sleep(0.05)
+        thread = threading.Thread(target=worker, name='worker')
+        thread.start()
+        thread.join()
+    op, step, bg = profiler.spans
+    assert [op.parent, step.parent, bg.parent] == [None, 0, 0]
+    assert bg.thread == 'worker'
+    assert step.seconds >= 0.1
+    assert [s.name for s in profiler.slowest(1)] == ['step']
+    trace = profiler.as_chrome_trace()['traceEvents']
+    complete = [e for e in trace if e['ph'] == 'X']
+    assert [e['name'] for e in complete] == ['op', 'step', 'bg']
+    assert complete[1]['dur'] >= 100000
+    assert complete[0]['tid'] != complete[2]['tid']
+    speedscope = profiler.as_speedscope()
+    assert [f['name'] for f in speedscope['shared']['frames']] == \
+        ['op', 'step', 'bg']
+    for prof in speedscope['profiles']:
+        opened = [e['frame'] for e in prof['events'] if e['type'] == 'O']
+        closed = [e['frame'] for e in prof['events'] if e['type'] == 'C']
+        assert sorted(opened) == sorted(closed)
+        times = [e['at'] for e in prof['events']]
+        assert times == sorted(times)
+
+
+def test_failures_are_recorded():
+    profiler = profiling.Profiler('test')
+    try:
+        with profiler.span('op', 'operation'):
+            raise SystemExit('aborted')
+    except SystemExit:
+        pass
+    assert profiler.spans[0].args == dict(error='aborted')
+    assert profiler.spans[0].end is not None
+
+
+def test_profile_wraps_fabric_and_writes_files(tmpdir):
+    original = api.local
+    reports = []
+    with mock.patch('fabric.api.local') as local:
+        with profiling.profile(str(tmpdir), 'provision',
+                               report=reports.append) as profiler:
+            api.local('make assets')
+            with profiling.profile(str(tmpdir), 'nested'):
+                pass
+        assert local.call_args == mock.call('make assets')
+        assert api.local is local
+    assert api.local is original
+    assert profiling._active is None
+    names = [span.name for span in profiler.spans]
+    assert names == ['provision', 'local: make assets', 'nested']
+    files = sorted(os.listdir(
+        os.path.join(str(tmpdir), profiling.PROFILE_DIR)))
+    assert len(files) == 3
+    assert any(f.endswith('.trace.json') for f in files)
+    assert any(f.endswith('.speedscope.json') for f in files)
+    for fname in files:
+        json.load(open(os.path.join(
+            str(tmpdir), profiling.PROFILE_DIR, fname)))
+    assert reports[0] == 'slowest steps:'
+    assert 'local: make assets' in reports[1]
+
+
+def test_span_without_profile():
+    with profiling.span('x', 'operation') as span:
+        assert span is None
+    assert profiling.traced('setup')(lambda: 3)() == 3
+
+
+@test_common.mock_aws
+def test_provision_with_profile():
+    with test_common.demo_service() as ctx:
+        service = ctx.get_service()
+        service._provision_remote = mock.Mock(return_value=True)
+        service._status = mock.Mock(return_value=dict(status='running'))
+        service.provision(use_list=['remote://uptime'], profile='1')
+        profile_dir = os.path.join(ctx.service_dir, profiling.PROFILE_DIR)
+        data = json.load(open(os.path.join(profile_dir, [
+            fname for fname in os.listdir(profile_dir)
+            if not fname.endswith('trace.json') and
+            not fname.endswith('speedscope.json')][0])))
+        names = [span['name'] for span in data['spans']]
+        assert names[0] == 'provision'
+        assert 'remote://uptime' in names
@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 """ tests.test_puppet
 """
+import os
+from StringIO import StringIO
+
 import mock
 import pytest
 import requests
 
+from ymir.util import puppet
 import tests.common as test_common
 noop_ctx = test_common.noop_ctx
 
@@ -39,9 +43,13 @@ def test_provision_puppet(run_puppet):
 
 
 @test_common.mock_aws
+@mock.patch('ymir.mixins.rsync.RsyncMixin._write_rsync_manifest')
+@mock.patch('ymir.mixins.rsync.RsyncMixin._read_rsync_manifest',
+            mock.Mock(return_value={}))
 @mock.patch('ymir.mixins.rsync.rsync_project')
 @mock.patch('ymir.mixins.rsync.RsyncMixin._require_rsync')
-def test_copy_puppet(rsync_mock, _require_rsync):
+def test_copy_puppet(_require_rsync, rsync_mock, _write_rsync_manifest):
+    rsync_mock.return_value = ''
     with test_common.demo_service() as ctx:
         ctx.rewrite_json(ymir_build_puppet=True)
         service = ctx.get_service()
@@ -60,6 +68,30 @@ def test_puppet_template_vars():
         all_vars = reduce(aggreg, file_to_vars_map.values())
         # operatingsystem variable is used in motd.erb templates
         assert 'operatingsystem' in all_vars
+        subdir = os.path.join(
+            service._puppet_dir, 'modules', 'ymir', 'templates', 'conf.d')
+        os.makedirs(subdir)
+        with open(os.path.join(subdir, 'site.erb'), 'w') as fhandle:
+            fhandle.write('<%- @operatingsystem.each do |x| -%>')
+        index = service._get_puppet_template_index()
+        assert index['operatingsystem'] == sorted([
+            os.path.join(subdir, 'site.erb'),
+            os.path.join(os.path.dirname(subdir), 'motd.erb')])
+
+
+ERB = """literal <%% @not_a_tag %> and email@example.com
+<%# @commented_out %>
+<%= @plain %> <%- if @in_code -%>
+  <%= @plain.join(',') %> <%= scope['::top_scope'] %>
+  <%= scope.lookupvar("looked_up") %> <%= scope['mod::qualified'] %>
+<% end -%>
+"""
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+def test_scan_template(chunk_size):
+    found = puppet.scan_template(StringIO(ERB), chunk_size=chunk_size)
+    assert found == ['plain', 'in_code', 'top_scope', 'looked_up']
 
 
 @test_common.mock_aws
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+""" tests.test_rsync
+"""
+import os
+import contextlib
+
+import mock
+
+from ymir.mixins import rsync
+import tests.common as test_common
+
+STATS = """
+Number of files: 12 (reg: 10, dir: 2)
+Number of regular files transferred: 3
+Total file size: 1,234,567 bytes
+Literal data: 2,048 bytes
+Matched data: 1,232,519 bytes
+Total bytes sent: 2,900
+"""
+
+
+def test_parse_rsync_stats():
+    assert rsync.parse_rsync_stats(STATS) == dict(
+        files_transferred=3, literal_data=2048,
+        matched_data=1232519, total_bytes_sent=2900)
+    assert rsync.parse_rsync_stats(None) == {}
+
+
+def _sync_patches(manifest):
+    return [
+        mock.patch('ymir.mixins.rsync.rsync_project',
+                   mock.Mock(return_value=STATS)),
+        mock.patch('ymir.mixins.rsync.RsyncMixin._require_rsync'),
+        mock.patch('ymir.mixins.rsync.RsyncMixin._read_rsync_manifest',
+                   mock.Mock(return_value=manifest)),
+        mock.patch('ymir.mixins.rsync.RsyncMixin._write_rsync_manifest'), ]
+
+
+@test_common.mock_aws
+def test_rsync_options_and_skip():
+    """ options are passed through, the remote manifest is read once,
+        and unchanged trees are not synced again
+    """
+    with test_common.demo_service() as ctx:
+        service = ctx.get_service()
+        src = os.path.join(ctx.service_dir, 'puppet', '*')
+        patches = _sync_patches({})
+        with contextlib.nested(*patches) as (rsync_project, _, read, write):
+            service._rsync(src=src, dest='~/puppet', delete=False,
+                           compress=False, checksum=True)
+            kargs = rsync_project.call_args[1]
+            assert kargs['delete'] is False
+            assert kargs['default_opts'] == '-pthrv'
+            assert kargs['extra_opts'] == '--stats --checksum'
+            assert write.call_count == 1
+            manifest = write.call_args[0][0]
+            assert manifest.keys() == ['~/puppet']
+            rsync_project.reset_mock()
+            service._rsync(src=src, dest='~/puppet', delete=False)
+            assert not rsync_project.called
+            # deleting is a different sync than not deleting
+            service._rsync(src=src, dest='~/puppet')
+            kargs = rsync_project.call_args[1]
+            assert kargs['delete'] is True
+            assert kargs['default_opts'] == '-pthrvz'
+            assert kargs['extra_opts'] == '--stats'
+            rsync_project.reset_mock()
+            service._rsync(src=src, dest='~/puppet', force=True)
+            assert rsync_project.called
+            assert read.call_count == 1
+
+
+@test_common.mock_aws
+def test_rsync_skips_when_remote_hash_matches():
+    with test_common.demo_service() as ctx:
+        service = ctx.get_service()
+        src = os.path.join(ctx.service_dir, 'puppet', '*')
+        tree_hash = service._rsync_tree_hash(src, True)
+        patches = _sync_patches({'~/puppet': tree_hash})
+        with contextlib.nested(*patches) as (rsync_project, _, read, write):
+            assert service._rsync(src=src, dest='~/puppet') is None
+            assert not rsync_project.called
+            assert not write.called
+            with open(os.path.join(ctx.service_dir, 'puppet', 'new.pp'),
+                      'w') as fhandle:
+                fhandle.write('# changed')
+            service._rsync(src=src, dest='~/puppet')
+            assert rsync_project.called
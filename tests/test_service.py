@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 """
 """
+import os
+
 import pytest
 import mock
 from peak.util.imports import lazyModule
@@ -40,3 +42,206 @@ def test_run_provisioner():
         provisioner_name, provision_instruction = 'foobar', 'baz'
         with pytest.raises(BadProvisionInstruction):
             service._run_provisioner(provisioner_name, provision_instruction)
+
+
+@test_common.mock_aws
+def test_status_cache_is_shared_and_invalidated():
+    instance = mock.Mock(
+        id='i-08002798', tags={}, ip_address='10.0.0.1',
+        private_ip_address='192.168.0.1')
+    instance.update.return_value = 'running'
+    with test_common.demo_service() as ctx:
+        with mock.patch('ymir.util.aws.get_instance_by_name',
+                        return_value=instance) as lookup:
+            # status isn't shared unless ymir_status_ttl asks for it
+            ctx.get_service()._status()
+            ctx.get_service()._status()
+            assert lookup.call_count == 2
+            lookup.reset_mock()
+            ctx.rewrite_json(ymir_status_ttl=30)
+            assert ctx.get_service()._status()['ip'] == '10.0.0.1'
+            # a fresh service object (i.e. a new `fab` process)
+            # should be answered from the on-disk cache
+            service = ctx.get_service()
+            status = service._status()
+            assert lookup.call_count == 1
+            assert status['instance'].id == 'i-08002798'
+            assert status['status'] == 'running'
+            service._invalidate_status()
+            service._status()
+            assert lookup.call_count == 2
+
+
+@test_common.mock_aws
+def test_template_data_is_memoized_and_readonly():
+    with test_common.demo_service() as ctx:
+        service = ctx.get_service()
+        tdata = service.template_data()
+        assert service.template_data() is tdata
+        assert service._template_data_stats == dict(hits=1, misses=1)
+        with pytest.raises(TypeError):
+            tdata['name'] = 'foo'
+        with pytest.raises(TypeError):
+            tdata['service_defaults'].update(foo='bar')
+        tmp = tdata.copy()
+        tmp.update(name='foo')
+        assert tdata['name'] != 'foo'
+        # a change of status produces a new state version
+        service._invalidate_status()
+        service._status = mock.Mock(
+            return_value=dict(ip='10.0.0.1', status='running'))
+        assert service.template_data()['host'] == '10.0.0.1'
+        assert service._template_data_stats['misses'] == 2
+        # cache hits don't ask for status
+        service._status.reset_mock()
+        service.template_data()
+        assert not service._status.called
+        # assigning new json produces a new state version
+        service._service_json = dict(service._service_json, name='other')
+        assert service.template_data()['name'] == 'other'
+        assert service._template_data_stats['misses'] == 3
+        # status is compared by value, not by identity
+        status = dict(ip='10.0.0.1', status='running',
+                      instance=mock.Mock(id='i-1'))
+        service._status_computed = status
+        service.template_data()
+        assert service._template_data_stats['misses'] == 4
+        service._status_computed = dict(status, instance=mock.Mock(id='i-1'))
+        service.template_data()
+        assert service._template_data_stats['misses'] == 4
+        service._status_computed = dict(status, ip='10.0.0.2')
+        service.template_data()
+        assert service._template_data_stats['misses'] == 5
+
+
+@test_common.mock_aws
+def test_template_data_renders_lists_as_lists():
+    with test_common.demo_service() as ctx:
+        ctx.rewrite_json(service_defaults=dict(packages=['git', 'curl']))
+        service = ctx.get_service()
+        assert service.template_data()['service_defaults']['packages'] == \
+            ('git', 'curl')
+        assert service.facts['packages'] == ['git', 'curl']
+        service._provision_remote = mock.Mock(return_value=True)
+        service._run_provisioner('remote', 'echo {{service_defaults.packages}}')
+        assert service._provision_remote.call_args[0][0] == \
+            "echo [u'git', u'curl']"
+
+
+@test_common.mock_aws
+def test_incremental_provisioning():
+    with test_common.demo_service() as ctx:
+        service = ctx.get_service()
+        local_file = os.path.join(ctx.service_dir, "file.txt")
+        with open(local_file, 'w') as fhandle:
+            fhandle.write('version 1')
+        provision_list = ['rsync://file.txt', 'remote://uptime']
+        manifest = {}
+        service._read_provision_manifest = lambda: manifest.copy()
+        service._write_provision_manifest = mock.Mock(
+            side_effect=manifest.update)
+        service._run_provisioner = mock.Mock(return_value=True)
+
+        def provisioned():
+            service._run_provisioner.reset_mock()
+            service._provision_helper(
+                use_list=provision_list, incremental='1')
+            return [args[0] for args, kargs in
+                    service._run_provisioner.call_args_list]
+        assert provisioned() == ['rsync', 'remote']
+        # the manifest is written once, after the steps have run
+        assert service._write_provision_manifest.call_count == 1
+        # remote:// instructions can't be fingerprinted, so they always run
+        assert provisioned() == ['remote']
+        assert service._write_provision_manifest.call_count == 1
+        with open(local_file, 'w') as fhandle:
+            fhandle.write('version 3')
+        # steps which succeeded are recorded even if a later one fails
+        service._run_provisioner.side_effect = [True, SystemExit(1)]
+        with pytest.raises(SystemExit):
+            provisioned()
+        service._run_provisioner.side_effect = None
+        assert provisioned() == ['remote']
+        with open(local_file, 'w') as fhandle:
+            fhandle.write('version 2')
+        assert provisioned() == ['rsync', 'remote']
+
+
+@test_common.mock_aws
+def test_background_local_provisioning():
+    with test_common.demo_service() as ctx:
+        service = ctx.get_service()
+        service._provision_remote = mock.Mock(return_value=True)
+        service._provision_helper(use_list=[
+            '[build background] local://echo built > out.txt',
+            '[check after=build] remote://cat out.txt'])
+        assert open(os.path.join(ctx.service_dir, 'out.txt')).read() == \
+            'built\n'
+        service._provision_remote.assert_called_with('cat out.txt')
+        with pytest.raises(SystemExit):
+            service._provision_helper(use_list=[
+                '[build background] local://exit 3', 'remote://uptime'])
+
+
+@test_common.mock_aws
+def test_remote_capabilities_are_probed_once():
+    from fabric.operations import _AttributeString
+    probe_output = _AttributeString(
+        'Welcome to Ubuntu\n'
+        '{"os_family": "debian", "os_id": "ubuntu", "rvm": false, '
+        '"pacapt": true, "package_update_age": 60, '
+        '"versions": {"ruby": "2.3.1p112", "puppet": null, "git": "2.7.4", '
+        '"rsync": "3.1.1", "gem": "2.5.1"}, "gems": ["librarian-puppet"]}')
+    with test_common.demo_service() as ctx:
+        service = ctx.get_service()
+        with mock.patch('fabric.api.run', return_value=probe_output) as run:
+            assert service._has_rsync()
+            assert not service._using_rvm
+            assert service._remote_version('puppet') is None
+            assert service._remote_version('ruby') == '2.3.1p112'
+            assert run.call_count == 1
+            service._invalidate_capabilities()
+            assert service._has_rsync()
+            assert run.call_count == 2
+
+
+def test_capability_probe_runs_locally():
+    import subprocess
+    from ymir.mixins import capabilities
+    cmd = capabilities.CAPABILITY_PROBE_CMD.format(
+        capabilities.CAPABILITY_PROBE)
+    output = subprocess.check_output(['sh', '-c', cmd])
+    result = capabilities.parse_capabilities(output)
+    assert set(result['versions']) == set(
+        ['ruby', 'puppet', 'git', 'rsync', 'gem'])
+    assert isinstance(result['gems'], list)
+    assert isinstance(result['rvm'], bool)
+
+
+@test_common.mock_aws
+def test_compiled_service_description():
+    with test_common.demo_service() as ctx:
+        service = ctx.get_service()
+        compiled = api.compiled_service_file(ctx.service_json)
+        # loading alone never creates the compiled file
+        assert not os.path.exists(compiled)
+        assert api.compile_service(ctx.service_json, quiet=True) == compiled
+        with mock.patch('ymir.api._load_service_from_json_helper') as helper:
+            again = ctx.get_service()
+            assert not helper.called
+        assert again._service_json == service._service_json
+        assert again._schema is service._schema
+        assert again.__class__.__name__ == service.__class__.__name__
+        # touching the file doesn't change it's contents
+        os.utime(ctx.service_json, None)
+        assert api.load_compiled_service(ctx.service_json) is not None
+        ctx.rewrite_json(name='renamed_service')
+        assert api.load_compiled_service(ctx.service_json) is None
+        # once it exists, loading keeps it up to date
+        assert ctx.get_service()._service_json['name'] == 'renamed_service'
+        assert api.load_compiled_service(ctx.service_json) is not None
+        # failing to write it doesn't fail the load
+        ctx.rewrite_json(name='renamed_again')
+        with mock.patch('json.dump', side_effect=TypeError('unencodable')):
+            assert ctx.get_service()._service_json['name'] == 'renamed_again'
+        assert not os.path.exists('{0}.{1}'.format(compiled, os.getpid()))
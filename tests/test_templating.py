@@ -60,3 +60,15 @@ def test_templating_in_setup_list():
 @test_common.mock_aws
 def test_templating_in_checks():
     pass
+
+
+def test_str_reflect_caches_templates():
+    from ymir import api as yapi
+    source = '{{name}}-08002798dcaa'
+    assert yapi.str_reflect(source, dict(name='x')) == 'x-08002798dcaa'
+    template = yapi.template_cache[source]
+    assert yapi.str_reflect(source, dict(name='y')) == 'y-08002798dcaa'
+    assert yapi.template_cache[source] is template
+    plain = 'no markers 08002798dcaa'
+    assert yapi.str_reflect(plain, {}) is plain
+    assert plain not in yapi.template_cache
@@ -16,6 +16,11 @@ def test_report():
     util.report('label', 'message')
 
 
+def test_is_true():
+    assert all(util.is_true(x) for x in ['1', 'true', 'Yes', 'y', True, 1])
+    assert not any(util.is_true(x) for x in ['0', 'no', '', None, False])
+
+
 def test_split_instruction():
     assert util.split_instruction('ansible://foo') == ('ansible', 'foo')
     assert util.split_instruction(
@@ -33,3 +38,180 @@ def test_get_conn_with_AWS_PROFILE_as_nonsense():
     with mock.patch.dict(os.environ, {'AWS_PROFILE': 'bd11cce2'}):
         with pytest.raises(SystemExit):
             util.aws.get_conn()
+
+
+def _fake_instance(name, state='running'):
+    inst = mock.Mock()
+    inst.tags = dict(Name=name)
+    inst.state = state
+    return inst
+
+
+@mock.patch.dict(util.aws.instance_index, clear=True)
+@mock.patch('ymir.util.aws._complete_indexes', set())
+def test_get_instance_by_name_uses_filtered_lookup():
+    conn = mock.Mock()
+    inst = _fake_instance('foo')
+    conn.get_only_instances.return_value = [inst]
+    assert util.aws.get_instance_by_name('foo', conn) is inst
+    assert util.aws.get_instance_by_name('foo', conn) is inst
+    assert conn.get_only_instances.call_count == 1
+    filters = conn.get_only_instances.call_args[1]['filters']
+    assert filters['tag:Name'] == 'foo'
+    assert 'terminated' not in filters['instance-state-name']
+
+
+@mock.patch.dict(util.aws.instance_index, clear=True)
+@mock.patch('ymir.util.aws._complete_indexes', set())
+def test_get_instance_by_name_uses_index():
+    conn = mock.Mock()
+    foo, bar = _fake_instance('foo'), _fake_instance('bar')
+    conn.get_only_instances.return_value = [foo, bar]
+    index = util.aws.get_instance_index(conn)
+    assert index == dict(foo=foo, bar=bar)
+    assert util.aws.get_instance_by_name('bar', conn) is bar
+    assert util.aws.get_instance_by_name('baz', conn) is None
+    assert conn.get_only_instances.call_count == 1
+    util.aws.invalidate_instance_index(conn, name='bar')
+    conn.get_only_instances.return_value = []
+    assert util.aws.get_instance_by_name('bar', conn) is None
+    assert conn.get_only_instances.call_count == 2
+
+
+def test_cached_with_key_function():
+    from ymir.caching import cached
+    calls = []
+
+    @cached(lambda name: 'test_cached:' + name)
+    def greet(name):
+        calls.append(name)
+        return 'hello ' + name
+    assert [greet('a'), greet('b'), greet('a')] == \
+        ['hello a', 'hello b', 'hello a']
+    assert calls == ['a', 'b']
+
+
+def test_hash_path():
+    with util.TemporaryDirectory() as tmp_dir:
+        fname = os.path.join(tmp_dir, 'foo.pp')
+        assert util.hashing.hash_path(fname) is None
+        with open(fname, 'w') as fhandle:
+            fhandle.write('one')
+        file_hash, dir_hash = [
+            util.hashing.hash_path(x) for x in [fname, tmp_dir]]
+        assert file_hash and dir_hash and file_hash != dir_hash
+        with open(os.path.join(tmp_dir, 'ignored.pyc'), 'w') as fhandle:
+            fhandle.write('ignored')
+        assert util.hashing.hash_path(tmp_dir) == dir_hash
+        with open(fname, 'w') as fhandle:
+            fhandle.write('two')
+        assert util.hashing.hash_path(fname) != file_hash
+        assert util.hashing.hash_path(tmp_dir) != dir_hash
+
+
+def test_mux_options():
+    opts = util.mux.mux_opts('ubuntu', '1.2.3.4', '22')
+    path = util.mux.control_path('ubuntu', '1.2.3.4', '22')
+    assert '-o ControlPath={0}'.format(path) in opts
+    assert '-o ControlMaster=auto' in opts
+    assert path != util.mux.control_path('ubuntu', '1.2.3.4', '2222')
+    # computing a path doesn't make this process responsible for it
+    assert path not in util.mux._control_paths
+    # unix sockets have short paths
+    assert len(path) < 100
+
+
+def test_mux_close_masters():
+    util.mux._checked_paths.clear()
+    util.mux._control_paths.clear()
+    with mock.patch('ymir.util.mux.master_running', return_value=True):
+        shared = util.mux.use_master('ubuntu', '1.2.3.4', '2222')
+    with mock.patch('ymir.util.mux.master_running', return_value=False):
+        path = util.mux.use_master('ubuntu', '1.2.3.4', '22')
+    # a master that was already running is left to ControlPersist
+    assert util.mux._control_paths == set([path])
+    assert shared in util.mux._checked_paths
+    with mock.patch('subprocess.call') as call:
+        with mock.patch('os.path.exists', return_value=True):
+            util.mux.close_masters()
+    assert call.called
+    assert 'ControlPath=' + path in call.call_args[0][0]
+    assert not util.mux._control_paths
+
+
+def test_jsonc_decode():
+    text = '''// leading comment
+    {
+        "url": "http://{{host}}/path", // trailing comment
+        'single': 'it\\'s "quoted"',
+        /* block
+           comment */
+        "list": [1, 2.5, true, null]
+    }'''
+    expected = {
+        'url': 'http://{{host}}/path',
+        'single': 'it\'s "quoted"',
+        'list': [1, 2.5, True, None]}
+    assert util.jsonc.decode(text) == expected
+    assert util.jsonc.normalize(text).count('\n') == text.count('\n')
+
+
+def test_jsonc_decode_matches_demjson():
+    import glob
+    import demjson
+    from tests.common import skeleton_dir
+    for fname in glob.glob(os.path.join(skeleton_dir, '*.json')):
+        with mock.patch('demjson.decode') as fallback:
+            decoded = util.jsonc.decode_file(fname)
+        assert not fallback.called, fname
+        assert decoded == demjson.decode_file(fname)
+
+
+def test_jsonc_falls_back_to_demjson():
+    import demjson
+    assert util.jsonc.decode('{"a": [1, 2,],}') == {'a': [1, 2]}
+    # unquoted keys and hex numbers are only understood by demjson
+    assert util.jsonc.decode('{a: 0x10}') == {'a': 16}
+    with pytest.raises(demjson.JSONDecodeError):
+        util.jsonc.decode('{"a": ')
+
+
+def _tag(res_id, name, value):
+    tag = mock.Mock(res_id=res_id, value=value)
+    tag.name = name
+    return tag
+
+
+def test_diff_tags():
+    current = {'i-1': dict(env='prod', app='a', Name='one'),
+               'i-2': dict(env='dev', Name='two'),
+               'i-3': {}}
+    desired = {'i-1': dict(env='prod', app=None, web='true'),
+               'i-2': dict(env='prod', app=None, web='true'),
+               'i-3': dict(env='prod', app='c')}
+    creates, deletes = util.aws.diff_tags(desired, current)
+    assert creates == {
+        ('i-2', 'i-3'): dict(env='prod'),
+        ('i-1', 'i-2'): dict(web='true'),
+        ('i-3',): dict(app='c')}
+    assert deletes == {('i-1',): dict(app=None)}
+
+
+def test_reconcile_tags_batches_calls():
+    conn = mock.Mock()
+    ids = ['i-{0}'.format(n) for n in range(5)]
+    conn.get_all_tags.side_effect = lambda filters: [
+        _tag(res_id, 'env', 'dev') for res_id in filters['resource-id']]
+    desired = dict((res_id, dict(env='prod', old=None)) for res_id in ids)
+    with mock.patch('ymir.util.aws.TAG_BATCH_SIZE', 2):
+        creates, deletes = util.aws.reconcile_tags(conn, desired)
+    assert conn.get_all_tags.call_count == 3
+    assert creates == {tuple(ids): dict(env='prod')}
+    assert deletes == {}
+    assert [call[0] for call in conn.create_tags.call_args_list] == [
+        (ids[:2], dict(env='prod')), (ids[2:4], dict(env='prod')),
+        (ids[4:], dict(env='prod'))]
+    assert not conn.delete_tags.called
+    conn.reset_mock()
+    util.aws.reconcile_tags(conn, desired, dry_run=True)
+    assert not conn.create_tags.called
@@ -2,6 +2,7 @@
 """
 """
 import os
+import time
 import shutil
 import contextlib
 
@@ -10,6 +11,7 @@ import demjson
 from fabric import api
 
 from ymir import validation
+from ymir.util import puppet
 from ymir.util import TemporaryDirectory
 from ymir import api as yapi
 from tests import common as test_common
@@ -150,3 +152,88 @@ def test_validate_keypairs():
                'cause an error in keypair validation')
         key_errors = [x for x in errors if service_json['key_name'] in x]
         assert key_errors, err
+
+
+@contextlib.contextmanager
+def fake_puppet():
+    """ puts a fake `puppet` on $PATH, which fails for any file named
+        bad*.pp and logs its arguments.  yields the log's filename
+    """
+    with TemporaryDirectory() as tmp_dir:
+        log = os.path.join(tmp_dir, 'log')
+        open(log, 'w').close()
+        fake_puppet = os.path.join(tmp_dir, 'puppet')
+        with open(fake_puppet, 'w') as fhandle:
+            fhandle.write('#!/bin/sh\necho "$@" >> {0}\n'
+                          'case "$*" in --version) echo 4.10.0;; '
+                          '*bad*) echo nope; exit 1;; esac\n'.format(log))
+        os.chmod(fake_puppet, 0o755)
+        path = tmp_dir + os.pathsep + os.environ['PATH']
+        with mock.patch.dict(os.environ, dict(PATH=path)):
+            yield log
+
+
+def test_validate_puppet_files_in_batches():
+    """ manifests are validated in batches, and only the
+        batches that fail are retried one file at a time
+    """
+    filenames = ['{0}.pp'.format(i) for i in range(5)] + ['bad.pp']
+    with fake_puppet() as log:
+        results = puppet.validate_files(
+            filenames, parser='future', batch_size=3)
+        calls = sorted(open(log).read().splitlines())
+    assert results == {
+        '0.pp': None, '1.pp': None, '2.pp': None,
+        '3.pp': None, '4.pp': None, 'bad.pp': 'nope'}
+    assert calls == sorted([
+        'parser --parser future validate 0.pp 1.pp 2.pp',
+        'parser --parser future validate 3.pp 4.pp bad.pp',
+        'parser --parser future validate 3.pp',
+        'parser --parser future validate 4.pp',
+        'parser --parser future validate bad.pp', ])
+
+
+@test_common.mock_aws
+def test_validate_puppet_is_cached():
+    """ only manifests which changed are parsed again """
+    with contextlib.nested(test_common.demo_service(), fake_puppet()) as \
+            (ctx, log):
+        ctx.rewrite_json(ymir_build_puppet=True)
+        service = ctx.get_service()
+
+        def parsed(**kargs):
+            open(log, 'w').close()
+            errors, warnings, messages = validation.validate_puppet(
+                service, **kargs)
+            return errors, [line.split()[-1] for line in open(log)
+                            if line.startswith('parser')]
+        manifests = puppet.find_manifests(service._puppet_dir)
+        bad_manifest = os.path.join(service._puppet_dir, 'bad.pp')
+        with open(bad_manifest, 'w') as fhandle:
+            fhandle.write('bad')
+        errors, files = parsed()
+        assert len(errors) == 1 and bad_manifest in errors[0]
+        errors, files = parsed()
+        assert len(errors) == 1 and not files
+        with open(manifests[0], 'a') as fhandle:
+            fhandle.write('\n')
+        errors, files = parsed()
+        assert len(errors) == 1 and files == [manifests[0]]
+        errors, files = parsed(cache=False)
+        assert len(errors) == 1 and bad_manifest in files
+        assert set(manifests).issubset(files)
+
+
+def test_run_validators_is_concurrent():
+    service = mock.Mock()
+
+    def slow_validator(msg):
+        def validator(service):
+            time.sleep(1)
+            return [msg], [], []
+        return validator
+    start = time.time()
+    results = validation.run_validators(
+        service, [slow_validator(i) for i in range(4)])
+    assert time.time() - start < 2
+    assert [errors for errors, _, _ in results] == [[0], [1], [2], [3]]
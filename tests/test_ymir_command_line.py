@@ -102,7 +102,8 @@ def test_skeleton_service_validation(mock_validate):
         err = "test service should not validate!"
         commands.ymir_validate(
             addict.Dict(service_json=ctx.service_json))
-        mock_validate.assert_called_with(ctx.service_json, simple=False)
+        mock_validate.assert_called_with(
+            ctx.service_json, simple=False, cache=True)
     with test_common.demo_service() as ctx:
         with pytest.raises(SystemExit):
             commands.ymir_validate(
@@ -120,3 +121,22 @@ def test_sg_command():  # mock_validate):
         sg_json['rules'].append(['tcp', 22, 22, '0.0.0.0/22'])
         ctx.rewrite_sg_json([sg_json])
         commands.ymir_sg(addict.Dict(sg_json=ctx.sg_json,))
+
+
+def test_ymir_command_line_imports_are_lazy():
+    """ `ymir version` and `ymir help` should not import the
+        heavy dependencies which are only needed by subcommands
+    """
+    from tests.benchmarks.bench_startup import heavy_imports
+    err = 'ymir.bin._ymir should not import: {0}'
+    heavy = heavy_imports('ymir.bin._ymir')
+    assert not heavy, err.format(heavy)
+
+
+def test_ymir_version():
+    """ `ymir version` should work without importing subcommands """
+    with api.quiet():
+        result = api.local('ymir version', capture=True)
+    assert result.succeeded
+    from ymir.version import __version__
+    assert result.strip().endswith(str(__version__))
@@ -8,7 +8,29 @@
 
 """
 
-from .api import load_service_from_json, guess_service_json_file
+import os
+import inspect
+
+from peak.util.imports import lazyModule
+
+# ymir.api pulls in boto, fabric, jinja and the schemas.  loading
+# it lazily keeps `import ymir` cheap for the command line tool
+yapi = lazyModule('ymir.api')
+
+
+def load_service_from_json(*args, **kargs):
+    """ see ymir.api.load_service_from_json """
+    return yapi.load_service_from_json(*args, **kargs)
+
+
+def guess_service_json_file(base_dir=None, **kargs):
+    """ see ymir.api.guess_service_json_file """
+    if base_dir is None:
+        # the guess is relative to the fabfile calling this
+        caller = inspect.getmodule(inspect.stack()[1][0])
+        base_dir = os.path.dirname(caller.__file__)
+    return yapi.guess_service_json_file(base_dir=base_dir, **kargs)
+
 
 # from ymir import loom
 __all__ = [x.__name__ for x in [
@@ -3,19 +3,28 @@
 """
 import os
 import re
+import json
+import time
 
-import demjson
 from fabric.colors import yellow
 from voluptuous import Optional, Undefined
 
 from ymir import util
+from ymir import caching
 from ymir.base import report as base_report
 from ymir import schema as yschema
+from ymir.version import __version__
 
 import jinja2
 
 jinja_env = jinja2.Environment(undefined=jinja2.StrictUndefined)
 
+# compiled templates, keyed by source string.  the same strings are
+# rendered over and over again, once per call to template_data()
+TEMPLATE_CACHE_SIZE = 1024
+template_cache = jinja2.utils.LRUCache(TEMPLATE_CACHE_SIZE)
+TEMPLATE_MARKERS = ['{{', '{%', '{#']
+
 guess_service_json_file = util.guess_service_json
 
 
@@ -23,13 +32,29 @@ class ReflectionError(Exception):
     pass
 
 
+def _is_template(obj):
+    """ strings without any jinja markers render to themselves """
+    return any(marker in obj for marker in TEMPLATE_MARKERS)
+
+
+def _get_template(obj):
+    """ returns compiled template for the given source string """
+    try:
+        return template_cache[obj]
+    except KeyError:
+        template = template_cache[obj] = jinja_env.from_string(obj)
+        return template
+
+
 def str_reflect(obj, ctx, simple=True):
     """ when `simple` is true, lazy JIT params like host/username/pem need
         not be resolved and certain errors are allowed
     """
     pattern = r"'([A-Za-z0-9_\./\\-]*)'"
+    if not _is_template(obj):
+        return obj
     try:
-        return jinja_env.from_string(obj).render(**ctx)
+        return _get_template(obj).render(**ctx)
     except jinja2.UndefinedError as err:
         lazy_keys = ['host', 'username', 'pem']
         group = re.search(pattern, str(err)).group().replace("'", '')
@@ -89,22 +114,38 @@ def load_json(fname):
                "variable and retry this operation.")
         raise SystemExit(err.format(util.unexpand(fname)))
     with open(fname) as fhandle:
-        tmp = demjson.decode(fhandle.read())
+        tmp = util.jsonc.decode(fhandle.read())
     return tmp
 
 
-def load_service_from_json(filename=None, quiet=False, die=True):
+def load_service_from_json(filename=None, quiet=False, die=True,
+                           compiled=True):
     """ return a service object from ymir-style service.json file.
         when filename is not given it will be guessed based on cwd.
+        when `compiled` is true, a compiled service description
+        is used if its inputs have not changed (see `compile_service`).
+        only `ymir compile` creates that file, but once it exists it
+        is kept up to date here
     """
     service_json_file = filename or util.get_or_guess_service_json_file(
         insist=True)
     # report('ymir.api', 'service.json is {0}'.format(
     #    util.unexpand(service_json_file)))
-    service_obj = _load_service_from_json_helper(
-        service_json_file=service_json_file,
-        service_json=load_json(service_json_file),
-        quiet=quiet, die=die)
+    service_obj = None
+    if compiled:
+        service_obj = load_compiled_service(service_json_file, quiet=quiet)
+    if service_obj is None:
+        service_json = load_json(service_json_file)
+        service_obj = _load_service_from_json_helper(
+            service_json_file=service_json_file,
+            service_json=service_json,
+            quiet=quiet, die=die)
+        # validation failures are fatal only when `die` is set,
+        # so otherwise there's no guarantee the result is valid
+        if compiled and die and os.path.exists(
+                compiled_service_file(service_json_file)):
+            _write_compiled_service(
+                service_json_file, service_json, service_obj)
     # trigger the caching of some config values now,
     # just to print the message as early as possible
     service_obj._debug_mode
@@ -159,6 +200,16 @@ def _load_service_from_json_helper(service_json_file=None,
     service_json = set_schema_defaults(service_json, chosen_schema)
 
     service_json = _reflect(service_json)
+    service_json = set_schema_defaults(service_json, chosen_schema)
+    return _build_service(
+        service_json_file, service_json, chosen_schema, report=report)
+
+
+def _build_service(service_json_file, service_json, chosen_schema,
+                   report=base_report):
+    """ builds the service object from validated, defaulted
+        and reflected service json
+    """
     classname = str(service_json["name"])
     BaseService = chosen_schema.get_service_class(service_json)
     report('ymir.api', 'chose service class: {0}'.format(
@@ -167,6 +218,125 @@ def _load_service_from_json_helper(service_json_file=None,
                            dict(service_json_file=service_json_file))
     obj = ServiceFromJSON(service_json_file=service_json_file)
     obj._schema = chosen_schema
-    service_json = set_schema_defaults(service_json, chosen_schema)
-    ServiceFromJSON._service_json = service_json
+    obj._service_json = service_json
     return obj
+
+
+# files modified this close to being stamped might change again
+# without their mtime changing, so their mtime isn't trusted
+RACY_SECONDS = 2
+
+
+def compiled_service_file(service_json_file):
+    """ compiled service descriptions are kept in the
+        cache directory next to the source file
+    """
+    service_root, fname = os.path.split(os.path.abspath(service_json_file))
+    return os.path.join(
+        service_root, caching.CACHE_DIR, fname + '.compiled')
+
+
+def _input_stamp(fname):
+    """ """
+    stat = os.stat(fname)
+    return dict(
+        path=os.path.abspath(fname), stamped=time.time(),
+        mtime=stat.st_mtime, size=stat.st_size,
+        sha1=util.hashing.hash_path(fname))
+
+
+def _inputs_unchanged(stamps):
+    """ mtime and size are checked first because they are cheap.  if
+        those differ, the file may have only been touched, so compare
+        the content hash before deciding that it changed
+    """
+    for stamp in stamps:
+        try:
+            stat = os.stat(stamp['path'])
+        except OSError:
+            return False
+        racy = stamp['mtime'] >= stamp['stamped'] - RACY_SECONDS
+        if not racy and stat.st_mtime == stamp['mtime'] and \
+                stat.st_size == stamp['size']:
+            continue
+        if util.hashing.hash_path(stamp['path']) != stamp['sha1']:
+            return False
+    return True
+
+
+def _compiled_inputs(service_json_file, service_json):
+    """ files which the compiled service depends on """
+    inputs = [service_json_file]
+    if service_json.get('extends'):
+        # NB: `extends` is resolved relative to the working directory
+        inputs.append(service_json['extends'])
+    return [_input_stamp(fname) for fname in inputs]
+
+
+def _write_compiled_service(service_json_file, service_json, service_obj):
+    """ writes the compiled form of `service_obj`.  this is only
+        an optimization, so failing to write it is not an error
+    """
+    compiled = dict(
+        ymir_version=__version__,
+        cwd=os.getcwd() if service_json.get('extends') else None,
+        inputs=_compiled_inputs(service_json_file, service_json),
+        schema=service_obj._schema.schema_name,
+        service_json_file=service_obj.service_json_file,
+        service_json=service_obj._service_json)
+    fname = compiled_service_file(service_json_file)
+    tmp_fname = '{0}.{1}'.format(fname, os.getpid())
+    try:
+        if not os.path.exists(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        with open(tmp_fname, 'w') as fhandle:
+            json.dump(compiled, fhandle)
+        os.rename(tmp_fname, fname)
+    except (IOError, OSError, TypeError, ValueError):
+        # i.e. a read-only service root, or values json can't encode
+        try:
+            os.remove(tmp_fname)
+        except OSError:
+            pass
+        return None
+    return fname
+
+
+def load_compiled_service(service_json_file, quiet=False):
+    """ returns a service object built from the compiled service
+        description, or None if that is missing or out of date
+    """
+    fname = compiled_service_file(service_json_file)
+    try:
+        with open(fname) as fhandle:
+            compiled = json.load(fhandle)
+    except (IOError, ValueError):
+        return None
+    fresh = (compiled.get('ymir_version') == __version__ and
+             compiled.get('cwd') in [None, os.getcwd()] and
+             compiled.get('schema') in yschema.schemas and
+             _inputs_unchanged(compiled.get('inputs', [])))
+    if not fresh:
+        return None
+    report = util.NOOP if quiet else base_report
+    report('ymir.api', 'using compiled service description')
+    return _build_service(
+        compiled['service_json_file'], compiled['service_json'],
+        yschema.schemas[compiled['schema']], report=report)
+
+
+def compile_service(service_json_file, quiet=False):
+    """ validates, defaults and reflects the given service.json, then
+        writes the result where `load_service_from_json` will find it.
+        returns the name of the compiled file
+    """
+    service_json = load_json(service_json_file)
+    service_obj = _load_service_from_json_helper(
+        service_json_file=service_json_file,
+        service_json=service_json, quiet=quiet)
+    fname = _write_compiled_service(
+        service_json_file, service_json, service_obj)
+    if fname is None:
+        raise SystemExit("could not write {0}".format(
+            compiled_service_file(service_json_file)))
+    return fname
@@ -6,6 +6,8 @@ import sys
 
 from pyterminalsize import get_terminal_size
 
+from ymir import events
+
 
 def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
@@ -28,6 +30,7 @@ class Reporter(object):
         name = name.replace('_', '')
         eprint(template.format(
             name, msg, args or ''))
+        events.report(name, msg)
 
 
 def report(title, msg, *args, **kargs):
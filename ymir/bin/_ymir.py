@@ -9,11 +9,23 @@ from argparse import ArgumentParser
 
 from ymir.base import report
 from ymir.version import __version__
-from ymir.commands import (
-    ymir_init, ymir_sg, ymir_list,
-    ymir_eip, ymir_keypair, ymir_shell, ymir_validate)
 logger = logging.getLogger(__name__)
 
+# subcommand -> function in ymir.commands.  that module is only imported
+# when one of these runs, so `ymir version` and `ymir help` stay cheap
+SUBCOMMANDS = dict(
+    eip='ymir_eip',
+    compile='ymir_compile',
+    security_group='ymir_sg',
+    init='ymir_init',
+    validate='ymir_validate',
+    keypair='ymir_keypair',
+    shell='ymir_shell',
+    list='ymir_list',
+    fleet='ymir_fleet',
+    monitor='ymir_monitor',
+)
+
 LOG_LEVELS = [logging.CRITICAL,  # 50
               logging.ERROR,  # 40
               logging.WARNING,  # 30
@@ -26,6 +38,12 @@ def ymir_freeze(args):
     print 'not implemented yet'
 
 
+def get_subcommand(name):
+    """ """
+    from ymir import commands
+    return getattr(commands, SUBCOMMANDS[name])
+
+
 def get_parser():
     """ creates the parser for the ymir command line utility """
     parser = ArgumentParser(prog=os.path.split(sys.argv[0])[-1])
@@ -97,14 +115,63 @@ def get_parser():
     vpkargs.update(
         dict(nargs='?', default=''))
     validate_parser.add_argument('service_json', **vpkargs)
+    validate_parser.add_argument(
+        '--no-cache', dest='no_cache', action='store_true',
+        help='check puppet code and templates again, even if unchanged')
 
     validate_parser.set_defaults(subcommand='validate')
+
+    compile_parser = subparsers.add_parser(
+        'compile', help='rebuild the compiled form of service.json')
+    compile_parser.add_argument(
+        'service_json', metavar='service_json', type=str,
+        nargs='?', default='', help='service json to compile')
+    compile_parser.set_defaults(subcommand='compile')
     init_parser = subparsers.add_parser('init', help='init ymir project')
     init_parser.add_argument('init_dir', metavar='directory', type=str,
                              help='a (new) directory to initial a ymir project in')
     init_parser.add_argument('-f', '--force', action='store_true',
                              help='force overwrite even if directory exists')
     init_parser.set_defaults(subcommand='init')
+    fleet_parser = subparsers.add_parser(
+        'fleet', help='run one operation across many services')
+    fleet_parser.set_defaults(subcommand='fleet')
+    fleet_parser.add_argument(
+        'operation', metavar='operation', type=str,
+        help='operation to run, in fab syntax (i.e. "check:failfast=1")')
+    fleet_parser.add_argument(
+        '-g', '--glob', action='append', default=None,
+        help='glob for service descriptions (default: */service.json)')
+    fleet_parser.add_argument(
+        '-t', '--tag', action='append', default=None,
+        help='only services with this tag (may be repeated)')
+    fleet_parser.add_argument(
+        '-e', '--env', dest='env_name', default=None,
+        help='only services with this env_name')
+    fleet_parser.add_argument(
+        '-j', '--jobs', type=int, default=None,
+        help='maximum number of services to run at once (default: 4)')
+    fleet_parser.add_argument(
+        '--log-dir', dest='log_dir', default=None,
+        help='directory for per-service logs (default: .ymir_cache/fleet)')
+    monitor_parser = subparsers.add_parser(
+        'monitor', help='run health checks continuously')
+    monitor_parser.set_defaults(subcommand='monitor')
+    monitor_parser.add_argument(
+        'service_json', metavar='service_json', type=str,
+        nargs='?', default='', help='service json to monitor')
+    monitor_parser.add_argument(
+        '-n', '--name', default=None,
+        help='only monitor the health check with this name')
+    monitor_parser.add_argument(
+        '-i', '--interval', type=float, default=60,
+        help='seconds between runs of each check (default: 60)')
+    monitor_parser.add_argument(
+        '--jitter', type=float, default=0.1,
+        help='random spread, as a fraction of interval (default: 0.1)')
+    monitor_parser.add_argument(
+        '-p', '--prometheus', type=int, default=None, metavar='PORT',
+        help='serve prometheus metrics instead of printing JSON lines')
     freeze_parser = subparsers.add_parser(
         'freeze', help='freeze ymir service (must be running)')
     freeze_parser.set_defaults(subcommand='freeze')
@@ -134,24 +201,18 @@ def entry(settings=None):
         level=level,
         format="%(levelname)s [%(filename)s:%(lineno)s] %(message)s",
     )
-    subcommand_map = dict(
-        help=lambda args: parser.print_help(),
-        eip=ymir_eip,
-        security_group=ymir_sg,
-        init=ymir_init,
-        validate=ymir_validate,
-        keypair=ymir_keypair,
-        freeze=ymir_freeze,
-        shell=ymir_shell,
-        list=ymir_list,
-    )
     logger.debug('log level is: {0}'.format(level))
     if args.subcommand == 'sg':
         args.subcommand = 'security_group'
     if args.subcommand == 'version':
         print '{0}'.format(__version__)
         return
-    subcommand_map[args.subcommand](args)
+    if args.subcommand == 'help':
+        parser.print_help()
+        return
+    if args.subcommand == 'freeze':
+        return ymir_freeze(args)
+    get_subcommand(args.subcommand)(args)
 
 if __name__ == '__main__':
     entry()
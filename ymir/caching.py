@@ -4,28 +4,42 @@
     dumb lightweight caching decorators, etc.
 
     `cached` requires werkzeug, but at least avoids a
-    memcache dependency.
+    memcache dependency.  `disk_cache` uses the same
+    werkzeug machinery, but is shared between processes.
+    `ContentCache` is for results keyed by content hashes.
 
 """
+import os
+import json
+import threading
 from functools import wraps
-from werkzeug.contrib.cache import SimpleCache
+from werkzeug.contrib.cache import SimpleCache, FileSystemCache
+
+# directory (relative to the service root) for caches
+# that need to survive between separate `fab` invocations
+CACHE_DIR = '.ymir_cache'
 
 
 def cached(key_or_fxn, timeout=5 * 60):
     """ dumb hack adapted from
         http://flask.pocoo.org/docs/patterns/viewdecorators/
+
+        `key_or_fxn` is either a fixed key, or a function which is
+        called with the decorated function's arguments and returns one
     """
     from ymir import caching as c
     if not getattr(c, 'CACHE', None):
         c.CACHE = SimpleCache()
     cache = c.CACHE
     if isinstance(key_or_fxn, basestring):
-        cache_key_fxn = lambda: key_or_fxn
+        cache_key_fxn = lambda *args, **kwargs: key_or_fxn
+    else:
+        cache_key_fxn = key_or_fxn
 
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            tmp2 = cache_key_fxn()
+            tmp2 = cache_key_fxn(*args, **kwargs)
             rv = cache.get(tmp2)
             if rv is not None:
                 return rv
@@ -34,3 +48,68 @@ def cached(key_or_fxn, timeout=5 * 60):
             return rv
         return decorated_function
     return decorator
+
+
+def disk_cache(service_root, namespace):
+    """ returns a cache stored under the given service root.
+        unlike `cached`, values here are visible to other
+        processes, so they must be picklable
+    """
+    return FileSystemCache(
+        os.path.join(service_root, CACHE_DIR, namespace),
+        threshold=100)
+
+
+class ContentCache(object):
+    """ JSON-able results keyed by content hashes, stored in one file
+        under the service root.  such results never go stale, so nothing
+        expires.  instead, `save` drops entries which weren't used since
+        the cache was loaded, so that the file doesn't grow forever
+    """
+
+    def __init__(self, service_root, name, enabled=True):
+        self.fname = os.path.join(service_root, CACHE_DIR, name + '.json')
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self._data = None
+        self._used = {}
+
+    def _load(self):
+        if self._data is None:
+            try:
+                with open(self.fname) as fhandle:
+                    self._data = json.load(fhandle)
+            except (IOError, OSError, ValueError):
+                self._data = {}
+        return self._data
+
+    def get(self, key):
+        """ returns the cached value, or None.  with `enabled`
+            false, this always misses but `set` still works
+        """
+        with self.lock:
+            if not self.enabled or key not in self._load():
+                return None
+            self._used[key] = self._data[key]
+            return self._used[key]
+
+    def set(self, key, value):
+        """ """
+        with self.lock:
+            self._used[key] = value
+
+    def save(self):
+        """ writes every entry used since loading.  this is only
+            an optimization, so failing to write is not an error
+        """
+        with self.lock:
+            try:
+                if not os.path.exists(os.path.dirname(self.fname)):
+                    os.makedirs(os.path.dirname(self.fname))
+                tmp_fname = '{0}.{1}'.format(self.fname, os.getpid())
+                with open(tmp_fname, 'w') as fhandle:
+                    json.dump(self._used, fhandle)
+                os.rename(tmp_fname, self.fname)
+            except (IOError, OSError):
+                return False
+            return True
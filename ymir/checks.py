@@ -11,19 +11,67 @@
    is fine or a string if there is an error.  Find the ".validate" assignments
    below for further example.
 """
+import os
+import json as _json
+import time
+import pipes
+import Queue
+import atexit
+import urlparse
+import tempfile
+import threading
+import contextlib
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
 import requests
-from tempfile import NamedTemporaryFile
+from requests.packages.urllib3.util.retry import Retry
 
-import testinfra as testinfra_mod
 from fabric.colors import blue, yellow
 from peak.util.imports import lazyModule
 
 from ymir import util
+from ymir import events
 from ymir import data as ydata
 import yurl
 
-backend_cache = {}
+# testinfra backends are shared by every worker in `run_checks`.
+# this guards the pool's bookkeeping, while connecting is serialized
+# per host (see `BackendPool.lease`)
+backend_lock = threading.RLock()
 yapi = lazyModule('ymir.api')
+# testinfra is slow to import, and only needed for testinfra checks
+testinfra_mod = lazyModule('testinfra')
+
+# defaults for the concurrent check engine, see `run_checks`
+CHECK_WORKERS = 8
+CHECK_DEADLINE = 60
+
+# see `BackendPool`
+BACKEND_POOL_SIZE = 8
+BACKEND_IDLE_CHECK = 30
+
+# remote checks which `run_checks` evaluates together,
+# using one generated script and a single SSH exec
+BATCHED_CHECK_TYPES = ['file_exists', 'file_contains', 'socket_listening']
+
+# http checks share one pooled session per (scheme, host), so that
+# repeated checks against the same host reuse their connections
+session_cache = {}
+session_lock = threading.Lock()
+HTTP_POOL_SIZE = CHECK_WORKERS
+# only connection failures are retried.  a read timeout means the
+# request reached the server, so retrying it would re-send the request
+# and turn one `timeout` into several before the check could fail
+HTTP_RETRIES = Retry(total=2, connect=2, read=0, backoff_factor=0.5)
+
+# per-check settings which may be given for http checks in the
+# `health_check_options` field of service.json, with their defaults
+HTTP_CHECK_OPTIONS = dict(timeout=10, allow_redirects=False)
+
+# options in `health_check_options` which every check accepts.  these
+# are for the scheduler in `ymir.monitor`, not for the checker itself
+SCHEDULE_OPTIONS = ['interval']
 
 
 class InvalidCheckType(RuntimeError):
@@ -36,48 +84,277 @@ class InvalidCheck(RuntimeError):
 
 class Check(object):
 
-    def __init__(self, name=None, check_type=None, url_t=None):
+    def __init__(self, name=None, check_type=None, url_t=None, options=None):
         self.name = name
         self.check_type = check_type
         self.url_t = url_t
+        self.options = dict(options or {})
+        self.interval = self.options.pop('interval', None)
+        self.url = url_t
         self.failed = None
         self.success = None
+        self.message = None
+        self.duration = None
 
     def __repr__(self):  # pragma: nocover
         return "<Check: {0}>".format(self.name)
     __str__ = __repr__
 
-    def run(self, service, quiet=False):
+    def _prepare(self, data):
+        """ renders the url and resolves the checker function.
+            returns the checker, which is safe to call from any thread
+        """
         import ymir.checks as modyool
-        data = service.template_data()
-        data.update(service.facts)
         self.url = yapi.str_reflect(self.url_t, ctx=data)
-
         try:
-            checker = getattr(modyool, self.check_type.replace('-', '_'))
+            return getattr(modyool, self.check_type.replace('-', '_'))
         except AttributeError:
             err = 'Cannot find checker "{0}"'.format(
                 self.check_type, self.url)
             raise InvalidCheckType(err)
 
-        _url, success, message = checker(service, self.url)
+    def _record(self, success, message, duration=None):
+        """ """
         self.success = success
         self.failed = not self.success
+        self.message = message
+        self.duration = duration
+        return self
+
+    def _emit(self, service):
+        """ emits the last result as a `check` event """
+        events.emit(
+            'check', service=service._report_name(), check=self.name,
+            check_type=self.check_type, url=self.url,
+            outcome='ok' if self.success else 'fail',
+            message=self.message or '', duration=self.duration)
+
+    def report(self):
+        """ """
+        util.eprint('  {4} [{0}] {1}{2} {3} '.format(
+            yellow(self.name),
+            blue(self.check_type + '://'),
+            self.url,
+            self.message if self.message else '',
+            ydata.FAIL + 'fail' if not self.success else ydata.SUCCESS + 'ok'
+        ))
+
+    def run(self, service, quiet=False):
+        checker = self._prepare(_check_context(service))
+        start = time.time()
+        _url, success, message = checker(service, self.url, **self.options)
+        self._record(success, message, time.time() - start)
+        self._emit(service)
         if not quiet:
-            print '  {4} [{0}] {1}{2} {3} '.format(
-                yellow(self.name),
-                blue(self.check_type + '://'),
-                self.url,
-                message if message else '',
-                ydata.FAIL + 'fail' if not success else ydata.SUCCESS + 'ok'
-            )
+            self.report()
         return self
 
 
+def _check_context(service):
+    """ template context for rendering check urls """
+    data = util.thaw(service.template_data())
+    data.update(service.facts)
+    return data
+
+
+def run_checks(service, check_objs, workers=CHECK_WORKERS,
+               deadline=CHECK_DEADLINE, failfast=False, quiet=False,
+               context=None):
+    """ runs the given checks concurrently on a bounded thread pool.
+
+        results are recorded (and reported, unless `quiet`) in the order
+        the checks were given, after they have all finished.  checks which
+        are still running when `deadline` (in seconds, 0 for no deadline)
+        passes are recorded as failures.  with `failfast`, the first failure
+        cancels every check which has not finished yet.  check urls are
+        rendered with `context`, which is looked up from the service
+        (i.e. its status) when it isn't given.
+    """
+    if not check_objs:
+        return check_objs
+    data = _check_context(service) if context is None else context
+    checkers = [check_obj._prepare(data) for check_obj in check_objs]
+    done = Queue.Queue()
+    cancelled = threading.Event()
+    batched = [index for index, check_obj in enumerate(check_objs)
+               if _check_type(check_obj) in BATCHED_CHECK_TYPES]
+
+    def work(index):
+        if cancelled.is_set():
+            return
+        start = time.time()
+        try:
+            check_obj = check_objs[index]
+            _url, success, message = checkers[index](
+                service, check_obj.url, **check_obj.options)
+        except Exception as exc:
+            success, message = False, str(exc)
+        done.put((index, success, message, time.time() - start))
+
+    def work_batch():
+        if cancelled.is_set():
+            return
+        start = time.time()
+        try:
+            results = run_remote_batch(
+                service, [check_objs[index] for index in batched])
+        except Exception as exc:
+            results = [(False, str(exc))] * len(batched)
+        for index, (success, message) in zip(batched, results):
+            done.put((index, success, message, time.time() - start))
+
+    jobs = [index for index in range(len(check_objs))
+            if index not in batched]
+    pool = ThreadPool(max(1, min(workers, len(jobs) + bool(batched))))
+    if batched:
+        pool.apply_async(work_batch)
+    for index in jobs:
+        pool.apply_async(work, (index,))
+    # no join: abandoned workers are daemon threads and
+    # must not be allowed to hold up the report
+    pool.close()
+    results = {}
+    reason = 'deadline of {0}s exceeded'.format(deadline)
+    stop_at = time.time() + deadline if deadline else None
+    while len(results) < len(check_objs):
+        # NB: Queue.get without a timeout can't be interrupted with ^C
+        timeout = 60 * 60 if stop_at is None else stop_at - time.time()
+        if timeout <= 0:
+            break
+        try:
+            index, success, message, duration = done.get(timeout=timeout)
+        except Queue.Empty:
+            break
+        results[index] = (success, message, duration)
+        if failfast and not success:
+            cancelled.set()
+            reason = 'cancelled (failfast)'
+            break
+    for index, check_obj in enumerate(check_objs):
+        check_obj._record(*results.get(index, (False, reason)))
+        check_obj._emit(service)
+        if not quiet:
+            check_obj.report()
+    return check_objs
+
+
+def _check_type(check_obj):
+    """ """
+    return check_obj.check_type.replace('-', '_')
+
+
+def _remote_test(check_obj):
+    """ the shell test for a batched check, or None for checks
+        which are evaluated locally using `netstat` output
+    """
+    check_type = _check_type(check_obj)
+    if check_type == 'file_exists':
+        return 'test -e {0}'.format(pipes.quote(check_obj.url))
+    elif check_type == 'file_contains':
+        fname, string = check_obj.url.split(',')
+        # same as testinfra's File.contains
+        return 'grep -qs -- {0} {1}'.format(
+            pipes.quote(string), pipes.quote(fname))
+
+
+def remote_check_script(check_objs):
+    """ returns a shell script which prints one line of JSON, like
+        {"uname": .., "results": {"<index>": bool, ..}, "netstat": ..}
+    """
+    out = ["""printf '{"uname": "%s", "results": {' "$(uname -s)" """]
+    sep = ''
+    for index, check_obj in enumerate(check_objs):
+        try:
+            test = _remote_test(check_obj)
+        except ValueError:
+            # malformed, see `run_remote_batch`
+            continue
+        if test is None:
+            continue
+        out.append('if {0} >/dev/null 2>&1; '
+                   'then result=true; else result=false; fi'.format(test))
+        out.append("""printf '{0}"{1}": %s' $result""".format(sep, index))
+        sep = ', '
+    out.append("""printf '}, "netstat": "'""")
+    if any(_check_type(x) == 'socket_listening' for x in check_objs):
+        # json-escape the output, which contains tabs and newlines
+        out.append(
+            r"""netstat -n -l -t -u --unix 2>/dev/null | tr '\t' ' ' | """
+            r"""sed -e 's/\\/\\\\/g' -e 's/"/\\"/g' | """
+            r"""awk '{printf "%s\\n", $0}'""")
+    out.append(r"""printf '"}\n'""")
+    return '\n'.join(out)
+
+
+def _socket_listening_from_netstat(socketspec, netstat):
+    """ testinfra's own Socket logic, replayed against the
+        netstat output which was captured by the remote script
+    """
+    from testinfra.backend.base import CommandResult
+    from testinfra.modules.socket import LinuxSocket
+
+    class Replay(object):
+        def run(self, command, *args, **kargs):
+            return CommandResult(self, 0, netstat, '', command,
+                                 stdout=netstat, stderr='')
+    socket = type('Socket', (LinuxSocket,), dict(_backend=Replay()))
+    return socket(socketspec).is_listening
+
+
+def run_remote_batch(service, check_objs):
+    """ evaluates the given checks with a single SSH exec.
+        returns [(success, message), ..] in the same order
+    """
+    with _testinfra_backend(service) as backend:
+        result = backend.run(remote_check_script(check_objs))
+    lines = [line for line in result.stdout.splitlines()
+             if line.startswith('{')]
+    if result.rc != 0 or not lines:
+        raise RuntimeError("remote checks failed: {0}".format(
+            result.stderr.strip() or result.rc))
+    batch = _json.loads(lines[-1])
+    out = []
+    for index, check_obj in enumerate(check_objs):
+        message = ''
+        if _check_type(check_obj) != 'socket_listening':
+            success = batch['results'].get(str(index))
+            if success is None:
+                success, message = False, 'malformed check'
+        elif batch['uname'] == 'Linux':
+            try:
+                success = _socket_listening_from_netstat(
+                    check_obj.url, batch['netstat'])
+            except Exception as exc:
+                success, message = False, str(exc)
+        else:
+            # netstat output differs on BSD, so ask testinfra
+            _url, success, message = socket_listening(service, check_obj.url)
+        out.append((success, message))
+    return out
+
+
+def _get_session(url):
+    """ returns the pooled session for the host in the given url """
+    parts = urlparse.urlsplit(url)
+    cache_key = (parts.scheme, parts.netloc)
+    with session_lock:
+        if cache_key not in session_cache:
+            session = requests.Session()
+            session.verify = False
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=HTTP_POOL_SIZE,
+                max_retries=HTTP_RETRIES)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session_cache[cache_key] = session
+        return session_cache[cache_key]
+
+
 def _get_request(url, **kargs):  # pragma: nocover
-    return requests.get(
-        url, timeout=10, verify=False,
-        allow_redirects=False, **kargs)
+    options = HTTP_CHECK_OPTIONS.copy()
+    options.update(kargs)
+    return _get_session(url).get(url, **options)
 
 
 def port_open(service, port):
@@ -100,7 +377,7 @@ def _port_open_validate(port):
 port_open.validate = _port_open_validate
 
 
-def http(service, url, assert_json=False, codes=[]):  # NOQA
+def http(service, url, assert_json=False, codes=[], **options):  # NOQA
     """ an ugly function but this is the single core implementation
         that drives the other checks (like http_200, http_301, etc).
         without the `NOQA` directive above git-hooks will not allow us
@@ -110,7 +387,7 @@ def http(service, url, assert_json=False, codes=[]):  # NOQA
     # might get handed ints or strings, need to normalize
     codes = map(unicode, codes)
     try:
-        resp = _get_request(url)
+        resp = _get_request(url, **options)
     except requests.exceptions.ConnectionError, e:
         success = False
         if 'timed out' in str(e):
@@ -150,26 +427,26 @@ def json(service, url, **kargs):
     return http(service, url, **kargs)
 
 
-def http_200(service, url):
-    return http(service, url, codes=[200])
+def http_200(service, url, **options):
+    return http(service, url, codes=[200], **options)
 
 
-def http_301(service, url):
-    return http(service, url, codes=[301])
+def http_301(service, url, **options):
+    return http(service, url, codes=[301], **options)
 
 
-def http_401(service, url):
-    return http(service, url, codes=[401])
+def http_401(service, url, **options):
+    return http(service, url, codes=[401], **options)
 
 
-def http_403(service, url):
+def http_403(service, url, **options):
     """ """
-    return http(service, url, codes=[403])
+    return http(service, url, codes=[403], **options)
 
 
-def json_200(service, url):
+def json_200(service, url, **options):
     """ """
-    return json(service, url, codes=[200])
+    return json(service, url, codes=[200], **options)
 
 
 def _url_validator(instruction):
@@ -178,8 +455,9 @@ def _url_validator(instruction):
     except Exception as exc:
         return str(exc)
 
-for _fxn in [json, json_200, http_200, http_301, http_401, http_403]:
+for _fxn in [http, json, json_200, http_200, http_301, http_401, http_403]:
     _fxn.validate = _url_validator
+    _fxn.options = HTTP_CHECK_OPTIONS.keys()
 
 
 def file_exists(service, instruction):
@@ -245,7 +523,10 @@ def testinfra(service, instruction, _type="testinfra"):
         ex: testinfra://File('/etc/passwd').exists
     """
     try:
-        exec('assert ' + instruction, _testinfra_namespace(service))
+        # a fresh namespace is cheap to build, because backend modules
+        # are resolved lazily and cached by the backend
+        with _testinfra_backend(service) as backend:
+            exec('assert ' + instruction, {}, _TestinfraNamespace(backend))
     except Exception as exc:
         success = False
         message = str(exc)
@@ -264,41 +545,181 @@ def _testinfra_validator(instruction):
 testinfra.validate = _testinfra_validator
 
 
-def _testinfra_backend(service):
-    """ this call is very expensive in terms of
-        time and I/O, so cache carefully
+class BackendPool(object):
+    """ testinfra backends, keyed by (host, port, user, key file).
+        each backend holds one SSH transport, which every check against
+        that host reuses.  backends idle for longer than `idle_check`
+        seconds are health-checked before reuse, and reconnect if their
+        transport died.  at most `size` backends are kept, and the least
+        recently used one is evicted to make room for a new one.  checks
+        lease backends, and an evicted backend is closed once the last
+        check using it has released it
     """
-    cache_key = id(service)
-    if cache_key in backend_cache:
-        return backend_cache[cache_key]
-    config = service._ssh_config_string
-    with NamedTemporaryFile() as tmpf:
-        tmpf.file.write(config)
-        tmpf.file.seek(0)
+
+    def __init__(self, size=BACKEND_POOL_SIZE, idle_check=BACKEND_IDLE_CHECK):
+        self.size = size
+        self.idle_check = idle_check
+        # key -> [backend, ssh_config_file, last_used, leases, evicted]
+        self._entries = OrderedDict()
+        # key -> [lock held while that backend is built or checked,
+        #         number of threads holding or waiting for the lock]
+        self._key_locks = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    @contextlib.contextmanager
+    def lease(self, key, ssh_config):
+        """ the backend for `key`, for use in the body of the
+            with-statement.  it is built when needed.  concurrent
+            checks against the same host wait for one transport to
+            connect, instead of each opening their own, but checks
+            against other hosts don't wait for it
+        """
+        entry = self._acquire(key, ssh_config)
+        try:
+            yield entry[0]
+        finally:
+            self._release(entry)
+
+    def _release(self, entry):
+        """ """
+        with backend_lock:
+            entry[3] -= 1
+            close = entry[4] and not entry[3]
+        if close:
+            self._close(entry)
+
+    def _acquire(self, key, ssh_config):
+        """ returns the entry for `key`, with a lease taken on it """
+        with backend_lock:
+            key_lock = self._key_locks.setdefault(
+                key, [threading.Lock(), 0])
+            key_lock[1] += 1
+        try:
+            with key_lock[0]:
+                return self._acquire_locked(key, ssh_config)
+        finally:
+            with backend_lock:
+                key_lock[1] -= 1
+                if not key_lock[1]:
+                    del self._key_locks[key]
+
+    def _acquire_locked(self, key, ssh_config):
+        """ """
+        # the entry is out of the pool while it's checked, so
+        # other hosts can't evict (and close) it meanwhile
+        with backend_lock:
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            entry = self._build(ssh_config)
+        elif time.time() - entry[2] > self.idle_check:
+            self._check(entry)
+        entry[2] = time.time()
+        with backend_lock:
+            entry[3] += 1
+            self._entries[key] = entry
+            closing = self._evict(len(self._entries) - self.size)
+        for old_entry in closing:
+            self._close(old_entry)
+        try:
+            entry[0].client
+        except BaseException:
+            self._release(entry)
+            raise
+        return entry
+
+    def _evict(self, count):
+        """ takes the `count` least recently used entries out of the
+            pool.  returns those which can be closed right away, the
+            others are closed when their last lease is released.
+            NB: must be called with `backend_lock` held
+        """
+        closing = []
+        for _ in range(max(0, count)):
+            entry = self._entries.popitem(last=False)[1]
+            entry[4] = True
+            if not entry[3]:
+                closing.append(entry)
+        return closing
+
+    def _build(self, ssh_config):
+        """ the ssh config file must outlive the backend,
+            because testinfra reads it again to reconnect
+        """
+        fd, config_file = tempfile.mkstemp(prefix='ymir-ssh-config-')
+        with os.fdopen(fd, 'w') as fhandle:
+            fhandle.write(ssh_config)
         backend = testinfra_mod.get_backend(
-            "paramiko://default", ssh_config=tmpf.name, sudo=True)
-        # this call is necessary to unlazy-ify the testinfra
-        # backend before we leave the context manager
-        backend.get_module('File')
-        backend_cache[cache_key] = backend
-        return backend
-
-
-def _testinfra_namespace(service):
-    """ testinfra primitives like {File, Package, Service} etc are defined differently
-        for each backend, so they cannot be imported directly.  need to create a
-        namespace containing all of these primitives, so one has to use inspection
-        to avoid listing them out explicitly.
+            "paramiko://default", ssh_config=config_file, sudo=True)
+        return [backend, config_file, time.time(), 0, False]
+
+    def _check(self, entry):
+        """ drops dead transports.  testinfra connects
+            again lazily, on the next command.  transports
+            which are still leased by other checks are kept
+        """
+        backend = entry[0]
+        client = backend._client
+        if client is None or entry[3]:
+            return
+        transport = client.get_transport()
+        try:
+            healthy = transport is not None and transport.is_active()
+            if healthy:
+                transport.send_ignore()
+        except Exception:
+            healthy = False
+        if not healthy:
+            client.close()
+            backend._client = None
+
+    def _close(self, entry):
+        """ """
+        backend, config_file = entry[:2]
+        if backend._client is not None:
+            backend._client.close()
+            backend._client = None
+        if os.path.exists(config_file):
+            os.remove(config_file)
+
+    def clear(self):
+        """ closes every backend which isn't leased, and the
+            others as soon as they are released
+        """
+        with backend_lock:
+            closing = self._evict(len(self._entries))
+        for entry in closing:
+            self._close(entry)
+
+backend_pool = BackendPool()
+atexit.register(backend_pool.clear)
+
+
+class _TestinfraNamespace(dict):
+    """ testinfra primitives like {File, Package, Service} etc are defined
+        differently for each backend, so they cannot be imported directly.
+        this resolves them from the backend only when a check uses them.
+        NB: only mappings used as `locals` for exec get this treatment
+    """
+
+    def __init__(self, backend):
+        super(_TestinfraNamespace, self).__init__()
+        self.backend = backend
+
+    def __missing__(self, name):
+        if name[0].isupper() and '_' not in name and \
+                hasattr(testinfra_mod.modules, name):
+            value = self[name] = self.backend.get_module(name)
+            return value
+        raise KeyError(name)
+
+
+def _testinfra_backend(service):
+    """ the pooled testinfra backend for this service,
+        leased for the body of a with-statement
     """
-    cache_key = -id(service)
-    if cache_key in backend_cache:
-        return backend_cache[cache_key]
-    backend = _testinfra_backend(service)
-    namespace = [
-        x for x in dir(testinfra_mod.modules)
-        if '_' not in x and x[0].upper() == x[0]]
-    namespace = dict(
-        [[name, backend.get_module(name)]
-         for name in namespace])
-    backend_cache[cache_key] = namespace
-    return namespace
+    key = (service._host, str(service._port),
+           service._username, service._pem)
+    util.mux.use_master(service._username, service._host, service._port)
+    return backend_pool.lease(key, service._ssh_config_string)
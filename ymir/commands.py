@@ -9,12 +9,12 @@ import copy
 import logging
 
 import boto
-import demjson
 
 from fabric.colors import red
 from fabric.contrib.console import confirm
 
 from ymir import util
+from ymir import fleet
 from ymir import api as yapi
 from ymir import validation
 from ymir.schema import SGFileSchema
@@ -49,7 +49,7 @@ def ymir_sg(args):
         err = 'security group json @ "{0}" does not exist'.format(fname)
         raise SystemExit(err)
     with open(fname) as fhandle:
-        json = demjson.decode(fhandle.read())
+        json = util.jsonc.decode(fhandle.read())
     logger.debug("loaded json from {0}".format(fname))
     logger.debug(json)
     SGFileSchema(json)
@@ -99,7 +99,8 @@ def ymir_validate(args):
             tmp_args.service_json = default_vagrant_json
             ymir_validate(tmp_args)
     elif args.service_json:
-        validation.validate(args.service_json, simple=False)
+        validation.validate(
+            args.service_json, simple=False, cache=not args.no_cache)
 
 
 def ymir_shell(args):
@@ -117,6 +118,16 @@ def ymir_shell(args):
     embed(user_ns=user_ns,)
 
 
+def ymir_compile(args):
+    """ responsible for executing the 'ymir compile' command, which
+        rebuilds the compiled form of a service description
+    """
+    service_json_file = _service_json_file(args)
+    fname = yapi.compile_service(service_json_file, quiet=True)
+    report("compiled {0} -> {1}".format(
+        util.unexpand(service_json_file), util.unexpand(fname)))
+
+
 def ymir_init(args):
     """ responsible for executing the 'ymir init' command. """
     init_dir = os.path.abspath(args.init_dir)
@@ -153,7 +164,7 @@ def ymir_list(args):
     if args.keypairs:
         print util.aws.get_keypair_names()
     elif args.instances:
-        print util.show_instances()
+        util.aws.show_instances()
     else:
         msg = "not sure what to list."
         raise SystemExit(msg)
@@ -194,6 +205,69 @@ def ymir_eip(args):
     print addr.allocation_id
 
 
+def ymir_fleet(args):
+    """ responsible for executing the 'ymir fleet' command,
+        which runs one operation across many services
+    """
+    service_json_files = fleet.find_service_files(
+        patterns=args.glob, tags=args.tag, env_name=args.env_name)
+    if not service_json_files:
+        raise SystemExit("no service descriptions matched")
+    name, _, kargs = fleet.parse_operation(args.operation)
+    if name == 'sync_tags':
+        # tags are reconciled for every service at once, with
+        # batched AWS calls, rather than one service per process
+        results = fleet.sync_tags(
+            service_json_files,
+            dry_run=util.is_true(kargs.get('dry_run')),
+            prune=util.is_true(kargs.get('prune')))
+        for result in results:
+            print '{0}: {1}'.format(
+                result['name'], ', '.join(result['changes']) or
+                result['error'] or 'unchanged')
+    else:
+        jobs = args.jobs or fleet.DEFAULT_JOBS
+        report("running `{0}` for {1} services ({2} at a time)".format(
+            args.operation, len(service_json_files), jobs))
+        results = fleet.run_fleet(
+            service_json_files, args.operation,
+            jobs=jobs, log_dir=args.log_dir)
+        for line in fleet.summary_table(results):
+            print line
+    failures = [result for result in results if not result['success']]
+    if failures:
+        raise SystemExit("{0} of {1} services failed".format(
+            len(failures), len(results)))
+
+
+def _service_json_file(args):
+    """ the service description named on the command line,
+        in $YMIR_SERVICE_JSON, or ./service.json, as an absolute path
+    """
+    service_json_file = os.path.abspath(
+        args.service_json or os.environ.get('YMIR_SERVICE_JSON') or
+        os.path.join(os.getcwd(), 'service.json'))
+    if not os.path.exists(service_json_file):
+        err = ('either filename should be passed, '
+               '$YMIR_SERVICE_JSON must be set, '
+               'or ./service.json should exist')
+        report(err)
+        raise SystemExit(1)
+    return service_json_file
+
+
+def ymir_monitor(args):
+    """ responsible for executing the 'ymir monitor' command, which
+        runs a service's health checks continuously
+    """
+    service_json_file = _service_json_file(args)
+    os.chdir(os.path.dirname(service_json_file))
+    service = yapi.load_service_from_json(service_json_file)
+    service.monitor(
+        name=args.name, interval=args.interval,
+        jitter=args.jitter, prometheus=args.prometheus)
+
+
 def ymir_freeze(args):
     msg = 'not implemented yet'
     print msg
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+""" ymir.dag
+
+    ordering for setup_list and provision_list.  an entry may start
+    with an annotation naming the step and the steps it needs, i.e.
+
+        "[assets background] local://make assets"
+        "[nginx] ansible_role://nginx"
+        "[deploy after=assets,nginx] puppet://puppet/deploy.pp"
+
+    steps are applied one at a time, in the order they are listed.
+    fabric keeps its settings (prefixes, `cd`, `warn_only`, ..) in one
+    process-global env, so provisioners driven by fabric can't safely
+    share the process with each other.
+
+    `local://` steps may be marked `background`.  they run in a
+    subprocess, at most `workers` at once, while the steps after them
+    go ahead.  a step which needs the output of a background step must
+    name it in `after`, and waits for it.  every background step is
+    finished before provisioning is, and its output is reported when
+    it finishes.
+"""
+import re
+import sys
+import time
+from multiprocessing.pool import ThreadPool
+
+from ymir.data import BadProvisionInstruction
+
+# at most this many background steps run at once,
+# unless `workers` says otherwise
+PROVISION_WORKERS = 4
+
+# options which may be given in a step annotation, besides `after`
+STEP_OPTIONS = ['background']
+
+# "[name option option=value ..]" at the start of an entry
+STEP_ANNOTATION = re.compile(
+    r'^\[\s*([\w.-]+)((?:\s+[\w-]+(?:=[^\s\]]*)?)*)\s*\]\s*')
+
+
+class Step(object):
+    """ one entry from a provision list """
+
+    def __init__(self, item, index, name=None, after=None, options=None):
+        self.item = item
+        self.index = index
+        self.name = name or str(index)
+        self.after = after
+        self.options = options or {}
+        self.instruction = STEP_ANNOTATION.sub('', item, count=1)
+        self.background = bool(self.options.get('background'))
+        self.seconds = None
+
+    def __repr__(self):  # pragma: nocover
+        return "<Step {0}: {1}>".format(self.name, self.instruction)
+
+
+def parse_step(item, index):
+    """ returns a Step for a provision list entry.  `step.after`
+        is None when the entry does not mention dependencies
+    """
+    match = STEP_ANNOTATION.match(item)
+    if not match:
+        return Step(item, index, after=None)
+    name, options_str = match.groups()
+    options = {}
+    for token in options_str.split():
+        key, _, value = token.partition('=')
+        options[key] = value if '=' in token else True
+    after = options.pop('after', None)
+    unknown = set(options) - set(STEP_OPTIONS)
+    if unknown:
+        raise BadProvisionInstruction(
+            "'{0}': unknown step options {1}".format(item, sorted(unknown)))
+    if options.get('background') and not \
+            match.string[match.end():].startswith('local://'):
+        raise BadProvisionInstruction(
+            "'{0}': only local:// steps can run in the background".format(
+                item))
+    if after is True:
+        raise BadProvisionInstruction(
+            "'{0}': use after=name1,name2".format(item))
+    after = None if after is None else [x for x in after.split(',') if x]
+    return Step(item, index, name=name, after=after, options=options)
+
+
+def plan(items):
+    """ returns Steps for the given provision list, with every
+        dependency resolved to a name.  steps may only depend on
+        steps declared before them, so there are no cycles
+    """
+    steps, names, previous = [], set(), None
+    for index, item in enumerate(items):
+        step = parse_step(item, index)
+        if step.name in names:
+            raise BadProvisionInstruction(
+                "'{0}': step name `{1}` is used twice".format(
+                    item, step.name))
+        if step.after is None:
+            step.after = [previous] if previous is not None else []
+        for dep in step.after:
+            if dep not in names:
+                raise BadProvisionInstruction(
+                    "'{0}': `{1}` must be declared earlier".format(item, dep))
+        names.add(step.name)
+        steps.append(step)
+        if not step.background:
+            previous = step.name
+    return steps
+
+
+def _timed(fxn, step):
+    """ runs fxn(step) and returns (step, result, exc_info).  this
+        catches SystemExit too (fabric aborts with it), because the
+        pool would otherwise lose the worker and the result with it
+    """
+    start = time.time()
+    try:
+        return step, fxn(step), None
+    except BaseException:
+        return step, None, sys.exc_info()
+    finally:
+        step.seconds = time.time() - start
+
+
+def run_steps(steps, fxn, workers=PROVISION_WORKERS, on_done=None):
+    """ calls fxn(step) for every step, in order, from the calling
+        thread.  background steps are started on a pool of at most
+        `workers` threads instead, and steps naming them in `after`
+        wait for them.  `on_done` is called with (step, result) from the
+        calling thread.  the first failure stops new steps from starting,
+        and is raised once running background steps are finished.
+        returns { name: result }
+    """
+    on_done = on_done or (lambda step, result: None)
+    results, futures = {}, {}
+    failure = []
+    background = [step for step in steps if step.background]
+    pool = ThreadPool(max(1, min(workers, len(background)))) \
+        if background else None
+
+    def finish(step, result, exc_info):
+        if exc_info:
+            failure.append(exc_info)
+        else:
+            results[step.name] = result
+            on_done(step, result)
+
+    def collect(names, wait=True):
+        for name in names:
+            future = futures.pop(name, None)
+            if future is not None and (wait or future.ready()):
+                # NB: .get() without a timeout can't be interrupted with ^C
+                finish(*future.get(60 * 60 * 24))
+            elif future is not None:
+                futures[name] = future
+    try:
+        for step in steps:
+            collect(list(futures), wait=False)
+            collect(step.after)
+            if failure:
+                break
+            if step.background:
+                futures[step.name] = pool.apply_async(_timed, (fxn, step))
+            else:
+                finish(*_timed(fxn, step))
+        collect([step.name for step in steps])
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if failure:
+        raise failure[0][0], failure[0][1], failure[0][2]
+    return results
+
+
+def timing_report(steps):
+    """ returns lines summarizing how long each step took """
+    return ['{0:8.1f}s  [{1}] {2}{3}'.format(
+        step.seconds, step.name, step.instruction,
+        ' (background)' if step.background else '')
+        for step in steps if step.seconds is not None]
@@ -5,6 +5,7 @@ import os
 from fabric.colors import green, red, cyan, yellow
 
 STATUS_DEAD = ['terminated', 'shutting-down']
+STATUS_LIVE = ['pending', 'running', 'stopping', 'stopped']
 OK = green('  ok')
 WARN = WARNING = yellow("☛ ")
 FAIL = FAILURE = red('✖ ')
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+""" ymir.events
+
+    a machine-readable record of what ymir does.  reports, check results,
+    provisioners and commands are emitted as JSON events, i.e.
+
+        {"event": "provisioner.end", "timestamp": 1476734400.0,
+         "service": "demo_service", "operation": "provision",
+         "provisioner": "puppet", "instruction": "puppet/app.pp",
+         "duration": 81.2, "outcome": "ok"}
+
+    sinks are configured with $YMIR_EVENTS, a comma-separated list of
+
+        stdout, stderr               one JSON object per line
+        udp://host:port              one JSON datagram per event
+        file:///path/to/events.jsonl appended to, one object per line
+                                     (a plain path works too)
+
+    nothing is emitted (and commands aren't wrapped) without sinks.
+"""
+import os
+import re
+import sys
+import json
+import time
+import socket
+import threading
+import contextlib
+from functools import wraps
+
+from peak.util.imports import lazyModule
+
+from ymir import hooks
+
+# fabric is only needed once an operation runs, and
+# the command line tool should not have to load it
+api = lazyModule('fabric.api')
+
+# environment variable naming the sinks
+EVENTS_ENV = 'YMIR_EVENTS'
+
+# colour codes are stripped from reported messages
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m')
+
+# fields added to every event while an operation runs.  this is
+# global instead of thread-local so that worker threads see it too
+CONTEXT = {}
+
+# configured sinks, or None until $YMIR_EVENTS is first looked at
+_sinks = None
+_lock = threading.Lock()
+
+
+def stream_sink(stream=None):
+    """ returns a sink that writes one JSON object per line """
+    def sink(event):
+        out = stream or sys.stdout
+        out.write(json.dumps(event, sort_keys=True) + '\n')
+        out.flush()
+    return sink
+
+
+def jsonl_sink(path):
+    """ returns a sink that appends one JSON object per line to `path` """
+    path = os.path.expanduser(path)
+    if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    return stream_sink(open(path, 'a'))
+
+
+def udp_sink(host, port):
+    """ returns a sink that sends each event as a datagram.  delivery
+        isn't checked, so a missing listener never breaks an operation
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    address = (host, int(port))
+
+    def sink(event):
+        try:
+            sock.sendto(json.dumps(event, sort_keys=True), address)
+        except socket.error:
+            pass
+    return sink
+
+
+def parse_sinks(spec):
+    """ sinks for the given $YMIR_EVENTS-style string """
+    sinks = []
+    for item in [x.strip() for x in (spec or '').split(',') if x.strip()]:
+        if item == 'stdout':
+            sinks.append(stream_sink())
+        elif item == 'stderr':
+            sinks.append(stream_sink(sys.stderr))
+        elif item.startswith('udp://'):
+            host, _, port = item[len('udp://'):].rpartition(':')
+            if not host or not port.isdigit():
+                raise ValueError("expected udp://host:port, got " + item)
+            sinks.append(udp_sink(host, port))
+        else:
+            if item.startswith('file://'):
+                item = item[len('file://'):]
+            sinks.append(jsonl_sink(item))
+    return sinks
+
+
+def get_sinks():
+    """ """
+    global _sinks
+    if _sinks is None:
+        _sinks = parse_sinks(os.environ.get(EVENTS_ENV))
+    return _sinks
+
+
+def set_sinks(sinks):
+    """ replaces the configured sinks.  None means
+        they are read from $YMIR_EVENTS again
+    """
+    global _sinks
+    _sinks = sinks
+
+
+def emit(kind, **fields):
+    """ sends an event to every sink """
+    sinks = get_sinks()
+    if not sinks:
+        return
+    event = dict(CONTEXT)
+    event.update(fields)
+    event.update(event=kind, timestamp=time.time())
+    with _lock:
+        for sink in sinks:
+            sink(event)
+
+
+def report(label, msg):
+    """ emits a `report` event for a message shown to the user """
+    if not get_sinks():
+        return
+    if not isinstance(msg, basestring):
+        msg = str(msg)
+    if isinstance(msg, str):
+        msg = msg.decode('utf-8', 'replace')
+    msg = ANSI_ESCAPE.sub('', msg)
+    level = 'info'
+    for prefix, name in [(u'✖', 'fail'), (u'✓', 'ok'), (u'☛', 'warn')]:
+        if msg.startswith(prefix):
+            level = name
+    emit('report', label=label, message=msg, level=level)
+
+
+@contextlib.contextmanager
+def timed(kind, **fields):
+    """ emits `kind.start` before the body of the with-statement and
+        `kind.end`, with its duration and outcome, afterwards
+    """
+    if not get_sinks():
+        yield
+        return
+    emit(kind + '.start', **fields)
+    start = time.time()
+    try:
+        yield
+    except BaseException as exc:
+        emit(kind + '.end', duration=time.time() - start, outcome='error',
+             error=str(exc) or exc.__class__.__name__, **fields)
+        raise
+    emit(kind + '.end', duration=time.time() - start, outcome='ok',
+         **fields)
+
+
+@contextlib.contextmanager
+def _command_events(call):
+    """ `ymir.hooks` observer which emits a `command`
+        event for every fabric command
+    """
+    start = time.time()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'fail' if getattr(
+            call.get('result'), 'failed', False) else 'ok'
+    finally:
+        emit('command', function=call['function'], command=call['command'],
+             host=api.env.host_string, duration=time.time() - start,
+             outcome=outcome)
+
+
+@contextlib.contextmanager
+def operation(service, name):
+    """ runs the body of the with-statement as operation `name` of
+        `service`.  operations called from other operations are part
+        of the outer one, so only the outermost emits events
+    """
+    if CONTEXT or not get_sinks():
+        yield
+        return
+    CONTEXT.update(service=service, operation=name)
+    hooks.add_observer(_command_events)
+    try:
+        with timed('operation'):
+            yield
+    finally:
+        hooks.remove_observer(_command_events)
+        CONTEXT.clear()
+
+
+def operation_events(fxn):
+    """ method decorator, for service operations """
+    @wraps(fxn)
+    def newf(self, *args, **kargs):
+        with operation(self._report_name(), fxn.__name__):
+            return fxn(self, *args, **kargs)
+    return newf
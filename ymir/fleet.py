@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+""" ymir.fleet
+
+    run a single ymir operation across many service
+    descriptions at once, using a process pool.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import glob
+import time
+import traceback
+import multiprocessing
+
+import demjson
+from fabric.main import parse_arguments
+
+from ymir import util
+from ymir import caching
+from ymir.base import report as base_report
+
+DEFAULT_PATTERNS = ['*/service.json']
+DEFAULT_JOBS = 4
+
+_report = lambda msg: base_report('ymir.fleet', msg)
+
+
+def find_service_files(patterns=None, tags=None, env_name=None):
+    """ returns service.json files matching any of the glob `patterns`,
+        which mention all of the given `tags` and the given `env_name`
+    """
+    fnames = []
+    for pattern in patterns or DEFAULT_PATTERNS:
+        for fname in sorted(glob.glob(os.path.expanduser(pattern))):
+            fname = os.path.abspath(fname)
+            if fname not in fnames:
+                fnames.append(fname)
+    if not tags and env_name is None:
+        return fnames
+    out = []
+    for fname in fnames:
+        try:
+            json = _extended_json(fname)
+        except demjson.JSONDecodeError:
+            _report("error decoding: {0}".format(fname))
+            continue
+        except IOError as exc:
+            _report("error reading: {0}".format(exc))
+            continue
+        if not isinstance(json, dict):
+            continue
+        if env_name is not None and json.get('env_name') != env_name:
+            continue
+        if not set(tags or []).issubset(json.get('tags', [])):
+            continue
+        out.append(fname)
+    return out
+
+
+def _extended_json(service_json_file):
+    """ the service description, merged with the one it `extends`
+        (if any) the same way `ymir.api` merges them, so that
+        inherited fields count when filtering
+    """
+    json = util.jsonc.decode_file(service_json_file)
+    if isinstance(json, dict) and json.get('extends'):
+        # operations run from the service's directory (see
+        # `_run_operation`), so `extends` is relative to that
+        extends = os.path.join(
+            os.path.dirname(service_json_file),
+            os.path.expanduser(json['extends']))
+        extending = util.jsonc.decode_file(extends)
+        extending.update(**json)
+        extending.pop('extends')
+        json = extending
+    return json
+
+
+def parse_operation(operation):
+    """ parses an operation in the same format `fab` uses, i.e.
+        "check:failfast=1" -> ('check', [], {'failfast': '1'})
+    """
+    [(name, args, kargs, _, _, _)] = parse_arguments([operation])
+    return name, args, kargs
+
+
+def _log_files(log_dir, service_json_files):
+    """ one log per service, named after the path of its service
+        description below the directory that all of them share.
+        i.e. `prod/web/service.json` and `dev/web/service.json`
+        get `prod-web-service.log` and `dev-web-service.log`
+    """
+    dirs = [os.path.dirname(fname).split(os.sep)
+            for fname in service_json_files]
+    common = os.path.commonprefix(dirs)
+    if common and len(common) == min(len(path) for path in dirs):
+        # keep at least one directory in every name
+        common = common[:-1]
+    root = os.sep.join(common) or os.sep
+    return [os.path.join(log_dir, '{0}.log'.format(
+        os.path.splitext(os.path.relpath(fname, root))[0].replace(
+            os.sep, '-')))
+        for fname in service_json_files]
+
+
+def _cleanup():
+    """ pool workers exit without running atexit hooks, so the
+        temporary ssh-configs of pooled testinfra backends and
+        the ssh master connections are closed explicitly
+    """
+    from ymir import checks
+    checks.backend_pool.clear()
+    util.mux.close_masters()
+
+
+def _run_operation(job):
+    """ runs inside a pool worker.  all output for the operation,
+        including output from subprocesses, goes to the service log
+    """
+    service_json_file, operation, log_file = job
+    name, args, kargs = parse_operation(operation)
+    result = dict(
+        service_json_file=service_json_file,
+        operation=name, success=False,
+        log_file=log_file, error='')
+    start = time.time()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = os.dup(1), os.dup(2)
+    cwd = os.getcwd()
+    with open(log_file, 'a') as fhandle:
+        os.dup2(fhandle.fileno(), 1)
+        os.dup2(fhandle.fileno(), 2)
+        try:
+            from ymir import api as yapi
+            os.environ['YMIR_SERVICE_JSON'] = service_json_file
+            os.chdir(os.path.dirname(service_json_file))
+            service = yapi.load_service_from_json(service_json_file)
+            result.update(name=service._report_name())
+            if not util.is_operation(service, name):
+                raise SystemExit(
+                    "`{0}` is not a ymir operation".format(name))
+            getattr(service, name)(*args, **kargs)
+        except SystemExit as exc:
+            result.update(
+                success=exc.code in [0, None],
+                error='' if exc.code in [0, None] else str(exc.code))
+        except Exception as exc:
+            traceback.print_exc()
+            result.update(error=str(exc) or exc.__class__.__name__)
+        else:
+            result.update(success=True)
+        finally:
+            _cleanup()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_fds[0], 1)
+            os.dup2(saved_fds[1], 2)
+            for fd in saved_fds:
+                os.close(fd)
+            os.chdir(cwd)
+    result.update(duration=time.time() - start)
+    return result
+
+
+def run_fleet(service_json_files, operation, jobs=DEFAULT_JOBS, log_dir=None):
+    """ runs `operation` for every service, at most `jobs` at once.
+        returns one result dictionary per service, in the same order
+    """
+    log_dir = os.path.abspath(log_dir or os.path.join(
+        caching.CACHE_DIR, 'fleet'))
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    work = [[fname, operation, log_file] for fname, log_file in zip(
+        service_json_files, _log_files(log_dir, service_json_files))]
+    if not work:
+        return []
+    # one operation per worker process, so that nothing cached
+    # in-process (instances, ssh configs, ..) leaks between services
+    pool = multiprocessing.Pool(
+        max(1, min(jobs, len(work))), maxtasksperchild=1)
+    try:
+        # NB: .get() without a timeout can't be interrupted with ^C
+        return pool.map_async(_run_operation, work).get(60 * 60 * 24)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def sync_tags(service_json_files, dry_run=False, prune=False):
+    """ reconciles instance tags for every service at once.  instances
+        are found with one describe-instances call per account/region,
+        tags are read with one describe-tags call per batch, and only
+        the changes are applied.  with `prune`, tags for empty fields
+        are removed.  returns one result per service
+    """
+    from ymir import api as yapi
+    results, desired, conns = [], {}, {}
+    for fname in service_json_files:
+        service = yapi.load_service_from_json(fname, quiet=True)
+        name = service.template_data()['name']
+        key = util.aws._conn_key(service.conn)
+        conns.setdefault(key, service.conn)
+        instance = util.aws.get_instance_index(conns[key]).get(name)
+        results.append(dict(
+            service_json_file=fname, name=service._report_name(),
+            operation='sync_tags', success=instance is not None,
+            error='' if instance else 'no instance found',
+            instance_id=instance and instance.id, log_file='',
+            duration=0, changes=[]))
+        if instance is not None:
+            desired.setdefault(key, {})[instance.id] = \
+                service._desired_tags(prune)
+    by_instance = {}
+    for key, service_tags in desired.items():
+        start = time.time()
+        creates, deletes = util.aws.reconcile_tags(
+            conns[key], service_tags, dry_run=dry_run)
+        for verb, changes in [('set', creates), ('remove', deletes)]:
+            for instance_ids, tags in changes.items():
+                for instance_id in instance_ids:
+                    by_instance.setdefault(instance_id, []).extend(
+                        '{0} {1}'.format(verb, tag) for tag in sorted(tags))
+        for result in results:
+            if result['instance_id'] in service_tags:
+                result.update(duration=time.time() - start)
+    for result in results:
+        result['changes'] = sorted(by_instance.get(result['instance_id'], []))
+    return results
+
+
+def summary_table(results):
+    """ returns a list of lines, summarizing fleet results """
+    header = ['service', 'operation', 'result', 'seconds', 'log']
+    rows = [header]
+    for result in results:
+        rows.append([
+            result.get('name', util.unexpand(result['service_json_file'])),
+            result['operation'],
+            'ok' if result['success'] else 'FAIL',
+            '{0:.1f}'.format(result['duration']),
+            util.unexpand(result['log_file'])])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return ['  '.join(cell.ljust(width) for cell, width in zip(row, widths))
+            for row in rows]
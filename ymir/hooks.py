@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+""" ymir.hooks
+
+    one shared layer of wrappers around fabric's run/sudo/local/put/get,
+    for everything that watches the commands ymir runs (see `ymir.events`
+    and `ymir.profiling`).  the wrappers are installed while at least one
+    observer is active, and the originals are put back afterwards.
+
+    fabric.contrib.files (exists, append, ..) and fabric.contrib.project
+    (rsync_project, ..) hold their own references to these functions, so
+    those are wrapped too.  commands run some other way, i.e. by
+    subprocesses or by testinfra, are not seen.
+"""
+import importlib
+import threading
+
+# fabric functions which are observed
+HOOKED_FABRIC = ['run', 'sudo', 'local', 'put', 'get']
+
+# modules holding references to those functions
+HOOKED_MODULES = ['fabric.api', 'fabric.contrib.files',
+                  'fabric.contrib.project']
+
+# active observers.  each is called with a dictionary describing
+# the call, {function, command}, and returns a context manager for
+# the duration of that call.  the call's result is added to the
+# dictionary (as `result`) before the context manager exits
+_observers = []
+
+# (module, name) -> original function, while the wrappers are installed
+_originals = {}
+_lock = threading.Lock()
+
+
+def _observed(observers, call, fxn, args, kargs):
+    """ calls `fxn` inside the context of every observer """
+    if not observers:
+        call['result'] = fxn(*args, **kargs)
+        return call['result']
+    with observers[0](call):
+        return _observed(observers[1:], call, fxn, args, kargs)
+
+
+def _hooked(fxn, name):
+    """ """
+    def newf(*args, **kargs):
+        observers = list(_observers)
+        if not observers:
+            return fxn(*args, **kargs)
+        command = args[0] if args else (
+            kargs.get('command') or kargs.get('local_path') or
+            kargs.get('remote_path', ''))
+        call = dict(function=name, command=command)
+        return _observed(observers, call, fxn, args, kargs)
+    newf.__doc__ = fxn.__doc__
+    return newf
+
+
+def _install():
+    """ NB: must be called with `_lock` held """
+    for module_name in HOOKED_MODULES:
+        module = importlib.import_module(module_name)
+        for name in HOOKED_FABRIC:
+            if hasattr(module, name):
+                original = getattr(module, name)
+                _originals[module, name] = original
+                setattr(module, name, _hooked(original, name))
+
+
+def _uninstall():
+    """ NB: must be called with `_lock` held """
+    for (module, name), original in _originals.items():
+        setattr(module, name, original)
+    _originals.clear()
+
+
+def add_observer(observer):
+    """ starts calling `observer` for fabric commands """
+    with _lock:
+        if not _observers:
+            _install()
+        _observers.append(observer)
+
+
+def remove_observer(observer):
+    """ stops calling `observer`.  the wrappers are
+        removed when the last observer goes
+    """
+    with _lock:
+        _observers.remove(observer)
+        if not _observers:
+            _uninstall()
@@ -7,10 +7,13 @@ from ._ansible import AnsibleMixin
 from ._fabric import FabricMixin
 from .puppet import PuppetMixin
 from .rsync import RsyncMixin
+from .incremental import IncrementalMixin
+from .capabilities import CapabilityMixin
 
 __all__ = [
     tmp.__name__ for tmp in
     [PackageMixin, AnsibleMixin,
      PuppetMixin, FabricMixin,
-     RsyncMixin,
+     RsyncMixin, IncrementalMixin,
+     CapabilityMixin,
      ]]
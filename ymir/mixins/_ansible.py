@@ -186,6 +186,10 @@ class AnsibleMixin(object):
             ANSIBLE_HOST_KEY_CHECKING="False",
             ANSIBLE_DEPRECATION_WARNINGS="False",
             ANSIBLE_TIMEOUT="60",
+            # share the service's ssh master connection with ymir
+            ANSIBLE_SSH_ARGS="-o ControlMaster=auto -o ControlPersist={0}".format(
+                util.mux.CONTROL_PERSIST),
+            ANSIBLE_SSH_CONTROL_PATH=self._ssh_control_path,
         )
 
     def _provision_ansible(self, cmd):
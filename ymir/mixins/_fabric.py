@@ -10,6 +10,7 @@ from peak.util.imports import lazyModule
 from ymir import util
 from ymir import checks as ychecks
 from ymir import data as ydata
+from ymir import monitor as ymonitor
 
 yapi = lazyModule('ymir.api')
 
@@ -23,6 +24,10 @@ class FabricMixin(object):
         result = self._status()
         for k, v in result.items():
             self.report('  {0}: {1}'.format(k, v))
+        if self._debug_mode:
+            stats = self._template_data_stats
+            self.report('  template data cache: {0} hits, {1} misses'.format(
+                stats['hits'], stats['misses']))
         return result
 
     @util.declare_operation
@@ -77,7 +82,8 @@ class FabricMixin(object):
             self._host,
             username=self._username,
             pem=self._pem,
-            port=self._port,)
+            port=self._port,
+            opts=self._ssh_mux_opts)
 
     @util.declare_operation
     @util.require_running_instance
@@ -94,41 +100,94 @@ class FabricMixin(object):
             protocol, check = util.split_check(check_instruction)
             if protocol in ['http_200']:
                 _show_url(yapi.str_reflect(
-                    check, self.template_data()))
+                    check, util.thaw(self.template_data())))
             else:
                 self.report(
                     "skipping '{0}' because protocol is unshowable".format(
                         check))
 
-    @util.declare_operation
-    @util.require_running_instance
-    def check(self, name=None, failfast=False):
-        """ reports health for this service """
-        # TODO: include relevant sections of status results
-        # for x in 'status eb_health eb_status'.split():
-        #    if x in data:
-        #        out['aws://'+x] = ['read', data[x]]
-        def fail():
-            raise SystemExit(1)
+    def _health_check_objs(self, name=None):
+        """ returns Check objects for the named health check,
+            or for all of them if no name is given
+        """
         service_health_checks = self.template_data()['health_checks']
-        self.report('running health checks ({0} total)'.format(
-            len(service_health_checks)))
+        check_options = self.template_data()['health_check_options']
         names = [name] if name is not None else service_health_checks.keys()
-        success = True
+        check_objs = []
         # for check_name, (_type, url_t) in service_health_checks.items():
-        for check_name, check_instruction in service_health_checks.items():
+        for check_name, check_instruction in sorted(service_health_checks.items()):
             _type, url_t = util.split_check(check_instruction)
             if check_name in names:
-                check_obj = ychecks.Check(
-                    url_t=url_t, check_type=_type, name=check_name)
-                result = check_obj.run(self)
-                success = success and result.success
-                if failfast and not success:
-                    fail()
+                check_objs.append(ychecks.Check(
+                    url_t=url_t, check_type=_type, name=check_name,
+                    options=check_options.get(check_name)))
             else:
                 self.report(ydata.WARNING + "skipped: " + check_name)
-        if not success:
-            fail()
+        return check_objs
+
+    @util.declare_operation
+    @util.require_running_instance
+    def check(self, name=None, failfast=False,
+              workers=ychecks.CHECK_WORKERS, deadline=ychecks.CHECK_DEADLINE,
+              watch=False):
+        """ reports health for this service.  checks run concurrently
+            (at most `workers` at once) and are abandoned as failures
+            after `deadline` seconds.  with `watch`, keep monitoring
+            (see the `monitor` operation)
+        """
+        # TODO: include relevant sections of status results
+        # for x in 'status eb_health eb_status'.split():
+        #    if x in data:
+        #        out['aws://'+x] = ['read', data[x]]
+        if util.is_true(watch):
+            return self.monitor(name=name, workers=workers, deadline=deadline)
+        try:
+            workers, deadline = int(workers), int(deadline)
+        except ValueError:
+            raise SystemExit("check requires integer workers/deadline")
+        self.report('running health checks ({0} total)'.format(
+            len(self.template_data()['health_checks'])))
+        check_objs = self._health_check_objs(name)
+        ychecks.run_checks(
+            self, check_objs, workers=workers,
+            deadline=deadline, failfast=failfast)
+        if not all(check_obj.success for check_obj in check_objs):
+            raise SystemExit(1)
+
+    @util.declare_operation
+    @util.require_running_instance
+    def monitor(self, name=None, interval=ymonitor.DEFAULT_INTERVAL,
+                jitter=ymonitor.DEFAULT_JITTER, prometheus=None,
+                workers=ychecks.CHECK_WORKERS,
+                deadline=ychecks.CHECK_DEADLINE, rounds=None):
+        """ runs health checks until interrupted, each on its own
+            interval.  results are printed as JSON lines, or served
+            for prometheus on the given port
+        """
+        try:
+            interval, jitter = float(interval), float(jitter)
+            workers, deadline = int(workers), int(deadline)
+            rounds = rounds if rounds is None else int(rounds)
+        except ValueError:
+            raise SystemExit("monitor requires numeric arguments")
+        check_objs = self._health_check_objs(name)
+        if not check_objs:
+            raise SystemExit("no health checks to monitor")
+        monitor = ymonitor.Monitor(
+            self, check_objs, interval=interval, jitter=jitter,
+            workers=workers, deadline=deadline)
+        if prometheus is None:
+            monitor.sinks.append(ymonitor.ndjson_sink())
+        else:
+            server = ymonitor.serve_metrics(monitor, prometheus)
+            self.report('serving metrics on port {0}'.format(
+                server.server_address[1]))
+        self.report('monitoring {0} health checks'.format(len(check_objs)))
+        try:
+            monitor.run(rounds=rounds)
+        except KeyboardInterrupt:
+            pass
+        return monitor
 
     @util.declare_operation
     @util.require_running_instance
@@ -137,3 +196,4 @@ class FabricMixin(object):
         self.report('rebooting service')
         with self.ssh_ctx():
             api.run('sudo reboot')
+        self._invalidate_status()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+""" ymir.mixins.capabilities
+
+    Defines a mixin which probes the remote host once for everything
+    setup needs to know (OS family, binary versions, installed gems,
+    etc), instead of asking one question per `api.run`.
+"""
+import json
+
+from fabric import api
+
+from ymir import data as ydata
+
+# canary touched by `_update_system_packages`
+PACKAGE_UPDATE_CANARY = '/tmp/.ymir_package_update'
+
+# prints a single line of JSON describing the remote host.  this is
+# fed to `bash -l -s`, so PATH matches what fabric's login shell sees
+CAPABILITY_PROBE = 'canary=' + PACKAGE_UPDATE_CANARY + r'''
+ver() {
+    field=$1; shift
+    "$@" 2>/dev/null | head -n 1 | awk -v f="$field" '{print $f}' | tr -d '"\\'
+}
+jstr() {
+    if [ -n "$1" ]; then printf '"%s"' "$1"; else printf 'null'; fi
+}
+jbool() {
+    if "$@" >/dev/null 2>&1; then printf 'true'; else printf 'false'; fi
+}
+os_id=""
+if [ -r /etc/os-release ]; then
+    os_id=$(. /etc/os-release && echo "$ID" | tr -d '"\\')
+fi
+os_family=""
+if command -v apt-get >/dev/null 2>&1; then os_family=debian
+elif command -v yum >/dev/null 2>&1; then os_family=redhat
+fi
+age=null
+if [ -e "$canary" ]; then
+    age=$(( $(date +%s) - $(date +%s -r "$canary") ))
+fi
+gems=$(gem list --no-versions 2>/dev/null | \
+    awk 'NF && $1 !~ /^\*/ {printf "%s\"%s\"", sep, $1; sep=", "}')
+printf '{"os_family": %s, "os_id": %s, ' \
+    "$(jstr "$os_family")" "$(jstr "$os_id")"
+printf '"rvm": %s, "pacapt": %s, "package_update_age": %s, ' \
+    "$(jbool which rvm)" "$(jbool test -e /usr/bin/pacapt)" "$age"
+printf '"versions": {"ruby": %s, "puppet": %s, "git": %s, ' \
+    "$(jstr "$(ver 2 ruby --version)")" \
+    "$(jstr "$(ver 1 puppet --version)")" \
+    "$(jstr "$(ver 3 git --version)")"
+printf '"rsync": %s, "gem": %s}, "gems": [%s]}\n' \
+    "$(jstr "$(ver 3 rsync --version)")" \
+    "$(jstr "$(ver 1 gem --version)")" "$gems"
+'''
+
+CAPABILITY_PROBE_CMD = "bash -l -s <<'YMIR_PROBE'\n{0}\nYMIR_PROBE"
+
+
+def parse_capabilities(output):
+    """ returns the probe's JSON, ignoring anything (motd, rvm
+        warnings, etc) that the login shell printed around it
+    """
+    for line in reversed(output.splitlines()):
+        line = line.strip()
+        if line.startswith('{'):
+            return json.loads(line)
+    raise ValueError("no capability data in output")
+
+
+class CapabilityMixin(object):
+    _remote_capabilities_cache = None
+
+    @property
+    def _remote_capabilities(self):
+        """ capabilities of the remote host, probed once and then
+            reused until something is installed there
+        """
+        if self._remote_capabilities_cache is None:
+            self._remote_capabilities_cache = self._probe_capabilities()
+        return self._remote_capabilities_cache
+
+    def _probe_capabilities(self):
+        """ """
+        with self.ssh_ctx():
+            with api.quiet():
+                result = api.run(
+                    CAPABILITY_PROBE_CMD.format(CAPABILITY_PROBE),
+                    shell=False)
+        try:
+            return parse_capabilities(result)
+        except ValueError:
+            self.report(ydata.FAIL + "could not probe remote host: " +
+                        str(result.strip()))
+            raise SystemExit(1)
+
+    def _invalidate_capabilities(self):
+        """ call this after installing anything on the remote host """
+        self._remote_capabilities_cache = None
+
+    def _remote_version(self, binary):
+        """ version string for `binary` on the remote host,
+            or None if it is not installed
+        """
+        return self._remote_capabilities['versions'].get(binary)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+""" ymir.mixins.incremental
+
+    Defines a mixin for incremental provisioning, where provision_list
+    entries whose inputs have not changed since they last succeeded
+    on the remote host are skipped.
+"""
+import os
+import re
+import json
+from StringIO import StringIO
+
+from fabric import api
+
+from ymir import util
+from ymir import data as ydata
+
+# remote location for fingerprints of successfully applied instructions
+PROVISION_MANIFEST = '.ymir/provision_manifest.json'
+
+# only these protocols have inputs that can be fingerprinted.
+# remote:// and local:// commands are opaque, so they always run
+FINGERPRINTED_PROTOCOLS = [
+    'puppet', 'ansible', 'ansible_role',
+    'ansible_playbook', 'rsync', ]
+
+# protocols for which service facts are part of the inputs
+FACT_PROTOCOLS = ['puppet', 'ansible', 'ansible_role', 'ansible_playbook']
+
+
+class IncrementalMixin(object):
+
+    def _use_incremental(self, incremental=None):
+        """ `incremental` may come from the fab command line, where
+            it is a string. otherwise use the service.json default
+        """
+        if incremental is None:
+            return self._service_json.get('ymir_incremental', False)
+        return util.is_true(incremental)
+
+    def _provision_inputs(self, protocol, cmd):
+        """ local files and directories which the given
+            (rendered) instruction depends on
+        """
+        root = self._ymir_service_root
+        paths = []
+        for token in re.split(r'[\s,]+', cmd):
+            path = token and os.path.join(root, os.path.expanduser(token))
+            if path and os.path.exists(path) and path not in paths:
+                paths.append(path)
+        if protocol == 'puppet':
+            paths.append(os.path.join(self._puppet_dir, 'modules'))
+        elif protocol == 'ansible_role':
+            paths.append(os.path.join(
+                self._ansible_roles_dir, cmd.split()[0]))
+        elif protocol == 'ansible_playbook':
+            paths.append(self._ansible_roles_dir)
+        return paths
+
+    def _provision_fingerprint(self, protocol, cmd):
+        """ returns a fingerprint covering the rendered instruction and
+            everything it depends on, or None if that is unknowable
+        """
+        if protocol not in FINGERPRINTED_PROTOCOLS:
+            return None
+        inputs = [[util.unexpand(path), util.hashing.hash_path(path)]
+                  for path in self._provision_inputs(protocol, cmd)]
+        facts = self.facts if protocol in FACT_PROTOCOLS else {}
+        return util.hashing.fingerprint(protocol, cmd, inputs, facts)
+
+    def _read_provision_manifest(self):
+        """ returns { provision_item: fingerprint } from the remote host,
+            for every instruction that was successfully applied
+        """
+        with self.ssh_ctx():
+            with api.quiet():
+                result = api.run('cat ~/{0}'.format(PROVISION_MANIFEST))
+        if result.failed:
+            return {}
+        try:
+            return json.loads(result)
+        except ValueError:
+            self.report(ydata.WARN + "ignoring unreadable provision manifest")
+            return {}
+
+    def _write_provision_manifest(self, manifest):
+        """ """
+        with self.ssh_ctx():
+            with api.quiet():
+                api.run('mkdir -p ~/{0}'.format(
+                    os.path.dirname(PROVISION_MANIFEST)))
+                api.put(StringIO(json.dumps(manifest, indent=2)),
+                        PROVISION_MANIFEST)
@@ -6,6 +6,7 @@ import os
 from fabric import api
 
 from ymir import data as ydata
+from .capabilities import PACKAGE_UPDATE_CANARY
 
 
 class PackageMixin(object):
@@ -28,14 +29,14 @@ class PackageMixin(object):
             return  # optimization hack: let's only run once per process
         self.report("checking remote side for pacapt "
                     "(an OS-agnostic package manager)")
-        with api.quiet():
-            remote_missing_pacapt = api.run('ls /usr/bin/pacapt').failed
+        remote_missing_pacapt = not self._remote_capabilities['pacapt']
         if remote_missing_pacapt:
             self.report(
                 ydata.FAIL + "  pacapt does not exist, installing it now")
             local_pacapt_path = os.path.join(
                 os.path.dirname(ydata.__file__), 'pacapt')
             self.put(local_pacapt_path, '/usr/bin', use_sudo=True)
+            self._invalidate_capabilities()
         else:
             self.report(ydata.SUCCESS + " pacapt is already present")
         api.sudo('chmod o+x /usr/bin/pacapt')
@@ -49,11 +50,9 @@ class PackageMixin(object):
         self._require_pacapt()
         quiet = '> /dev/null' if quiet else ''
         self.report("updating system packages, this might take a while.")
-        canary = '/tmp/.ymir_package_update'
         max_age = 360
-        age_test = "[[ `date +%s -r {0}` -gt `date +%s --date='{1} min ago'` ]]"
-        with api.quiet():
-            need_update = api.sudo(age_test.format(canary, max_age)).failed
+        age = self._remote_capabilities['package_update_age']
+        need_update = age is None or age > max_age * 60
         if not need_update:
             msg = "packages were updated less than {0} minutes ago"
             self.report(ydata.SUCCESS + msg.format(max_age))
@@ -63,7 +62,8 @@ class PackageMixin(object):
                 # return code is "100" for centos
                 result = api.sudo(
                     '/usr/bin/pacapt --noconfirm -Sy {0}'.format(quiet)).succeeded
-            api.sudo('touch {0}'.format(canary))
+            api.sudo('touch {0}'.format(PACKAGE_UPDATE_CANARY))
+            self._invalidate_capabilities()
             return result
     _update_sys_packages = _update_system_packages
 
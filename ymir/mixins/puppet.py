@@ -3,16 +3,16 @@
 
     Defines a puppet mixin for the base ymir service service class
 """
-import re
 import os
-import glob
 import shutil
 import functools
 
 from fabric import api
 from fabric.contrib.files import exists
 from ymir.util import puppet as util_puppet
+from ymir.util import hashing as util_hashing
 from ymir import data as ydata
+from ymir import profiling
 
 GIT_ROLE = 'geerlingguy.git'
 
@@ -60,18 +60,30 @@ class PuppetMixin(object):
 
     def _get_puppet_templates(self):
         """ return puppet template files relative to working directory """
-        return glob.glob(
-            os.path.join(self._puppet_dir, 'modules', '*', 'templates', '*'))
+        return util_puppet.find_templates(self._puppet_dir)
 
-    def _get_puppet_template_vars(self):
-        """ returns a dictionary of { puppet_file : [..,template_vars,..]}"""
+    def _get_puppet_template_vars(self, cache=None):
+        """ returns a dictionary of { puppet_file : [..,template_vars,..]}.
+            `cache` is an optional `ContentCache` for the scan results
+        """
         out = {}
         for f in self._puppet_templates:
-            with open(f, 'r') as fhandle:
-                content = fhandle.read()
-                out[f] = [x for x in re.findall('<%= @(.*?) %>', content)]
+            key = cache and util_hashing.fingerprint(
+                'template vars', util_puppet.ERB_TAG.pattern,
+                util_puppet.ERB_VARIABLE.pattern, util_hashing.hash_path(f))
+            out[f] = cache and cache.get(key)
+            if out[f] is None:
+                with open(f, 'r') as fhandle:
+                    out[f] = util_puppet.scan_template(fhandle)
+                if cache:
+                    cache.set(key, out[f])
         return out
 
+    def _get_puppet_template_index(self, cache=None):
+        """ returns a dictionary of { template_var : [..,puppet_file,..]} """
+        return util_puppet.template_index(
+            self._get_puppet_template_vars(cache=cache))
+
     @noop_if_no_puppet_support
     def copy_puppet(self, clean=True, puppet_dir='puppet', lcd=None):
         """ copy puppet code to remote host (refreshes any dependencies) """
@@ -110,9 +122,8 @@ class PuppetMixin(object):
 
     @property
     def _using_rvm(self):
-        with api.quiet():
-            has_rvm = api.run('which rvm').succeeded
-        return has_rvm
+        """ answers whether the remote side has rvm """
+        return self._remote_capabilities['rvm']
 
     def _rvm_ctx(self, ruby_version='system'):
         if self._using_rvm:  # ruby version was old so ymir installed another ruby side-by-side
@@ -122,6 +133,7 @@ class PuppetMixin(object):
         return api.prefix(prefix)
 
     @noop_if_no_puppet_support
+    @profiling.traced('setup')
     def _setup_puppet_deps(self, force=False):
         """ puppet itself is already installed at this point,
             this sets up the provisioning dependencies
@@ -152,21 +164,19 @@ class PuppetMixin(object):
         self._install_puppet()
         self._install_ruby()
         self._install_git()
-        with api.quiet():
-            has_gem = api.run("gem --version").succeeded
+        has_gem = self._remote_version('gem') is not None
         if not has_gem:
             self.report(
                 ydata.FAIL + "`gem` not found but ruby was already installed!")
             raise SystemExit(1)
-        with api.quiet():
-            has_librarian = api.run(
-                "gem list | grep -c librarian-puppet").succeeded
+        has_librarian = 'librarian-puppet' in self._remote_capabilities['gems']
         if not has_librarian:
             self.report(ydata.FAIL + "puppet librarian not found")
             with self._rvm_ctx("1.9.3"):
                 if self._using_rvm:
                     api.sudo('gem install puppet --no-ri --no-rdoc')
                 api.sudo('gem install librarian-puppet --no-ri --no-rdoc')
+            self._invalidate_capabilities()
         else:
             self.report(ydata.SUCCESS + "puppet librarian already installed")
 
@@ -177,15 +187,14 @@ class PuppetMixin(object):
             requiring at least version 1.9.  if not found,
             ruby_version: 2.2.3 will be installed
         """
-        with api.quiet():
-            has_ruby = api.run("ruby --version")
-        ruby_version = has_ruby.succeeded and has_ruby.split()[1]
-        has_ruby = has_ruby.succeeded
+        ruby_version = self._remote_version('ruby')
+        has_ruby = ruby_version is not None
         if not has_ruby or not (ruby_version.startswith('1.9') or ruby_version.startswith('2')):
             self.report(
                 ydata.FAIL + "ruby is missing or old: " + str(ruby_version))
             self._provision_ansible_role(
                 "rvm_io.rvm1-ruby", rvm1_rubies=['ruby-1.9.3'])
+            self._invalidate_capabilities()
             self.sudo("rvm default system")
             self.run("rvm default system")
             self.report(ydata.SUCCESS +
@@ -196,12 +205,12 @@ class PuppetMixin(object):
 
     def _install_git(self):
         """ installs git on the remote service """
-        with api.quiet():
-            has_git = api.run("git --version").succeeded
+        has_git = self._remote_version('git') is not None
         if not has_git:
             self.report(ydata.FAIL + "git is missing, installing it")
             with api.hide("output"):
                 self._apply_ansible_role(GIT_ROLE)
+            self._invalidate_capabilities()
             self.report(ydata.SUCCESS + "git was installed")
         else:
             self.report(ydata.SUCCESS + "remote side already has git")
@@ -218,10 +227,10 @@ class PuppetMixin(object):
                 with api.lcd(self._ansible_dir):
                     api.local(cmd)
             self._provision_ansible_playbook("ansible/puppet.yml")
+            self._invalidate_capabilities()
 
-        with api.quiet():
-            puppet_version = api.run('puppet --version')
-        puppet_installed = not puppet_version.failed
+        puppet_version = self._remote_version('puppet')
+        puppet_installed = puppet_version is not None
         if puppet_installed:
             puppet_version = puppet_version.strip().split('.')
             puppet_version = map(int, puppet_version)
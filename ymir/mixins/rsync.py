@@ -1,15 +1,42 @@
 # -*- coding: utf-8 -*-
 
 import os
+import re
+import glob
+import json
 
+from ymir import util
 from ymir import data as ydata
+from ymir import profiling
 from ymir.data import BadProvisionInstruction
 
 from fabric import api
 from fabric.contrib.project import rsync_project
 
+# remote location for hashes of what was last synced to each destination
+RSYNC_MANIFEST = '.ymir/rsync_manifest.json'
+RSYNC_MANIFEST_WRITE = (
+    "mkdir -p ~/{0} && cat > ~/{1} <<'YMIR_MANIFEST'\n{2}\nYMIR_MANIFEST")
+
+# lines of interest in the output of `rsync --stats`
+RSYNC_STATS = re.compile(
+    r'^(Literal data|Matched data|Total bytes sent|'
+    r'Number of (?:regular )?files transferred): ([\d,]+)', re.MULTILINE)
+
+
+def parse_rsync_stats(output):
+    """ returns a dictionary like { 'literal_data': 123, .. }
+        from the output of `rsync --stats`
+    """
+    out = {}
+    for name, value in RSYNC_STATS.findall(output or ''):
+        name = name.lower().replace(' ', '_').replace('regular_', '')
+        out[name.replace('number_of_', '')] = int(value.replace(',', ''))
+    return out
+
 
 class RsyncMixin(object):
+    _rsync_manifest_cache = None
 
     def _provision_rsync(self, instruction):
         """ """
@@ -33,29 +60,102 @@ class RsyncMixin(object):
                 dest = os.path.join(dest, tmp)
         return self._rsync(src=src, dest=dest)
 
-    def _rsync(self, src=None, dest=None, delete=True, **kargs):
-        """ """
+    def _rsync(self, src=None, dest=None, delete=True,
+               compress=True, checksum=False, force=False, **kargs):
+        """ syncs local `src` (which may be a glob) to remote `dest`.
+            the transfer is skipped when the local files hash the same
+            as they did at the last sync to `dest`, unless `force`
+        """
         assert src and dest
+        tree_hash = self._rsync_tree_hash(src, delete)
+        if not force and tree_hash is not None and \
+                self._rsync_manifest.get(dest) == tree_hash:
+            self.report(ydata.SUCCESS + "unchanged since last sync, "
+                        "skipping rsync {0} -> {1}".format(src, dest))
+            return None
         self._require_rsync()
         self.report("rsync {0} -> {1}".format(
             src, dest))
-        with self.ssh_ctx():
+        with self.ssh_ctx(), profiling.span(
+                'rsync: {0} -> {1}'.format(src, dest), 'rsync'):
             result = rsync_project(
                 dest,
                 local_dir=src,
-                delete=True,
-                ssh_opts=ydata.RSYNC_SSH_OPTS,
-                exclude=ydata.RSYNC_EXCLUDES,)
-        self.report(ydata.SUCCESS + "sync finished")
+                delete=delete,
+                default_opts='-pthrv' + ('z' if compress else ''),
+                extra_opts=' '.join(
+                    ['--stats'] + (['--checksum'] if checksum else [])),
+                ssh_opts=' '.join(
+                    [ydata.RSYNC_SSH_OPTS, self._ssh_mux_opts]),
+                exclude=ydata.RSYNC_EXCLUDES,
+                capture=True)
+        if self._debug_mode:
+            self.report(result)
+        stats = parse_rsync_stats(result)
+        self.report(ydata.SUCCESS + "sync finished: {0} bytes sent, "
+                    "{1} bytes matched, {2} files transferred".format(
+                        stats.get('literal_data', '?'),
+                        stats.get('matched_data', '?'),
+                        stats.get('files_transferred', '?')))
+        if tree_hash is not None:
+            self._record_rsync(dest, tree_hash)
         return result
 
+    def _rsync_tree_hash(self, src, delete):
+        """ hash of everything `src` matches, or None if nothing does """
+        paths = sorted(glob.glob(os.path.expanduser(src)))
+        if not paths:
+            return None
+        return util.hashing.fingerprint(
+            'rsync', delete, ydata.RSYNC_EXCLUDES,
+            [[os.path.basename(path), util.hashing.hash_path(path)]
+             for path in paths])
+
+    @property
+    def _rsync_manifest(self):
+        """ { remote_dest: tree_hash } for the last successful sync to
+            each destination, read from the remote host only once
+        """
+        if self._rsync_manifest_cache is None:
+            self._rsync_manifest_cache = self._read_rsync_manifest()
+        return self._rsync_manifest_cache
+
+    def _read_rsync_manifest(self):
+        """ """
+        with self.ssh_ctx():
+            with api.quiet():
+                result = api.run('cat ~/{0}'.format(RSYNC_MANIFEST))
+        if result.failed:
+            return {}
+        try:
+            return json.loads(result)
+        except ValueError:
+            return {}
+
+    def _record_rsync(self, dest, tree_hash):
+        """ remembers `tree_hash` for `dest`, with one remote command """
+        manifest = dict(self._rsync_manifest)
+        manifest[dest] = tree_hash
+        self._write_rsync_manifest(manifest)
+        self._rsync_manifest_cache = manifest
+
+    def _write_rsync_manifest(self, manifest):
+        """ """
+        with self.ssh_ctx():
+            with api.quiet():
+                api.run(RSYNC_MANIFEST_WRITE.format(
+                    os.path.dirname(RSYNC_MANIFEST), RSYNC_MANIFEST,
+                    json.dumps(manifest, indent=2, sort_keys=True)),
+                    shell=False)
+
     def _has_rsync(self):
         """ answers whether the remote side has rsync """
-        with api.quiet():
-            return api.run('rsync --version').succeeded
+        return self._remote_version('rsync') is not None
 
     def _require_rsync(self):
-        """ """
+        """ installs rsync on the remote host if necessary.  this costs
+            nothing once the remote capabilities have been probed
+        """
         has_rsync = self._has_rsync()
         if not has_rsync:
             self.report(
@@ -65,5 +165,6 @@ class RsyncMixin(object):
                 success = self._provision_apt("rsync")
                 if not success:
                     self._provision_yum("rsync")
+            self._invalidate_capabilities()
         else:
             self.report(ydata.SUCCESS + "remote side already has rsync")
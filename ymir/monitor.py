@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+""" ymir.monitor
+
+    long-running health monitoring.  every health check is scheduled
+    on its own interval (with jitter, so checks don't all fire at once)
+    and results are emitted as newline-delimited JSON, or exposed as a
+    prometheus text endpoint.  the service, the context check urls are
+    rendered with (which needs its AWS status), pooled http sessions and
+    ssh backends are all loaded once and reused between rounds, which is
+    the whole point compared to `fab check` from cron.  restart the
+    monitor if the service's address changes.
+"""
+import time
+import random
+import threading
+import BaseHTTPServer
+from collections import deque
+
+from ymir import events
+from ymir import checks as ychecks
+
+# seconds between runs of a check, unless `interval` is given
+# for it in the `health_check_options` field of service.json
+DEFAULT_INTERVAL = 60
+
+# each run is rescheduled up to this fraction of its interval
+# early or late, and the first run is spread over one interval
+DEFAULT_JITTER = 0.1
+
+# a check whose last FLAP_WINDOW results changed state at least
+# FLAP_THRESHOLD times is reported as flapping
+FLAP_WINDOW = 10
+FLAP_THRESHOLD = 4
+
+
+class ScheduledCheck(object):
+    """ a check, when it should next run, and its recent history """
+
+    def __init__(self, check_obj, interval=DEFAULT_INTERVAL):
+        self.check = check_obj
+        self.interval = float(check_obj.interval or interval)
+        self.next_run = 0
+        self.last_run = None
+        self.runs = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.history = deque(maxlen=FLAP_WINDOW)
+
+    @property
+    def flapping(self):
+        """ """
+        history = list(self.history)
+        changes = sum(1 for before, after in zip(history, history[1:])
+                      if before != after)
+        return changes >= FLAP_THRESHOLD
+
+    def schedule(self, now, jitter=DEFAULT_JITTER, rng=random):
+        """ """
+        spread = self.interval * jitter
+        self.next_run = now + self.interval + rng.uniform(-spread, spread)
+
+    def record(self, now):
+        """ updates history from the check's last result.  returns
+            True if the check changed state (ok -> fail or back)
+        """
+        changed = bool(self.history) and \
+            self.history[-1] != self.check.success
+        self.history.append(self.check.success)
+        self.last_run = now
+        self.runs += 1
+        if self.check.success:
+            self.consecutive_failures = 0
+        else:
+            self.failures += 1
+            self.consecutive_failures += 1
+        return changed
+
+    def event(self, service_name, changed=False):
+        """ result of the last run, as a JSON-able dictionary """
+        return dict(
+            service=service_name,
+            check=self.check.name,
+            check_type=self.check.check_type,
+            url=self.check.url,
+            success=bool(self.check.success),
+            message=self.check.message or '',
+            timestamp=self.last_run,
+            consecutive_failures=self.consecutive_failures,
+            flapping=self.flapping,
+            changed=changed)
+
+
+class Monitor(object):
+    """ runs the checks which are due, sleeps until more are due, repeat.
+        each round goes through `ychecks.run_checks`, so due checks run
+        concurrently and remote file/socket checks are still batched
+    """
+
+    def __init__(self, service, check_objs,
+                 interval=DEFAULT_INTERVAL, jitter=DEFAULT_JITTER,
+                 workers=ychecks.CHECK_WORKERS,
+                 deadline=ychecks.CHECK_DEADLINE,
+                 sinks=None, rng=None):
+        self.service = service
+        self.context = ychecks._check_context(service)
+        self.service_name = self.context['name']
+        self.jitter = jitter
+        self.workers = workers
+        self.deadline = deadline
+        self.sinks = sinks or []
+        self.rng = rng or random.Random()
+        self.lock = threading.Lock()
+        self.scheduled = [ScheduledCheck(check_obj, interval=interval)
+                          for check_obj in check_objs]
+
+    def start(self, now):
+        """ spreads the first run of each check over one jitter window """
+        for sched in self.scheduled:
+            sched.next_run = now + self.rng.uniform(
+                0, sched.interval * self.jitter)
+
+    def due(self, now):
+        """ """
+        return [sched for sched in self.scheduled if sched.next_run <= now]
+
+    def next_wakeup(self):
+        """ """
+        return min(sched.next_run for sched in self.scheduled)
+
+    def run_round(self, now):
+        """ runs every check that is due at `now` and emits the
+            results.  returns the emitted events
+        """
+        due = self.due(now)
+        if not due:
+            return []
+        ychecks.run_checks(
+            self.service, [sched.check for sched in due],
+            workers=self.workers, deadline=self.deadline, quiet=True,
+            context=self.context)
+        events = []
+        with self.lock:
+            for sched in due:
+                changed = sched.record(now)
+                sched.schedule(now, jitter=self.jitter, rng=self.rng)
+                events.append(sched.event(self.service_name, changed=changed))
+        for event in events:
+            for sink in self.sinks:
+                sink(event)
+        return events
+
+    def run(self, rounds=None, clock=time.time, sleep=time.sleep):
+        """ runs forever, or for the given number of rounds """
+        self.start(clock())
+        count = 0
+        while rounds is None or count < rounds:
+            delay = self.next_wakeup() - clock()
+            if delay > 0:
+                sleep(delay)
+            self.run_round(clock())
+            count += 1
+
+    def metrics(self):
+        """ current state of every check, in prometheus text format """
+        with self.lock:
+            return prometheus_text(self.service_name, self.scheduled)
+
+
+# monitor events are written the same way as ymir.events
+ndjson_sink = events.stream_sink
+
+
+def _label(value):
+    """ escapes a prometheus label value """
+    return str(value).replace('\\', '\\\\').replace(
+        '"', '\\"').replace('\n', '\\n')
+
+
+PROMETHEUS_METRICS = [
+    ('ymir_check_up', 'gauge',
+     'whether the last run of the check succeeded',
+     lambda sched: int(bool(sched.check.success))),
+    ('ymir_check_consecutive_failures', 'gauge',
+     'failed runs since the check last succeeded',
+     lambda sched: sched.consecutive_failures),
+    ('ymir_check_flapping', 'gauge',
+     'whether the check keeps changing state',
+     lambda sched: int(sched.flapping)),
+    ('ymir_check_last_run_timestamp_seconds', 'gauge',
+     'when the check last ran',
+     lambda sched: sched.last_run),
+    ('ymir_check_runs_total', 'counter',
+     'runs of the check', lambda sched: sched.runs),
+    ('ymir_check_failures_total', 'counter',
+     'failed runs of the check', lambda sched: sched.failures),
+]
+
+
+def prometheus_text(service_name, scheduled):
+    """ renders checks which have run at least once, in the
+        prometheus text exposition format
+    """
+    lines = []
+    ran = [sched for sched in scheduled if sched.runs]
+    for name, kind, help_text, value in PROMETHEUS_METRICS:
+        lines.append('# HELP {0} {1}'.format(name, help_text))
+        lines.append('# TYPE {0} {1}'.format(name, kind))
+        for sched in ran:
+            labels = 'service="{0}",check="{1}",check_type="{2}"'.format(
+                _label(service_name), _label(sched.check.name),
+                _label(sched.check.check_type))
+            lines.append('{0}{{{1}}} {2}'.format(name, labels, value(sched)))
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ serves `monitor.metrics()` at any path """
+    monitor = None
+
+    def do_GET(self):
+        body = self.monitor.metrics()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        """ scrapes are frequent, keep them out of the output """
+
+
+def serve_metrics(monitor, port, host=''):
+    """ serves prometheus metrics for `monitor` from a daemon
+        thread.  returns the server, which knows its bound port
+    """
+    class handler(_MetricsHandler):
+        pass
+    handler.monitor = monitor
+    server = BaseHTTPServer.HTTPServer((host, int(port)), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
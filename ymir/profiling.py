@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+""" ymir.profiling
+
+    a timeline of where time goes during an operation.  spans nest per
+    thread: operations contain provisioners, which contain remote
+    commands and local subprocesses.  while a profile is active, every
+    fabric command gets a span without the callers knowing about it
+    (see `ymir.hooks` for which commands are seen).
+
+    profiles are written under the service root as plain JSON, as a
+    chrome trace (load it at chrome://tracing or ui.perfetto.dev), and
+    in speedscope's format (https://www.speedscope.app)
+"""
+import os
+import json
+import time
+import threading
+import contextlib
+from functools import wraps
+
+from ymir import hooks
+from ymir.caching import CACHE_DIR
+
+# directory (relative to the service root) for profiles
+PROFILE_DIR = os.path.join(CACHE_DIR, 'profiles')
+
+# how many of the slowest spans are reported when a profile finishes
+PROFILE_TOP = 10
+
+# categories for the spans of fabric commands
+PROFILED_FABRIC = dict(
+    run='remote', sudo='remote', put='remote', get='remote', local='local')
+
+# the profiler in use, if any.  there is one at a time,
+# since the fabric functions it wraps are global too
+_active = None
+
+
+class Span(object):
+    """ one timed piece of work """
+
+    def __init__(self, index, name, category, parent=None, args=None):
+        self.index = index
+        self.name = name
+        self.category = category
+        self.parent = parent
+        self.args = args or {}
+        self.thread = threading.current_thread().name
+        self.start = time.time()
+        self.end = None
+
+    @property
+    def seconds(self):
+        """ """
+        return (self.end or time.time()) - self.start
+
+    def as_dict(self, origin=0):
+        """ """
+        return dict(
+            id=self.index, parent=self.parent, name=self.name,
+            category=self.category, thread=self.thread, args=self.args,
+            start=self.start - origin, seconds=self.seconds)
+
+
+class Profiler(object):
+    """ collects spans from any number of threads """
+
+    def __init__(self, name):
+        self.name = name
+        self.spans = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.start = time.time()
+
+    @contextlib.contextmanager
+    def span(self, name, category, **args):
+        """ times the body of the with-statement """
+        stack = self.local.__dict__.setdefault('stack', [])
+        with self.lock:
+            # the first span in another thread belongs to the
+            # first span overall, i.e. the operation being profiled
+            parent = stack[-1].index if stack else \
+                (0 if self.spans else None)
+            span = Span(len(self.spans), name, category,
+                        parent=parent, args=args)
+            self.spans.append(span)
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as exc:
+            span.args.update(error=str(exc) or exc.__class__.__name__)
+            raise
+        finally:
+            span.end = time.time()
+            stack.pop()
+
+    def slowest(self, count=PROFILE_TOP):
+        """ the longest spans, not counting the operations
+            (which contain everything else)
+        """
+        spans = [span for span in self.spans
+                 if span.category != 'operation']
+        return sorted(spans, key=lambda span: -span.seconds)[:count]
+
+    def as_json(self):
+        """ """
+        return dict(
+            name=self.name, start=self.start,
+            spans=[span.as_dict(self.start) for span in self.spans])
+
+    def as_chrome_trace(self):
+        """ complete ("X") events, timestamps in microseconds """
+        threads = self._threads()
+        events = [dict(name=span.name, cat=span.category, ph='X', pid=1,
+                       tid=threads[span.thread],
+                       ts=int((span.start - self.start) * 1e6),
+                       dur=int(span.seconds * 1e6), args=span.args)
+                  for span in self.spans]
+        events += [dict(name='thread_name', ph='M', pid=1, tid=tid,
+                        args=dict(name=thread))
+                   for thread, tid in threads.items()]
+        return dict(traceEvents=events, displayTimeUnit='ms')
+
+    def as_speedscope(self):
+        """ one evented profile per thread.  spans with the same
+            name share a frame
+        """
+        frames, frame_index, profiles = [], {}, []
+        end = max([self.start] + [span.start + span.seconds
+                                  for span in self.spans]) - self.start
+        for thread in sorted(self._threads()):
+            events, stack = [], []
+            spans = sorted([span for span in self.spans
+                            if span.thread == thread],
+                           key=lambda span: (span.start, -span.seconds))
+            for span in spans:
+                if span.name not in frame_index:
+                    frame_index[span.name] = len(frames)
+                    frames.append(dict(name=span.name))
+                start = span.start - self.start
+                while stack and stack[-1][1] <= start:
+                    events.append(
+                        dict(type='C', frame=stack[-1][0], at=stack[-1][1]))
+                    stack.pop()
+                # clamp to the parent, so the events stay well nested
+                close = start + span.seconds
+                if stack:
+                    close = min(close, stack[-1][1])
+                events.append(
+                    dict(type='O', frame=frame_index[span.name], at=start))
+                stack.append((frame_index[span.name], close))
+            while stack:
+                events.append(
+                    dict(type='C', frame=stack[-1][0], at=stack[-1][1]))
+                stack.pop()
+            profiles.append(dict(
+                type='evented', name=thread, unit='seconds',
+                startValue=0, endValue=end, events=events))
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': self.name,
+            'shared': dict(frames=frames),
+            'profiles': profiles, }
+
+    def write(self, directory):
+        """ writes every format to `directory`.  returns the paths """
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        prefix = os.path.join(directory, '{0}-{1}'.format(
+            self.name, time.strftime(
+                '%Y%m%d-%H%M%S', time.localtime(self.start))))
+        paths = []
+        for suffix, data in [('.json', self.as_json()),
+                             ('.trace.json', self.as_chrome_trace()),
+                             ('.speedscope.json', self.as_speedscope())]:
+            with open(prefix + suffix, 'w') as fhandle:
+                json.dump(data, fhandle)
+            paths.append(prefix + suffix)
+        return paths
+
+    def _threads(self):
+        """ { thread name: small integer id } """
+        names = []
+        for span in self.spans:
+            if span.thread not in names:
+                names.append(span.thread)
+        return dict((name, index + 1) for index, name in enumerate(names))
+
+
+@contextlib.contextmanager
+def span(name, category, **args):
+    """ a span in the active profile, if there is one """
+    profiler = _active
+    if profiler is None:
+        yield None
+    else:
+        with profiler.span(name, category, **args) as _span:
+            yield _span
+
+
+def traced(category, name=None):
+    """ method decorator which puts each call in a span """
+    def decorator(fxn):
+        @wraps(fxn)
+        def newf(*args, **kargs):
+            if _active is None:
+                return fxn(*args, **kargs)
+            with span(name or fxn.__name__, category):
+                return fxn(*args, **kargs)
+        return newf
+    return decorator
+
+
+def _command_span(call):
+    """ `ymir.hooks` observer which puts every fabric command in a span """
+    return span(u'{0}: {1}'.format(call['function'], call['command']),
+                PROFILED_FABRIC[call['function']])
+
+
+@contextlib.contextmanager
+def profile(service_root, name, report=None, top=PROFILE_TOP):
+    """ profiles the body of the with-statement as one span called
+        `name`, then writes the profile under `service_root` and
+        reports the slowest spans
+    """
+    global _active
+    if _active is not None:
+        # already profiling, i.e. setup calling provision
+        with span(name, 'operation'):
+            yield _active
+        return
+    profiler = _active = Profiler(name)
+    hooks.add_observer(_command_span)
+    try:
+        with profiler.span(name, 'operation'):
+            yield profiler
+    finally:
+        hooks.remove_observer(_command_span)
+        _active = None
+        paths = profiler.write(os.path.join(service_root, PROFILE_DIR))
+        if report is not None:
+            report('slowest steps:')
+            for _span in profiler.slowest(top):
+                report('{0:8.2f}s  {1}: {2}'.format(
+                    _span.seconds, _span.category, _span.name))
+            for path in paths:
+                report('profile written to: ' + path)
@@ -22,6 +22,11 @@ vagrant_schema = Schema(VAGRANT_DATA, name='VagrantSchema')
 extension_schema = Schema(
     EXTENSION_DATA, name='ExtensionSchema', extra=ALLOW_EXTRA)
 
+# schema_name -> schema, for compiled service descriptions
+schemas = dict([
+    [schema.schema_name, schema] for schema in
+    [ec2_schema, eb_schema, vagrant_schema, extension_schema]])
+
 
 def choose_schema(json):
     """ """
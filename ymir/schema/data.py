@@ -16,12 +16,14 @@ AWS_DATA = {
     Optional("reservation_extras", default={}): dict,
     Required("security_groups", default=[]): validators._validate_sg_field,
     Required("key_name"): unicode,
+    Optional("ymir_status_ttl", default=0): int,
 }
 
 PROVISION_DATA = {
     Required("setup_list", default=[]): validators._validate_sl_field,
     Required("provision_list", default=[]): validators._validate_pl_field,
     Optional("puppet_parser", default="future"): validators._validate_puppet_parser,
+    Optional("ymir_incremental", default=False): bool,
 }
 
 BASE_DATA = {
@@ -31,6 +33,7 @@ BASE_DATA = {
     Required("service_description"): unicode,
     Required("instance_type"): unicode,
     Required("health_checks"): dict,
+    Optional("health_check_options", default={}): dict,
     Optional("logs", default=[]): validators.list_of_strings,
     Optional("ymir_debug", default=False): bool,
     Optional("ymir_build_puppet", default=False): bool,
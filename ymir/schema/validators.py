@@ -4,6 +4,9 @@
 import os
 from voluptuous import Invalid
 
+from ymir import dag
+from ymir.data import BadProvisionInstruction
+
 
 def nested_vagrant_validator(dct, ):
     """ """
@@ -63,10 +66,19 @@ def list_of_strings(lst, key=None):
                 key, i, type(x).__name__, x)
             raise Invalid(err)
 
+
+def list_of_instructions(lst, key=None):
+    """ a list of strings, with valid step annotations (see ymir.dag) """
+    list_of_strings(lst, key=key)
+    try:
+        dag.plan(lst)
+    except BadProvisionInstruction as exc:
+        raise Invalid('bad step for key@`{0}`: {1}'.format(key, exc))
+
 string_or_int = lambda x: isinstance(x, (unicode, int))
-_validate_sl_field = lambda lst: list_of_strings(lst, key='setup_list')
+_validate_sl_field = lambda lst: list_of_instructions(lst, key='setup_list')
 _validate_sg_field = lambda lst: list_of_strings(lst, key='security_groups')
-_validate_pl_field = lambda lst: list_of_strings(lst, key='provision_list')
+_validate_pl_field = lambda lst: list_of_instructions(lst, key='provision_list')
 
 
 def _validate_puppet_parser(x):
@@ -4,12 +4,16 @@
 import os
 import time
 import boto
+from boto.ec2.instance import Instance
 
 from fabric.colors import yellow
 
 from ymir import util
+from ymir import caching
 from ymir.service.base import AbstractService
 
+STATUS_TRANSIENT = ['pending', 'stopping', 'shutting-down']
+
 
 class AmazonService(AbstractService):
     """ """
@@ -104,6 +108,8 @@ class AmazonService(AbstractService):
                 report("   -> currently unassigned.  "
                        "associating with this instance")
                 aws_address.associate(instance_id=service_instance_id)
+                # the public ip just changed
+                self._invalidate_status()
             elif aws_address.instance_id == service_instance_id:
                 report("   -> already associated with this service")
             else:
@@ -113,9 +119,25 @@ class AmazonService(AbstractService):
 
     @util.declare_operation
     @util.require_running_instance
-    def sync_tags(self):
-        """ update aws instance tags from service.json `tags` field """
+    def sync_tags(self, dry_run=False, prune=False):
+        """ update aws instance tags from service.json `tags` field.
+            with `prune`, tags for empty fields are removed
+        """
         self.report('updating instance tags: ')
+        creates, deletes = util.aws.reconcile_tags(
+            self.conn,
+            {self._instance.id: self._desired_tags(util.is_true(prune))},
+            dry_run=util.is_true(dry_run))
+        self.report('  set: {0}'.format(
+            sorted(key for tags in creates.values() for key in tags)))
+        self.report('  removed: {0}'.format(
+            sorted(key for tags in deletes.values() for key in tags)))
+
+    def _desired_tags(self, prune=False):
+        """ tags the instance should have, according to service.json.
+            tags for empty fields are left alone, unless `prune` is
+            set.  then they are None, meaning they should be removed
+        """
         json = self.template_data()
         tags = dict(
             description=json.get('service_description', ''),
@@ -125,11 +147,8 @@ class AmazonService(AbstractService):
         )
         for tag in json.get('tags', []):
             tags[tag] = 'true'
-        for tag in tags:
-            if not tags[tag]:
-                tags.pop(tag)
-        self.report('  {0}'.format(tags.keys()))
-        self._instance.add_tags(tags)
+        return dict((key, value or None) for key, value in tags.items()
+                    if value or prune)
 
     @util.declare_operation
     @util.require_running_instance
@@ -138,8 +157,10 @@ class AmazonService(AbstractService):
         instance = self._instance
         self.report("{0} slated for termination.".format(instance))
         if force:
-            return self.conn.terminate_instances(
+            result = self.conn.terminate_instances(
                 instance_ids=[instance.id])
+            self._invalidate_status()
+            return result
         else:
             msg = ("This will terminate the instance {0} ({1}) and can "
                    "involve data loss.  Are you sure? [y/n] ")
@@ -162,6 +183,45 @@ class AmazonService(AbstractService):
 
     ssh = util.require_running_instance(AbstractService.ssh)
 
+    @property
+    def _status_cache(self):
+        """ on-disk status cache, shared by every `fab` process """
+        return caching.disk_cache(self._ymir_service_root, 'status')
+
+    @property
+    def _status_cache_key(self):
+        """ status depends on the service name and which
+            AWS account/region is being asked about it
+        """
+        return ':'.join([
+            self._service_json['name'],
+            os.environ.get('AWS_PROFILE', 'default'),
+            str(getattr(self.conn.region, 'name', self.conn.region))])
+
+    def _invalidate_status(self):
+        """ forget cached status, both in-process and on disk """
+        super(AmazonService, self)._invalidate_status()
+        self._status_cache.delete(self._status_cache_key)
+        util.aws.invalidate_instance_index(
+            self.conn, name=self._service_json['name'])
+
+    def _status_from_cache(self, cached):
+        """ rebuilds a status result from the on-disk cache.  the
+            instance is rebuilt locally from its id, without asking AWS
+        """
+        result = cached.copy()
+        instance_id = result.pop('instance_id')
+        if instance_id is not None:
+            instance = Instance(self.conn)
+            instance.id = instance_id
+            instance.tags = result['tags']
+            instance.ip_address = result['ip']
+            instance.private_ip_address = result['private_ip']
+            result.update(instance=instance)
+        else:
+            result.update(instance=None)
+        return result
+
     def _status(self):
         """ retrieves service status information.
             use this instead of self.status() if you want to quietly
@@ -171,6 +231,13 @@ class AmazonService(AbstractService):
         if not self._status_computed and self._debug_mode:
             self.report("AWS profile: {0}".format(yellow(
                 os.environ.get('AWS_PROFILE', 'default'))))
+        ttl = tdata.get('ymir_status_ttl', 0)
+        cache_key = self._status_cache_key
+        cached = self._status_cache.get(cache_key) if ttl > 0 else None
+        if cached is not None:
+            result = self._status_from_cache(cached)
+            self._status_computed = result
+            return result
         name = tdata['name']
         # DON'T use self._get_instance(); recursion
         instance = util.aws.get_instance_by_name(name, self.conn)
@@ -188,6 +255,15 @@ class AmazonService(AbstractService):
                     private_ip=instance.private_ip_address,
                 ))
         self._status_computed = result
+        # transient states are not worth caching, they are
+        # usually being polled for a change
+        if ttl > 0 and result['status'] not in STATUS_TRANSIENT:
+            cached = result.copy()
+            cached.update(
+                instance_id=instance and instance.id,
+                tags=dict(result['tags']))
+            cached.pop('instance')
+            self._status_cache.set(cache_key, cached, timeout=ttl)
         return result
 
     @util.declare_operation
@@ -202,7 +278,8 @@ class AmazonService(AbstractService):
             self.report(msg)
             if force:
                 self.report('  force is True, terminating it & rebuilding')
-                util._block_while_terminating(i, conn)
+                util.aws._block_while_terminating(i, conn)
+                self._invalidate_status()
                 # might need to block and wait here
                 return self.create(force=False)
             self.report('  force is False, refusing to rebuild it')
@@ -243,7 +320,7 @@ class AmazonService(AbstractService):
         self.report('  no instance found, creating it now.')
         self.report('  reservation-id:', instance.id)
 
-        util._block_while_pending(instance)
+        util.aws._block_while_pending(instance)
         status = instance.update()
         name = self.template_data()['name']
         if status == 'running':
@@ -251,6 +328,7 @@ class AmazonService(AbstractService):
             self.report('  setting tag for "Name": {0}'.format(
                 name))
             instance.add_tag("Name", name)
+            self._invalidate_status()
         else:
             self.report('Weird instance status: ', status)
             return None
@@ -4,6 +4,7 @@
 import os
 import time
 import pprint
+import subprocess
 import logging
 
 import demjson
@@ -13,6 +14,9 @@ from fabric.colors import blue, yellow
 
 from peak.util.imports import lazyModule
 
+from ymir import dag
+from ymir import events
+from ymir import profiling
 from ymir import util
 from ymir import mixins
 from ymir import data as ydata
@@ -36,10 +40,15 @@ class AbstractService(Reporter,
                       mixins.PuppetMixin,
                       mixins.AnsibleMixin,
                       mixins.PackageMixin,
+                      mixins.IncrementalMixin,
+                      mixins.CapabilityMixin,
                       mixins.FabricMixin):
     _schema = None
     _ymir_service_root = None
     _status_computed = False
+    _template_data_cache = None
+    # bumped whenever `_service_json` is assigned
+    _service_json_version = 0
 
     def __str__(self):  # pragma:nocover
         """ """
@@ -69,7 +78,7 @@ class AbstractService(Reporter,
         if fname is not None:
             with open(fname) as fhandle:
                 try:
-                    json = demjson.decode(fhandle.read())
+                    json = util.jsonc.decode(fhandle.read())
                 except demjson.JSONDecodeError:
                     self.report("error decoding: {0}".format(fname))
                 else:
@@ -117,7 +126,8 @@ class AbstractService(Reporter,
         return out
 
     @property
-    @cached('service._ssh_config_string', 60 * 20)
+    @cached(lambda self: 'service._ssh_config_string:' +
+            self._ymir_service_json_file, 60 * 20)
     def _ssh_config_string(self):
         """ return a string suitable for use as ssh-config file """
         out = [
@@ -131,9 +141,20 @@ class AbstractService(Reporter,
             "  IdentityFile {0}".format(self._pem),
             "  IdentityOnly yes",
             "  LogLevel FATAL",
-        ]
+        ] + util.mux.mux_config(self._username, self._host, self._port)
         return '\n'.join(out)
 
+    @property
+    def _ssh_mux_opts(self):
+        """ ssh options that share this service's master connection """
+        util.mux.use_master(self._username, self._host, self._port)
+        return util.mux.mux_opts(self._username, self._host, self._port)
+
+    @property
+    def _ssh_control_path(self):
+        """ """
+        return util.mux.use_master(self._username, self._host, self._port)
+
     def fabric_install(self):
         """ publish certain service-methods into the fabfile
             namespace. this method is responsible for
@@ -159,6 +180,7 @@ class AbstractService(Reporter,
         """ """
         self._ymir_service_root = os.path.dirname(service_json_file)
         self._ymir_service_json_file = service_json_file
+        self._template_data_stats = dict(hits=0, misses=0)
 
     def report(self, msg, *args, **kargs):
         """ 'print' shortcut that includes some color and formatting """
@@ -175,14 +197,25 @@ class AbstractService(Reporter,
         print result
 
     @util.declare_operation
-    def setup(self, instruction=None):
+    def setup(self, instruction=None, profile=False):
         """ setup service (invoke after 'create', before 'provision')
         """
         self.report('setting up')
-        # setup ansible first, because it updates local files and is
-        # unusual in that it doesn't require a working  remote service
-        self.setup_ansible()
-        return self._setup(instruction, failures=0)
+        with self._profile('setup', profile):
+            # setup ansible first, because it updates local files and is
+            # unusual in that it doesn't require a working  remote service
+            self.setup_ansible()
+            return self._setup(instruction, failures=0)
+
+    def _profile(self, name, profile=False):
+        """ context manager for the body of an operation.  with `profile`
+            (which may come from the fab command line), a profile of
+            the operation is written and the slowest steps are reported
+        """
+        if util.is_true(profile):
+            return profiling.profile(
+                self._ymir_service_root, name, report=self.report)
+        return profiling.span(name, 'operation')
 
     def _setup(self, instruction, failures=0):
         """ """
@@ -199,6 +232,7 @@ class AbstractService(Reporter,
                 self.report(str(exc))
                 self.report("network error? sleeping and retrying")
                 time.sleep(wait_period)
+            self._invalidate_status()
             return self._setup(instruction, failures=failures + 1)
         cm_data = self._status()
         if cm_data['status'] == 'running':
@@ -212,6 +246,7 @@ class AbstractService(Reporter,
             self.report(ydata.FAIL + msg)
             return retry()
 
+    @profiling.traced('setup')
     def setup_ip(self, instruction):
         """ """
         with self.ssh_ctx():
@@ -224,7 +259,8 @@ class AbstractService(Reporter,
         self.report(ydata.SUCCESS + "Setup complete.  Now run `fab provision`")
 
     @property
-    @cached('service._instance', 60 * 20)
+    @cached(lambda self: 'service._instance:' +
+            self._ymir_service_json_file, 60 * 20)
     def _instance(self):
         """ return the aws instance """
         return self._get_instance(strict=True)
@@ -253,20 +289,21 @@ class AbstractService(Reporter,
 
     @util.declare_operation
     @util.require_running_instance
-    def provision(self, instruction=None, use_list=None, **kargs):
+    def provision(self, instruction=None, use_list=None, profile=False,
+                  **kargs):
         """ provision this service """
         self.report('preparing to provision: {0}'.format(
             yellow(instruction or '(everything)')))
-        self._clean_puppet_tmp_dir()
-
-        try:
-            instruction_index = int(instruction)
-        except:
-            return self._provision_helper(
-                instruction=instruction, use_list=use_list, **kargs)
-        else:
-            return self._provision_from_index(
-                instruction_index, use_list=use_list, **kargs)
+        with self._profile('provision', profile):
+            self._clean_puppet_tmp_dir()
+            try:
+                instruction_index = int(instruction)
+            except:
+                return self._provision_helper(
+                    instruction=instruction, use_list=use_list, **kargs)
+            else:
+                return self._provision_from_index(
+                    instruction_index, use_list=use_list, **kargs)
 
     def _provision_from_index(self, instruction_index, use_list=None, **kargs):
         """ given an integer, run the instruction at
@@ -283,9 +320,15 @@ class AbstractService(Reporter,
         else:
             return self._provision_helper(instruction=instruction, **kargs)
 
-    def _provision_helper(self, instruction=None, use_list=None, force=False, **kargs):
+    def _provision_helper(self, instruction=None, use_list=None, force=False,
+                          incremental=None, workers=dag.PROVISION_WORKERS,
+                          **kargs):
         """ `force` must be True to provision with arguments not
-            mentioned in service's provision_list
+            mentioned in service's provision_list.  with `incremental`,
+            instructions whose inputs are unchanged since they last
+            succeeded on the remote host are skipped.  steps run in
+            order, except `local://` steps marked `background` (see
+            `ymir.dag`), at most `workers` of which run at once
         """
         provision_list = self.template_data()['provision_list'] \
             if use_list is None else use_list
@@ -296,6 +339,7 @@ class AbstractService(Reporter,
             #               'but "{0}" was not found.').format(util.unexpand(instruction))
             #        raise SystemExit(err)
             provision_list = [instruction]
+        steps = dag.plan(provision_list)
         with self.ssh_ctx():
             with api.lcd(self._ymir_service_root):
                 msg = ('\n  ' + pprint.pformat(provision_list, indent=2)) if \
@@ -305,13 +349,50 @@ class AbstractService(Reporter,
                 # which were installed in the `setup` phase would be
                 # destroyed.  not what is wanted for simple provisioning!
                 self.copy_puppet(clean=False)
-                for provision_item in provision_list:
+                incremental = self._use_incremental(incremental)
+                manifest = self._read_provision_manifest() \
+                    if incremental else {}
+
+                def apply_step(step):
                     protocol, instruction = util.split_instruction(
-                        provision_item)
-                    self.report('provision_list[{0}]:'.format(
-                        provision_list.index(provision_item)))
-                    self._run_provisioner(
-                        protocol, instruction, **kargs)
+                        step.instruction)
+                    self.report('provision_list[{0}]:'.format(step.index))
+                    fingerprint = incremental and self._provision_fingerprint(
+                        protocol, yapi.str_reflect(
+                            instruction,
+                            ctx=util.thaw(self.template_data())))
+                    if fingerprint and manifest.get(step.item) == fingerprint:
+                        self.report(
+                            ydata.SUCCESS + "unchanged, skipping: " + step.item)
+                        return None, None
+                    options = dict(kargs)
+                    if step.background:
+                        # collect the output instead of interleaving it
+                        options.update(capture=True)
+                    result = self._run_provisioner(
+                        protocol, instruction, **options)
+                    return fingerprint, result
+
+                applied = {}
+
+                def record_step(step, outcome):
+                    fingerprint, result = outcome
+                    if fingerprint and result is not False:
+                        applied[step.item] = fingerprint
+                try:
+                    dag.run_steps(steps, apply_step, workers=int(workers),
+                                  on_done=record_step)
+                finally:
+                    # written once, after every step (background ones
+                    # included) is done, so nothing else is running
+                    # while fabric settings are changed for the write
+                    if applied:
+                        manifest.update(applied)
+                        self._write_provision_manifest(manifest)
+                    if len(steps) > 1:
+                        self.report('step timings:')
+                        for line in dag.timing_report(steps):
+                            self.report(line)
         self.report(ydata.SUCCESS + "Finished with provision.")
         self.report("You might want to restart services now "
                     "using `fab service` or `fab supervisor`")
@@ -331,18 +412,45 @@ class AbstractService(Reporter,
         else:
             cmd = yapi.str_reflect(
                 provision_instruction,
-                ctx=self.template_data())
+                ctx=util.thaw(self.template_data()))
             if cmd != provision_instruction:
                 self.report(yellow("≈") + "translated to: {0}".format(cmd))
-            return provision_fxn(cmd, **kargs)
+            with events.timed('provisioner', provisioner=provisioner_name,
+                              instruction=cmd):
+                with profiling.span(provisioner_name + '://' + cmd,
+                                    'provisioner'):
+                    return provision_fxn(cmd, **kargs)
 
     def _provision_remote(self, cmd):
         """ handler for provision-list entries prefixed with `remote://` """
         return self.run(cmd)
 
-    def _provision_local(self, cmd):
-        """ handler for provision-list entries prefixed with `local://` """
-        return api.local(cmd)
+    def _provision_local(self, cmd, capture=False):
+        """ handler for provision-list entries prefixed with `local://`.
+            with `capture`, output is reported once the command finishes.
+            that doesn't go through fabric, whose settings are global, so
+            it is safe for background steps
+        """
+        if not capture:
+            return api.local(cmd)
+        with profiling.span('local: ' + cmd, 'local'):
+            proc = subprocess.Popen(
+                cmd, shell=True, cwd=self._ymir_service_root,
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output = proc.communicate()[0]
+        for line in output.splitlines():
+            self.report('  [{0}] {1}'.format(cmd, line))
+        if proc.returncode != 0:
+            raise SystemExit("local command failed ({0}): {1}".format(
+                proc.returncode, cmd))
+        return output
+
+    def _invalidate_status(self):
+        """ forget any cached status information.  call this
+            after operations which change the host or its state
+        """
+        self._status_computed = False
+        self._invalidate_capabilities()
 
     @property
     def _debug_mode(self):
@@ -368,7 +476,8 @@ class AbstractService(Reporter,
             either the puppet or ansible provisioners
         """
         json = self.template_data()
-        service_defaults = json['service_defaults']
+        # FACTER_* values are strings, which should show lists as lists
+        service_defaults = util.thaw(json['service_defaults'])
         # migrate a few other variables from the toplevel json,
         # this stuff might be used in filling out motds, etc
         service_defaults.update(
@@ -404,10 +513,49 @@ class AbstractService(Reporter,
         """ """
         return self._status().get('ip')
 
+    @property
+    def _service_json(self):
+        """ """
+        return self._service_json_data
+
+    @_service_json.setter
+    def _service_json(self, service_json):
+        self._service_json_data = service_json
+        self._service_json_version += 1
+
+    @property
+    def _state_version(self):
+        """ template data only changes when the json or the status of
+            this service changes.  status is whatever was computed
+            in-process, so this never asks for status itself;
+            `_invalidate_status` resets it.  status is compared by
+            value, since it is a new dictionary every time it is
+            computed, while instances are compared by their id
+        """
+        status = self._status_computed
+        if status:
+            status = sorted(
+                [k, getattr(v, 'id', v) if k == 'instance' else v]
+                for k, v in status.items())
+        return (self._service_json_version, status)
+
     def template_data(self):
         """ a last phase of reflection, for data that's potentially
-            only available just-in-time.
+            only available just-in-time.  the result is read-only,
+            and computed only once per state version
         """
+        cached = self._template_data_cache
+        if cached is not None and cached[0] == self._state_version:
+            self._template_data_stats['hits'] += 1
+            return cached[1]
+        self._template_data_stats['misses'] += 1
+        tmp = util.freeze(self._template_data())
+        # building template data may have computed the status
+        self._template_data_cache = (self._state_version, tmp)
+        return tmp
+
+    def _template_data(self):
+        """ """
         tmp = self._service_json.copy()
         tmp.update(
             username=self._username,
@@ -20,10 +20,18 @@ from ._fabric import has_gem, list_dir
 from .shell import unexpand
 from .backports import TemporaryDirectory
 from ymir.data import OPERATION_MAGIC
+from ymir import events
 from . import aws
+from . import hashing
+from . import mux
+from . import jsonc
 
 NOOP = lambda *args, **kargs: None
 
+# values which count as true for flags given on the command line,
+# i.e. `fab provision:incremental=yes` (where every value is a string)
+TRUE_STRINGS = ['1', 'true', 'yes', 'y']
+
 remote_path_exists = remote_exists
 
 __all__ = [x.__name__ for x in [
@@ -34,8 +42,14 @@ __all__ = [x.__name__ for x in [
 ]]
 
 
+def is_true(value):
+    """ parses a boolean flag from the command line """
+    return str(value).lower() in TRUE_STRINGS
+
+
 def declare_operation(fxn):
     """ """
+    fxn = events.operation_events(fxn)
     setattr(fxn, OPERATION_MAGIC, True)
     return fxn
 
@@ -80,6 +94,7 @@ def report(label, msg, *args, **kargs):
     # fabric publishes as commands.
     label = label.replace('_', '')
     eprint(template.format(label, msg, args or ''))
+    events.report(label, msg)
 
 
 def require_running_instance(fxn):
@@ -123,7 +138,7 @@ def mosh(ip, username='ubuntu', pem=None):
         return api.local(cmd)
 
 
-def ssh(ip, username='ubuntu', port='22', pem=None):
+def ssh(ip, username='ubuntu', port='22', pem=None, opts=''):
     """ connect to remote host using ssh """
     assert ip is not None
     if ':' in ip:
@@ -132,6 +147,8 @@ def ssh(ip, username='ubuntu', port='22', pem=None):
         username, ip, port)
     if pem is not None:
         cmd += ' -i {0}'.format(pem)
+    if opts:
+        cmd += ' ' + opts
     with api.settings(warn_only=True):
         api.local(cmd)
 
@@ -173,6 +190,45 @@ class InvalidValidator(Exception):
     pass
 
 
+class FrozenDict(dict):
+    """ a read-only dictionary.  use .copy() to get a
+        (shallow, mutable) version of it
+    """
+
+    def _readonly(self, *args, **kargs):
+        raise TypeError("FrozenDict is read-only, use .copy()")
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+def freeze(obj):
+    """ returns a read-only version of the given
+        JSON-ish data, i.e. dicts/lists nested in any way
+    """
+    if isinstance(obj, dict):
+        return FrozenDict([[k, freeze(v)] for k, v in obj.items()])
+    elif isinstance(obj, (list, tuple)):
+        return tuple(freeze(x) for x in obj)
+    else:
+        return obj
+
+
+def thaw(obj):
+    """ the opposite of `freeze`.  templates show tuples as
+        (u'a', u'b') rather than [u'a', u'b'], so data is
+        thawed again before anything is rendered with it
+    """
+    if isinstance(obj, dict):
+        return dict([[k, thaw(v)] for k, v in obj.items()])
+    elif isinstance(obj, (list, tuple)):
+        return [thaw(x) for x in obj]
+    else:
+        return obj
+
+
 def get_or_guess_service_json_file(base_dir=None, default='service.json', insist=True):
     """ NB: only to be used from fabfiles! """
     if base_dir is None:
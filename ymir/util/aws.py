@@ -54,41 +54,168 @@ def get_conn(key_name=None, region='us-east-1'):
     return conn
 
 
+# { (aws_profile, region_name): { instance_name: instance } }
+instance_index = {}
+
+# connection keys for which `instance_index` holds every live instance
+_complete_indexes = set()
+
+# page size for the describe-instances call that builds the index
+INSTANCE_PAGE_SIZE = 1000
+
+
+def _conn_key(conn):
+    """ instance indexes are keyed by account and region rather than by
+        connection object, so that fresh connections can share them
+    """
+    region = getattr(conn, 'region', None)
+    return (os.environ.get('AWS_PROFILE', 'default'),
+            getattr(region, 'name', None))
+
+
+def _live_filters(**filters):
+    """ server-side filters matching only instances that are not dead """
+    filters.update({'instance-state-name': ydata.STATUS_LIVE})
+    return filters
+
+
+def get_instance_index(conn, refresh=False):
+    """ returns { instance_name: instance } for every live instance
+        on the given connection.  the index is built from a single
+        (paginated) describe call and cached in-process afterwards
+    """
+    key = _conn_key(conn)
+    if refresh or key not in _complete_indexes:
+        index = {}
+        instances = conn.get_only_instances(
+            filters=_live_filters(),
+            max_results=INSTANCE_PAGE_SIZE)
+        for inst in instances:
+            name = inst.tags.get('Name')
+            if name:
+                index[name] = inst
+        instance_index[key] = index
+        _complete_indexes.add(key)
+    return instance_index[key]
+
+
+def invalidate_instance_index(conn, name=None):
+    """ forget cached instance lookups for the given connection.
+        when `name` is given only that entry is dropped
+    """
+    key = _conn_key(conn)
+    if name is None:
+        instance_index.pop(key, None)
+    else:
+        instance_index.get(key, {}).pop(name, None)
+    _complete_indexes.discard(key)
+
+
 def show_instances(conn=None):
     """ shows all AWS instances on the given connection """
     conn = conn or get_conn()
-    results = get_tags(None, conn).items()
-    for i, tags in results:
-        if i:
-            eprint(i)
-        for k in tags:
-            eprint('  ', k, tags[k])
+    results = sorted(get_instance_index(conn).items())
+    for name, inst in results:
+        eprint(name, inst, inst.state)
+        for k, v in sorted(inst.tags.items()):
+            eprint('  ', k, v)
     if not results:
         eprint("nothing to show")
 
 
 def get_instance_by_name(name, conn):
-    """ returns the id for the given instance """
-    for i, tags in get_tags(None, conn).items():
-        if tags.get('Name') == name and tags['status'] not in ydata.STATUS_DEAD:
-            return conn.get_only_instances([i.id])[0]
+    """ returns the live instance for the given name, or None.
+        uses the in-process index when it is available, otherwise
+        asks AWS for this name only (via `tag:Name` filter)
+    """
+    index = instance_index.setdefault(_conn_key(conn), {})
+    if name not in index and _conn_key(conn) not in _complete_indexes:
+        matches = conn.get_only_instances(
+            filters=_live_filters(**{'tag:Name': name}))
+        index[name] = matches[0] if matches else None
+    return index.get(name)
 
 
 def get_tags(instance, conn):
     """ returns { instance_id: instance_tags } """
     assert conn is not None
     if instance is None:
-        reservations = conn.get_only_instances()
+        reservations = conn.get_only_instances(
+            max_results=INSTANCE_PAGE_SIZE)
     else:
         reservations = conn.get_only_instances([instance.id])
     out = {}
     for inst in reservations:
         tags = inst.tags.copy()
-        tags.update(status=inst.update())
+        tags.update(status=inst.state)
         out[inst] = tags
     return out
 
 
+# resource ids per describe-tags filter, and per create/delete-tags call
+TAG_BATCH_SIZE = 200
+
+
+def _batches(items, size=None):
+    """ yields `items` in lists of at most `size` (TAG_BATCH_SIZE) """
+    items, size = list(items), size or TAG_BATCH_SIZE
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def get_resource_tags(conn, resource_ids):
+    """ returns { resource_id: { key: value } }, using one
+        describe-tags call for every TAG_BATCH_SIZE resources
+    """
+    out = dict((resource_id, {}) for resource_id in resource_ids)
+    for batch in _batches(sorted(out)):
+        for tag in conn.get_all_tags(filters={'resource-id': batch}):
+            out.setdefault(tag.res_id, {})[tag.name] = tag.value
+    return out
+
+
+def diff_tags(desired, current):
+    """ `desired` is { resource_id: { key: value } }, where a value
+        of None means the key should be absent.  returns the changes
+        as ( creates, deletes ), both { resource_ids: { key: value } }
+        so that each entry can be applied with one call
+    """
+    creates, deletes = {}, {}
+    for resource_id, tags in desired.items():
+        have = current.get(resource_id, {})
+        for key, value in tags.items():
+            if value is None and key in have:
+                deletes.setdefault((key, None), []).append(resource_id)
+            elif value is not None and have.get(key) != value:
+                creates.setdefault((key, value), []).append(resource_id)
+
+    def group(changes):
+        # tags which change on exactly the same resources go together
+        out = {}
+        for (key, value), resource_ids in changes.items():
+            out.setdefault(tuple(sorted(resource_ids)), {})[key] = value
+        return out
+    return group(creates), group(deletes)
+
+
+def reconcile_tags(conn, desired, dry_run=False):
+    """ brings tags on many resources in line with `desired` (see
+        `diff_tags`) using batched create/delete-tags calls.  tags
+        not mentioned in `desired` are left alone.  returns the
+        changes, as `diff_tags` does
+    """
+    current = get_resource_tags(conn, desired.keys())
+    creates, deletes = diff_tags(desired, current)
+    if not dry_run:
+        for resource_ids, tags in sorted(creates.items()):
+            for batch in _batches(resource_ids):
+                conn.create_tags(batch, tags)
+        for resource_ids, tags in sorted(deletes.items()):
+            for batch in _batches(resource_ids):
+                conn.delete_tags(batch, tags)
+    return creates, deletes
+
+
 def _block_while_pending(instance):
     """ """
     # Check up on its status every so often
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+""" ymir.util.hashing
+
+    content hashes for local files and directory trees
+"""
+import os
+import json
+import fnmatch
+import hashlib
+
+from ymir import data as ydata
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _excluded(name, excludes):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in excludes)
+
+
+def _update_with_file(digest, fname):
+    with open(fname, 'rb') as fhandle:
+        for chunk in iter(lambda: fhandle.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+
+def hash_path(path, excludes=ydata.RSYNC_EXCLUDES):
+    """ returns a hex digest for the contents of the given file, or
+        for every file (and relative filename) beneath a directory.
+        a path which does not exist hashes to None
+    """
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha1()
+    if not os.path.isdir(path):
+        _update_with_file(digest, path)
+        return digest.hexdigest()
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if not _excluded(d, excludes))
+        for fname in sorted(files):
+            if _excluded(fname, excludes):
+                continue
+            full_path = os.path.join(root, fname)
+            digest.update(os.path.relpath(full_path, path).encode('utf-8'))
+            digest.update(b'\0')
+            if os.path.isfile(full_path):
+                _update_with_file(digest, full_path)
+    return digest.hexdigest()
+
+
+def fingerprint(*parts):
+    """ returns a hex digest for any JSON-serializable parts """
+    return hashlib.sha1(
+        json.dumps(parts, sort_keys=True, default=str)).hexdigest()
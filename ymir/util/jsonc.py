@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+""" ymir.util.jsonc
+
+    fast decoding for the commented JSON used in service descriptions.
+    comments and trailing commas are stripped and single-quoted strings
+    are normalized in one pass, then the stdlib's C decoder does the real
+    work.  demjson (which is pure python and slow) is only used when
+    that fails.
+"""
+import re
+import json
+
+import demjson
+
+_TOKENS = re.compile(r'''
+    ("(?:[^"\\]|\\.)*")    # double-quoted string, kept as is
+  | ('(?:[^'\\]|\\.)*')    # single-quoted string
+  | (//[^\n]*|/\*.*?\*/)   # comment
+  | (,(?=(?:\s|//[^\n]*\n|/\*(?:[^*]|\*(?!/))*\*/)*[}\]]))  # trailing comma
+''', re.VERBOSE | re.DOTALL)
+
+
+def _normalize_token(match):
+    """ """
+    double_quoted, single_quoted, comment, comma = match.groups()
+    if double_quoted is not None:
+        return double_quoted
+    if single_quoted is not None:
+        body = single_quoted[1:-1].replace("\\'", "'").replace('"', '\\"')
+        return '"' + body + '"'
+    if comma is not None:
+        return ''
+    # keep line numbers intact for error messages
+    return '\n' * comment.count('\n')
+
+
+def normalize(text):
+    """ returns `text` without comments or trailing commas, and with
+        single-quoted strings converted to double-quoted ones
+    """
+    return _TOKENS.sub(_normalize_token, text)
+
+
+def decode(text):
+    """ decodes (possibly commented) JSON.  anything the strict parser
+        rejects is retried with demjson, so errors are still reported
+        as demjson.JSONDecodeError
+    """
+    try:
+        return json.loads(normalize(text))
+    except ValueError:
+        return demjson.decode(text)
+
+
+def decode_file(fname):
+    """ """
+    with open(fname) as fhandle:
+        return decode(fhandle.read())
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+""" ymir.util.mux
+
+    OpenSSH connection multiplexing.  every ssh subprocess ymir
+    starts for a given user@host:port (rsync, ansible, ..) shares
+    one ControlMaster connection, so the handshake is paid once.
+    masters that this process started are closed at exit, while
+    masters that were already running are left to ControlPersist.
+"""
+import os
+import atexit
+import hashlib
+import tempfile
+import subprocess
+
+# seconds an idle master connection stays open
+CONTROL_PERSIST = 600
+
+# control sockets of masters started by this process, closed at exit
+_control_paths = set()
+
+# control sockets already looked at by `use_master`
+_checked_paths = set()
+
+
+def control_dir():
+    """ private per-user directory for control sockets.  this lives
+        in the temp dir because unix socket paths are length-limited
+    """
+    path = os.path.join(
+        tempfile.gettempdir(), 'ymir-cm-{0}'.format(os.getuid()))
+    if not os.path.exists(path):
+        os.makedirs(path, 0o700)
+    return path
+
+
+def control_path(user, host, port):
+    """ returns the control socket for user@host:port """
+    key = hashlib.sha1('{0}@{1}:{2}'.format(user, host, port)).hexdigest()
+    return os.path.join(control_dir(), key[:16])
+
+
+def master_running(path):
+    """ whether a master is listening on control socket `path` """
+    if not os.path.exists(path):
+        return False
+    with open(os.devnull, 'w') as devnull:
+        # the host argument is required but is ignored by `-O check`
+        return subprocess.call(
+            ['ssh', '-o', 'ControlPath=' + path, '-O', 'check', 'ymir'],
+            stdout=devnull, stderr=devnull) == 0
+
+
+def use_master(user, host, port):
+    """ call before the first ssh/rsync/ansible connection to
+        user@host:port.  if no master is running yet, that connection
+        starts one, which then belongs to this process and is closed
+        at exit.  returns the control socket
+    """
+    path = control_path(user, host, port)
+    if path not in _checked_paths:
+        _checked_paths.add(path)
+        if not master_running(path):
+            _control_paths.add(path)
+    return path
+
+
+def mux_options(user, host, port, persist=CONTROL_PERSIST):
+    """ returns [(option, value), ..] enabling multiplexing """
+    return [
+        ('ControlMaster', 'auto'),
+        ('ControlPath', control_path(user, host, port)),
+        ('ControlPersist', str(persist)), ]
+
+
+def mux_opts(user, host, port, persist=CONTROL_PERSIST):
+    """ multiplexing options as an ssh command line fragment """
+    return ' '.join(
+        '-o {0}={1}'.format(opt, val)
+        for opt, val in mux_options(user, host, port, persist=persist))
+
+
+def mux_config(user, host, port, persist=CONTROL_PERSIST):
+    """ multiplexing options as lines for an ssh-config file """
+    return ['  {0} {1}'.format(opt, val)
+            for opt, val in mux_options(user, host, port, persist=persist)]
+
+
+def close_master(path):
+    """ asks the master behind control socket `path` to exit """
+    if not os.path.exists(path):
+        return False
+    with open(os.devnull, 'w') as devnull:
+        # the host argument is required but is ignored by `-O exit`
+        return subprocess.call(
+            ['ssh', '-o', 'ControlPath=' + path, '-O', 'exit', 'ymir'],
+            stdout=devnull, stderr=devnull) == 0
+
+
+@atexit.register
+def close_masters():
+    """ closes every master connection this process started """
+    for path in list(_control_paths):
+        close_master(path)
+        _control_paths.discard(path)
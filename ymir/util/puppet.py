@@ -2,6 +2,11 @@
 """ ymir.util.puppet
 """
 import os
+import re
+import subprocess
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
 from fabric import api
 from peak.util.imports import lazyModule
 util = lazyModule('ymir.util')
@@ -10,6 +15,25 @@ DEFAULT_FACTS = [
     'domain', 'operatingsystem', 'memoryfree'
 ]
 
+# manifests per `puppet parser validate` invocation.  puppet's startup
+# dominates the cost of validating a single file, so files are batched
+VALIDATE_BATCH_SIZE = 50
+
+# ERB templates are scanned this many bytes at a time
+ERB_CHUNK_SIZE = 64 * 1024
+
+# an ERB tag: <%= expr %>, <%- code -%>, <%# comment %>, etc.
+# "<%%" is a literal "<%" and does not open a tag
+ERB_TAG = re.compile(r'<%(?!%)([=#]?)(.*?)%>', re.DOTALL)
+
+# puppet variables inside a tag: @var, scope['var'], scope["::var"]
+# and scope.lookupvar('var').  class-qualified lookups (mod::var)
+# are not service facts, so they are ignored
+ERB_VARIABLE = re.compile(r"""
+    (?<![\w@])@([A-Za-z_]\w*)
+  | scope(?:\[|\.lookupvar\()\s*['"](?:::)?([A-Za-z_]\w*)['"]
+""", re.VERBOSE)
+
 
 def run_puppet(_fname, parser=None, debug=False,
                hiera_config=None, puppet_dir=None, facts={}):
@@ -39,3 +63,109 @@ def run_puppet(_fname, parser=None, debug=False,
                 pdir=pdir,
                 fname=_fname,
                 hiera_config=hconfig))
+
+
+def find_manifests(puppet_dir):
+    """ returns every .pp file beneath `puppet_dir`, sorted """
+    out = []
+    for root, dirs, files in os.walk(puppet_dir):
+        out += [os.path.join(root, fname)
+                for fname in files if fname.endswith('.pp')]
+    return sorted(out)
+
+
+def validate_cmd(parser=None):
+    """ the `puppet parser validate` command line, as a list """
+    return ['puppet', 'parser'] + \
+        (['--parser', parser] if parser else []) + ['validate']
+
+
+def _run(cmd):
+    """ returns (return_code, output) for a local command """
+    try:
+        proc = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError as exc:
+        # not installed, the same as a shell would report it
+        return 127, str(exc)
+    output = proc.communicate()[0]
+    return proc.returncode, output
+
+
+def local_version():
+    """ version of puppet on localhost, or None if it isn't installed """
+    code, output = _run(['puppet', '--version'])
+    return output.strip() if code == 0 else None
+
+
+def validate_files(filenames, parser=None, workers=None,
+                   batch_size=VALIDATE_BATCH_SIZE):
+    """ validates puppet manifests in batches, several batches at once.
+        a batch that fails is retried one file at a time, to find out
+        which files are bad.  returns { filename: output_or_None }
+    """
+    cmd = validate_cmd(parser)
+    batches = [filenames[i:i + batch_size]
+               for i in range(0, len(filenames), batch_size)]
+    if not batches:
+        return {}
+    pool = ThreadPool(max(1, min(
+        workers or multiprocessing.cpu_count(), len(batches))))
+    try:
+        results = pool.map(
+            lambda batch: _run(cmd + batch), batches)
+        retry = [fname for batch, (code, _) in zip(batches, results)
+                 if code != 0 for fname in batch]
+        retried = pool.map(lambda fname: _run(cmd + [fname]), retry)
+    finally:
+        pool.close()
+        pool.join()
+    out = dict.fromkeys(filenames)
+    for fname, (code, output) in zip(retry, retried):
+        if code != 0:
+            out[fname] = output.strip()
+    return out
+
+
+def scan_template(fhandle, chunk_size=ERB_CHUNK_SIZE):
+    """ returns the puppet variables used by an ERB template, in order
+        of first use.  the file is read in chunks, and only text from
+        an unclosed tag is carried over to the next chunk
+    """
+    out, buf = [], ''
+    for chunk in iter(lambda: fhandle.read(chunk_size), ''):
+        buf += chunk
+        end = 0
+        for match in ERB_TAG.finditer(buf):
+            end = match.end()
+            if match.group(1) == '#':
+                continue
+            for var in ERB_VARIABLE.findall(match.group(2)):
+                var = var[0] or var[1]
+                if var not in out:
+                    out.append(var)
+        buf = buf[end:]
+        start = buf.find('<%')
+        # keep the last character too, it might be the "<" of a tag
+        buf = buf[start:] if start >= 0 else buf[-1:]
+    return out
+
+
+def find_templates(puppet_dir):
+    """ returns every file beneath modules/*/templates, sorted """
+    out = []
+    modules = os.path.join(puppet_dir, 'modules')
+    for module in sorted(os.listdir(modules)) if os.path.isdir(modules) else []:
+        templates = os.path.join(modules, module, 'templates')
+        for root, dirs, files in os.walk(templates):
+            out += [os.path.join(root, fname) for fname in files]
+    return sorted(out)
+
+
+def template_index(template_vars):
+    """ inverts { template: [var, ..] } into { var: [template, ..] } """
+    out = {}
+    for template, variables in sorted(template_vars.items()):
+        for var in variables:
+            out.setdefault(var, []).append(template)
+    return out
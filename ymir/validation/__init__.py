@@ -3,6 +3,8 @@
 """
 import os
 import logging
+import functools
+from multiprocessing.pool import ThreadPool
 
 import voluptuous
 
@@ -10,6 +12,7 @@ from fabric import api
 from peak.util.imports import lazyModule
 
 from ymir import util
+from ymir import caching
 from ymir import checks
 from ymir.util import puppet
 from ymir.base import report as base_report
@@ -23,13 +26,19 @@ beanstalk = lazyModule('ymir.beanstalk')
 logger = logging.getLogger(__name__)
 _report = lambda msg: base_report('ymir.validation', msg)
 
+# validators are mostly waiting on AWS or on subprocesses,
+# so `validate` runs them all at once on a thread pool
+VALIDATION_WORKERS = 8
+
 
 @util.declare_validator
-def validate_puppet(service):
+def validate_puppet(service, cache=True):
     """ runs puppet parser validation on puppet files contained
         inside the given service.  NB: this checks all the puppet
         code, not just things things in the service.json `setup_list`
-        and `provision_list` fields
+        and `provision_list` fields.  results are cached by file
+        content and puppet version, so only changed files are parsed
+        again.  with `cache` false, every file is parsed
     """
     errors, warnings, messages = [], [], []
     pdir = service._puppet_dir
@@ -42,29 +51,56 @@ def validate_puppet(service):
         errors.append(msg)
     elif service._supports_puppet:
         parser = service.template_data()['puppet_parser']
-        validation_cmd = 'puppet parser {0} validate '.format(
-            '--parser {0}'.format(parser) if parser else '')
-        with api.quiet():
-            result = api.local('find {0}|grep .pp$'.format(pdir), capture=True)
-            for filename in result.split('\n'):
-                if not filename:
-                    continue
-                (" .. validating {0}".format(filename))
-                result = api.local('{1} {0}'.format(
-                    filename, validation_cmd), capture=True)
-                error = result.return_code != 0
-                if error:
-                    short_fname = filename.replace(os.getcwd(), '.')
-                    error = "running `{1} {0}'".format(
-                        short_fname, validation_cmd)
-                    errors.append(error)
-                else:
-                    messages.append(filename)
+        validation_cmd = ' '.join(puppet.validate_cmd(parser))
+        filenames = puppet.find_manifests(pdir)
+        results, hits = _cached_puppet_validation(
+            service, filenames, parser, cache=cache)
+        if hits:
+            messages.append(
+                '{0} of {1} manifests unchanged since last validated'.format(
+                    hits, len(filenames)))
+        for filename in filenames:
+            if results[filename] is not None:
+                short_fname = filename.replace(os.getcwd(), '.')
+                error = "running `{1} {0}'".format(
+                    short_fname, validation_cmd)
+                errors.append(error)
+            else:
+                messages.append(filename)
     return errors, warnings, messages
 
 
+def _cached_puppet_validation(service, filenames, parser, cache=True):
+    """ `puppet.validate_files`, but only for files which were not
+        validated before with the same content and puppet.  returns
+        the results, and how many of them came from the cache
+    """
+    version = puppet.local_version()
+    if version is None:
+        # puppet is missing, and that isn't worth remembering
+        return puppet.validate_files(filenames, parser=parser), 0
+    content_cache = caching.ContentCache(
+        service._ymir_service_root, 'puppet_validation', enabled=cache)
+    keys, results, todo = {}, {}, []
+    for fname in filenames:
+        keys[fname] = util.hashing.fingerprint(
+            'puppet parser validate', version, parser,
+            util.hashing.hash_path(fname))
+        cached = content_cache.get(keys[fname])
+        if cached is None:
+            todo.append(fname)
+        else:
+            results[fname] = cached['output']
+    hits = len(results)
+    for fname, output in puppet.validate_files(todo, parser=parser).items():
+        results[fname] = output
+        content_cache.set(keys[fname], dict(output=output))
+    content_cache.save()
+    return results, hits
+
+
 @util.declare_validator
-def validate_puppet_templates(service):
+def validate_puppet_templates(service, cache=True):
     """ validates that variables mentioned in puppet
         templates are defined in service.json
     """
@@ -75,15 +111,20 @@ def validate_puppet_templates(service):
         return errors, warnings, messages
     default_facts = puppet.DEFAULT_FACTS
 
-    service_vars = service.facts.keys()
-    service_vars += default_facts
-    for f, template_vars in service._get_puppet_template_vars().items():
-        for template_var in template_vars:
-            if template_var not in service_vars:
-                msg = ("template {0} uses variable `{1}` "
-                       "which is not defined for service").format(
-                    f, template_var)
-                errors.append(msg)
+    service_vars = set(service.facts.keys())
+    service_vars.update(default_facts)
+    content_cache = caching.ContentCache(
+        service._ymir_service_root, 'puppet_templates', enabled=cache)
+    index = service._get_puppet_template_index(cache=content_cache)
+    content_cache.save()
+    for template_var in sorted(index):
+        if template_var in service_vars:
+            continue
+        for f in index[template_var]:
+            msg = ("template {0} uses variable `{1}` "
+                   "which is not defined for service").format(
+                f, template_var)
+            errors.append(msg)
     return errors, warnings, messages
 
 
@@ -169,10 +210,15 @@ def validate_health_checks(service):
     """ """
     # here we fake the host value just for validation because we
     # don't actually know whether this service has been bootstrapped or not
-    service_json = service.template_data()
+    service_json = service.template_data().copy()
     service_json.update(host='host_name')
     service_json.update(service.facts)
     errors, warnings, messages = [], [], []
+    check_options = service_json['health_check_options']
+    for check_name in check_options:
+        if check_name not in service_json['health_checks']:
+            err = '`health_check_options` mentions unknown check "{0}"'
+            errors.append(err.format(check_name))
     for check_name in service_json['health_checks']:
         check_instruction = service_json['health_checks'][check_name]
         check_type, url = util.split_check(check_instruction)
@@ -183,6 +229,19 @@ def validate_health_checks(service):
             err = err.format(check_type)
             errors.append(err)
             continue
+        bad_options = set(check_options.get(check_name, {})) - \
+            set(getattr(checker, 'options', [])) - \
+            set(checks.SCHEDULE_OPTIONS)
+        if bad_options:
+            err = 'check "{0}" does not support options: {1}'
+            errors.append(err.format(check_name, sorted(bad_options)))
+            continue
+        interval = check_options.get(check_name, {}).get('interval')
+        if interval is not None and (
+                not isinstance(interval, (int, float)) or interval <= 0):
+            err = 'check "{0}" has bad interval: {1}'
+            errors.append(err.format(check_name, interval))
+            continue
         tmp = service_json.copy()
         tmp.update(dict(host='host'))
         try:
@@ -230,12 +289,14 @@ def print_errs(msg, validator_result, quiet=False, die=False, report=_report):
 
 
 def validate(service_json_file=None, service_json=None,
-             schema=None, simple=True, quiet=False, die=True):
+             schema=None, simple=True, quiet=False, die=True, cache=True):
     """ validate service json is 2 step.  when simple==True,
         validation exits early after running against the main
         JSON schema.  otherwise, the service will be instantiated
         and sanity-checked against real-world requirements such as
         actually existing security-groups, keyfiles, etc.
+        with `cache` false, puppet code and templates are
+        checked again even if they have not changed
     """
     report = _report  # util.NOOP if quiet else _report
     print_errs(
@@ -253,27 +314,47 @@ def validate(service_json_file=None, service_json=None,
     # quiet or report('Instantiating service to scrutinize it..')
     service = yapi.load_service_from_json(service_json_file, quiet=quiet)
     report = util.NOOP if quiet else service.report
-
-    print_errs(
-        'checking content in `health_checks` field..',
-        validate_health_checks(service),
-        report=report,)
+    steps = [('checking content in `health_checks` field..',
+              validate_health_checks)]
     if isinstance(service, yservice.AmazonService):
-        print_errs(
-            'checking AWS security groups in field `security_groups` exist..',
-            validate_security_groups(service), report=report,)
-        print_errs(
-            'checking parity of `security_groups` field and security_groups.json file..',
-            validate_security_groups_json(service), report=report,)
-        print_errs('checking AWS keypair at field `key_name`..',
-                   validate_keypairs(service), report=report,)
-    print_errs('checking puppet-librarian\'s metadata.json',
-               validate_metadata_file(service),
-               report=report)
-    print_errs('checking puppet code validates with puppet parser..',
-               validate_puppet(service), report=report,)
-    print_errs('checking puppet templates for undefined variables..',
-               validate_puppet_templates(service), report=report,)
+        steps += [
+            ('checking AWS security groups in field `security_groups` exist..',
+             validate_security_groups),
+            ('checking parity of `security_groups` field and security_groups.json file..',
+             validate_security_groups_json),
+            ('checking AWS keypair at field `key_name`..',
+             validate_keypairs), ]
+    steps += [
+        ('checking puppet-librarian\'s metadata.json',
+         validate_metadata_file),
+        ('checking puppet code validates with puppet parser..',
+         functools.partial(validate_puppet, cache=cache)),
+        ('checking puppet templates for undefined variables..',
+         functools.partial(validate_puppet_templates, cache=cache)), ]
+    results = run_validators(service, [fxn for _, fxn in steps])
+    for (msg, _), result in zip(steps, results):
+        print_errs(msg, result, report=report,)
+
+
+def run_validators(service, validators, workers=VALIDATION_WORKERS):
+    """ runs the given validators for `service` concurrently,
+        returning their results in the same order
+    """
+    # warm up shared state, instead of racing to compute it
+    service.template_data()
+    service.facts
+    pool = ThreadPool(max(1, min(workers, len(validators))))
+    try:
+        # fabric's settings are global, and validators toggle them with
+        # `api.quiet`.  nesting everything in one `api.quiet` means that
+        # concurrent validators restore each other's settings correctly
+        with api.quiet():
+            # NB: .get() without a timeout can't be interrupted with ^C
+            return pool.map_async(
+                lambda fxn: fxn(service), validators).get(60 * 60)
+    finally:
+        pool.close()
+        pool.join()
 
 
 @util.declare_validator